@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+import httpx
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from librarys2 import Library
+from openlibrary import OpenLibraryClient
+
+RETRYABLE = "error"
+
+class RateLimiter:
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def read_isbns(path: str) -> Iterator[str]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            isbn = line.strip().replace("-", "").replace(" ", "")
+            if isbn and not isbn.startswith("#"):
+                yield isbn
+
+def load_report(path: str) -> Set[str]:
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry['status'] != RETRYABLE:
+                done.add(entry['isbn'])
+    return done
+
+class BulkImporter:
+    def __init__(self, library: Library, concurrency: int = 8, rate: float = 5.0,
+                 batch_size: int = 100, report_path: Optional[str] = None):
+        self.library = library
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.batch_size = batch_size
+        self.report_path = report_path
+        self.summary: Dict[str, int] = {}
+
+    def run(self, isbns: Iterable[str]) -> Dict[str, int]:
+        done = load_report(self.report_path) if self.report_path else set()
+        self.summary = {'added': 0, 'exists': 0, 'not_found': 0, 'error': 0, 'skipped': 0}
+        results: List[Dict] = []
+        seen: Set[str] = set()
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for isbn in isbns:
+                if isbn in done or isbn in seen:
+                    self.summary['skipped'] += 1
+                    continue
+                seen.add(isbn)
+                if isbn in self.library.books:
+                    results.append(self._result(isbn, 'exists', "Already in library"))
+                else:
+                    in_flight[executor.submit(self._fetch, isbn)] = isbn
+                    if len(in_flight) >= self.concurrency * 2:
+                        self._collect(in_flight, results)
+                if len(results) >= self.batch_size:
+                    self._commit(results)
+                    results = []
+            while in_flight:
+                self._collect(in_flight, results)
+                if len(results) >= self.batch_size:
+                    self._commit(results)
+                    results = []
+        self._commit(results)
+        return self.summary
+
+    def _fetch(self, isbn: str):
+        self.limiter.wait()
+        return self.library._fetch_book_data(isbn)
+
+    def _collect(self, in_flight: Dict, results: List[Dict]) -> None:
+        finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+        for future in finished:
+            isbn = in_flight.pop(future)
+            try:
+                data = future.result()
+            except httpx.HTTPStatusError as e:
+                status = 'not_found' if e.response.status_code == 404 else 'error'
+                results.append(self._result(isbn, status, str(e)))
+                continue
+            except Exception as e:
+                results.append(self._result(isbn, 'error', str(e)))
+                continue
+            if not data:
+                results.append(self._result(isbn, 'error', "Open Library request failed"))
+                continue
+            results.append({'isbn': isbn, 'data': data})
+
+    def _commit(self, results: List[Dict]) -> None:
+        if not results:
+            return
+        with self.library.batch():
+            for result in results:
+                data = result.pop('data', None)
+                if data is None:
+                    continue
+                message = self.library.add_book(
+                    title=data.get('title', 'Unknown Title'),
+                    authors=data.get('authors', ['Unknown Author']),
+                    isbn=result['isbn']
+                )
+                status = 'added' if message.startswith("Added") else 'exists' if "already exists" in message else 'error'
+                result.update(self._result(result['isbn'], status, message))
+        for result in results:
+            self.summary[result['status']] += 1
+        if self.report_path:
+            with open(self.report_path, 'a', encoding='utf-8') as f:
+                for result in results:
+                    f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def _result(isbn: str, status: str, message: str) -> Dict:
+        return {'isbn': isbn, 'status': status, 'message': message}
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Import books from a file of ISBNs (one per line)")
+    parser.add_argument("isbn_file")
+    parser.add_argument("--library", default=os.path.join(current_dir, "library_data.json"))
+    parser.add_argument("--report", default=None, help="JSON lines report, also used to resume (default: <isbn_file>.report.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=5.0, help="Maximum Open Library lookups per second")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--cache-dir", default=os.path.join(current_dir, ".openlibrary_cache"))
+    args = parser.parse_args(argv)
+
+    lib = Library(args.library, client=OpenLibraryClient(cache_dir=args.cache_dir))
+    importer = BulkImporter(
+        lib,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        batch_size=args.batch_size,
+        report_path=args.report or args.isbn_file + ".report.jsonl"
+    )
+    try:
+        summary = importer.run(read_isbns(args.isbn_file))
+    finally:
+        lib.close()
+    print(", ".join(f"{status}: {count}" for status, count in summary.items()))
+
+if __name__ == "__main__":
+    main()
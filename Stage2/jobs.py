@@ -0,0 +1,240 @@
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from librarys2 import Library
+from metrics import metrics
+from openlibrary import UpstreamBusy
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+JOBS = metrics.counter("library_jobs_total", "Background ISBN jobs by event")
+JOB_SECONDS = metrics.histogram("library_job_seconds", "Time from submitting a background ISBN job to its outcome")
+
+class JobStore:
+    # SQLite, so queued jobs survive a restart and every worker process sees the same queue.
+    # run_after is when a queued job may start, and for a running job when its lease runs
+    # out: a job whose worker died is claimed again after `lease` seconds
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            isbn TEXT NOT NULL,
+            status TEXT NOT NULL,
+            result TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            run_after REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, run_after)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_isbn ON jobs (isbn)",
+    )
+    COLUMNS = "id, isbn, status, result, attempts, created_at, updated_at"
+
+    def __init__(self, filename: str, lease: float = 60.0):
+        self.filename = filename
+        self.lease = lease
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+
+    def submit(self, isbn: str) -> Dict:
+        # A lookup already queued or running for the ISBN is returned instead of a second one
+        now = time.time()
+        with self._transaction():
+            row = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM jobs WHERE isbn = ? AND status IN (?, ?) LIMIT 1",
+                (isbn, QUEUED, RUNNING)).fetchone()
+            if row is not None:
+                return self._job(row)
+            job_id = uuid.uuid4().hex
+            self.conn.execute(
+                "INSERT INTO jobs (id, isbn, status, attempts, created_at, updated_at, run_after) "
+                "VALUES (?, ?, ?, 0, ?, ?, ?)", (job_id, isbn, QUEUED, now, now, now))
+        JOBS.inc(event="submitted")
+        return {'id': job_id, 'isbn': isbn, 'status': QUEUED, 'result': None, 'attempts': 0,
+                'created_at': now, 'updated_at': now}
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self.conn.execute(f"SELECT {self.COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def claim(self) -> Optional[Dict]:
+        now = time.time()
+        with self._transaction():
+            row = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM jobs WHERE status IN (?, ?) AND run_after <= ? "
+                "ORDER BY run_after LIMIT 1", (QUEUED, RUNNING, now)).fetchone()
+            if row is None:
+                return None
+            job = self._job(row)
+            if job['status'] == RUNNING:
+                logger.warning("Job %s for %s outlived its lease, running it again", job['id'], job['isbn'])
+            job.update(status=RUNNING, attempts=job['attempts'] + 1, updated_at=now)
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, attempts = ?, updated_at = ?, run_after = ? WHERE id = ?",
+                (RUNNING, job['attempts'], now, now + self.lease, job['id']))
+        return job
+
+    def finish(self, job_id: str, status: str, result: str) -> None:
+        with self._transaction():
+            self.conn.execute("UPDATE jobs SET status = ?, result = ?, updated_at = ? WHERE id = ?",
+                              (status, result, time.time(), job_id))
+
+    def retry(self, job_id: str, delay: float, result: str) -> None:
+        now = time.time()
+        with self._transaction():
+            self.conn.execute("UPDATE jobs SET status = ?, result = ?, updated_at = ?, run_after = ? WHERE id = ?",
+                              (QUEUED, result, now, now + delay, job_id))
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {**{status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}, **dict(rows)}
+
+    def prune(self, older_than: float) -> int:
+        # Finished jobs are kept for a while so clients can still read their outcome
+        with self._transaction():
+            return self.conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                                     (DONE, FAILED, time.time() - older_than)).rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # IMMEDIATE takes the write lock up front, so two processes cannot claim the same job
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    @staticmethod
+    def _job(row) -> Dict:
+        return dict(zip(('id', 'isbn', 'status', 'result', 'attempts', 'created_at', 'updated_at'), row))
+
+class JobRunner:
+    # Worker threads that look up queued ISBNs through the library's Open Library client
+    # and add them. Transient failures are retried with backoff up to max_attempts
+    def __init__(self, library: Library, store: JobStore, workers: int = 4, max_attempts: int = 5,
+                 poll_interval: float = 1.0, retention: float = 7 * 86400):
+        self.library = library
+        self.store = store
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._wakeup = threading.Condition()
+        self._pruned_at = 0.0
+
+    def submit(self, isbn: str) -> Dict:
+        job = self.store.submit(isbn)
+        with self._wakeup:
+            self._wakeup.notify()
+        return job
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._threads = [threading.Thread(target=self._work, name=f"library-jobs-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        # Jobs being worked on are finished; queued ones wait in the store for the next start
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def run_once(self) -> Optional[Dict]:
+        job = self.store.claim()
+        if job is not None:
+            self._run(job)
+        return job
+
+    def _work(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = self.run_once()
+                if job is None and time.monotonic() - self._pruned_at > 3600:
+                    self._pruned_at = time.monotonic()
+                    self.store.prune(self.retention)
+            except Exception:
+                logger.exception("Background job worker failed")
+                job = None
+            if job is None:
+                # Jobs submitted by other processes or due for retry are picked up by polling
+                with self._wakeup:
+                    if not self._stopping.is_set():
+                        self._wakeup.wait(self.poll_interval)
+
+    def _run(self, job: Dict) -> None:
+        isbn = job['isbn']
+        book = self.library.find_book(isbn)
+        if book is not None and job['attempts'] > 1:
+            # An earlier attempt may have added it before its worker died
+            return self._finish(job, DONE, f"Already in library: {book.title}")
+        try:
+            data = self.library.client.fetch_book(isbn)
+        except UpstreamBusy as e:
+            return self._retry(job, e.retry_after, f"Error: {e}")
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                return self._finish(job, FAILED, "Error: Book not found via API!")
+            return self._retry(job, None, f"API Error: {e}")
+        except Exception as e:
+            logger.exception("Job %s for %s failed", job['id'], isbn)
+            return self._finish(job, FAILED, f"API Error: {e}")
+        if not data:
+            return self._retry(job, None, "Error: Open Library request failed")
+
+        message = self.library.add_book(
+            title=data.get('title', 'Unknown Title'),
+            authors=data.get('authors', ['Unknown Author']),
+            isbn=isbn
+        )
+        # Batched durability queues the change; the job only reports done once it is on disk
+        self.library.flush()
+        self._finish(job, DONE if message.startswith("Added") else FAILED, message)
+
+    def _retry(self, job: Dict, delay: Optional[float], message: str) -> None:
+        if job['attempts'] >= self.max_attempts:
+            return self._finish(job, FAILED, message)
+        if delay is None:
+            delay = min(60.0, 2.0 ** job['attempts'])
+        logger.info("Job %s for %s will be retried in %.0fs: %s", job['id'], job['isbn'], delay, message)
+        self.store.retry(job['id'], delay, message)
+        JOBS.inc(event="retried")
+
+    def _finish(self, job: Dict, status: str, message: str) -> None:
+        self.store.finish(job['id'], status, message)
+        JOBS.inc(event=status)
+        JOB_SECONDS.observe(time.time() - job['created_at'])
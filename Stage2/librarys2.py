@@ -1,44 +1,156 @@
-import json
+import asyncio
+import logging
 import os
-import httpx
-from typing import List, Dict, Optional
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+from typing import ContextManager, List, Dict, MutableMapping, Optional, Tuple, Union
+from storage import JsonStorage, SqliteBooks, SqliteStorage, make_storage
+from search import SearchIndex
+from stats import CatalogStats
+from ordering import SORT_KEYS, SortedIndex, decode_cursor, encode_cursor
+from openlibrary import AsyncOpenLibraryClient, OpenLibraryClient, UpstreamBusy
+from metrics import metrics
+from loans import DAY, Loan, LoanIndex
+
+logger = logging.getLogger(__name__)
+
+LOAD_SECONDS = metrics.histogram("library_load_seconds", "Time spent loading the catalog from storage")
+BOOKS_LOADED = metrics.counter("library_books_loaded_total", "Books found when loading the catalog")
 
 class Book:
-    def __init__(self, title: str, authors: List[str], isbn: str):
+    # __weakref__ lets the snapshot storage find books still in use across a compaction
+    __slots__ = ('title', 'authors', 'isbn', 'copies', 'available_copies', 'loans', '__weakref__')
+
+    def __init__(self, title: str, authors: List[str], isbn: str, copies: int = 1):
         self.title = title
-        self.authors = authors
+        # Author names repeat across a catalog, so share one string per name
+        self.authors = [sys.intern(author) for author in authors]
         self.isbn = isbn
-        self.available = True
+        self.copies = copies
+        self.available_copies = copies
+        # Active loans, oldest first; None until the first borrow to keep idle books small
+        self.loans: Optional[List[Loan]] = None
+
+    @property
+    def available(self) -> bool:
+        return self.available_copies > 0
+
+    @available.setter
+    def available(self, available: bool) -> None:
+        self.available_copies = self.copies if available else 0
 
     def __str__(self):
-        status = "Available" if self.available else "Borrowed"
+        if self.copies > 1:
+            status = f"{self.available_copies}/{self.copies} copies available"
+        else:
+            status = "Available" if self.available else "Borrowed"
         return f"{self.title} by {', '.join(self.authors)} (ISBN: {self.isbn}) - {status}"
 
     def to_dict(self) -> Dict:
-        return {
+        data = {
             'title': self.title,
             'authors': self.authors,
             'isbn': self.isbn,
             'available': self.available
         }
+        # Single-copy records keep the original layout
+        if self.copies != 1:
+            data['copies'] = self.copies
+            data['available_copies'] = self.available_copies
+        if self.loans:
+            data['loans'] = [loan.to_dict() for loan in self.loans]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Book':
+        book = cls(title=data['title'], authors=data['authors'], isbn=data['isbn'], copies=data.get('copies', 1))
+        if 'available_copies' in data:
+            book.available_copies = data['available_copies']
+        else:
+            book.available = data.get('available', True)
+        if data.get('loans'):
+            book.loans = [Loan.from_dict(book.isbn, loan) for loan in data['loans']]
+        return book
 
 class Library:
-    def __init__(self, filename: str = "library.json"):
+    def __init__(self, filename: str = "library.json",
+                 storage: Union[str, JsonStorage, SqliteStorage] = "json", compact_every: int = 1000,
+                 client: Optional[OpenLibraryClient] = None,
+                 async_client: Optional[AsyncOpenLibraryClient] = None,
+                 durability: str = "per_op", flush_interval_ms: int = 50, flush_ops: int = 100,
+                 loan_days: float = 14):
+        if durability not in ("per_op", "batched"):
+            raise ValueError(f"Unknown durability: {durability}")
         self.filename = os.path.abspath(filename)
-        self.books: Dict[str, Book] = {}
+        self.books: MutableMapping[str, Book] = {}
+        if isinstance(storage, str):
+            storage = make_storage(storage, self.filename, compact_every)
+        self.storage = storage
+        self._shared = getattr(storage, 'shared', False)
+        if self._shared and durability == "batched":
+            # Queued changes would be validated against state other processes may already have changed
+            raise ValueError("Batched durability cannot be used with shared storage")
+        self.client = client or OpenLibraryClient()
+        self.async_client = async_client or AsyncOpenLibraryClient()
+        self._index: Optional[SearchIndex] = None
+        self._orders: Dict[str, SortedIndex] = {}
+        self._stats: Optional[CatalogStats] = None
+        self._loans: Optional[LoanIndex] = None
+        self.loan_period = loan_days * DAY
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._isbn_locks = [threading.Lock() for _ in range(64)]
+        # SQLite applies changes to its connection right away and any commit covers all of
+        # them, so an open batch has to keep every other writer out until it commits
+        self._batch_gate = threading.RLock() if getattr(storage, 'transactional', False) else None
+        self.durability = durability
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.flush_ops = flush_ops
+        self._queue: List = []
+        self._flushing = 0
+        self._queue_cond = threading.Condition()
+        self._flusher: Optional[threading.Thread] = None
+        self._closed = False
+        # Bumped on every change to the catalog, so readers can cache per version
+        self.version = 0
         self._ensure_directory()
         self._load_books()
+        if durability == "batched":
+            self._flusher = threading.Thread(target=self._flush_loop, name="library-flusher", daemon=True)
+            self._flusher.start()
 
-    def add_book(self, title: str, authors: List[str], isbn: str) -> str:
-        if not all([title, isbn, authors]):
-            return "Error: Title, authors and ISBN are required!"
+    def add_book(self, title: str, authors: List[str], isbn: str, copies: int = 1) -> str:
+        error = self._add_error(title, authors, isbn, copies)
+        if error:
+            return error
         
-        if isbn in self.books:
-            return f"Error: ISBN {isbn} already exists!"
-            
-        self.books[isbn] = Book(title, authors, isbn)
-        self._save_books()
-        return f"Added: {title}"
+        with self._isbn_lock(isbn):
+            if isbn in self.books:
+                return f"Error: ISBN {isbn} already exists!"
+            return self._add(title, authors, isbn, copies)
+
+    def add_books(self, books: List[Dict]) -> List[str]:
+        # All or nothing: every item is validated before any is applied, and the
+        # whole batch is persisted with one write
+        isbns = [book.get('isbn') or "" for book in books]
+        with self._isbn_lock_all(isbns):
+            seen = set()
+            errors = []
+            for book, isbn in zip(books, isbns):
+                error = self._add_error(book.get('title'), book.get('authors'), isbn, book.get('copies', 1))
+                if not error and (isbn in seen or isbn in self.books):
+                    error = f"Error: ISBN {isbn} already exists!"
+                seen.add(isbn)
+                errors.append(error)
+            if any(errors):
+                return self._rejected(errors)
+            with self.batch():
+                return [self._add(book['title'], book['authors'], book['isbn'], book.get('copies', 1))
+                        for book in books]
 
     def add_book_by_isbn(self, isbn: str) -> str:
         try:
@@ -46,54 +158,260 @@ class Library:
                 return "Error: ISBN is required!"
                 
             book_data = self._fetch_book_data(isbn)
-            if not book_data:
-                return "Error: Book not found via API!"
-                
-            return self.add_book(
-                title=book_data.get('title', 'Unknown Title'),
-                authors=book_data.get('authors', ['Unknown Author']),
-                isbn=isbn
-            )
+            return self._add_fetched_book(isbn, book_data)
+        except UpstreamBusy:
+            # Not a lookup failure: the caller should back off and retry
+            raise
         except Exception as e:
             return f"API Error: {str(e)}"
 
-    def borrow_book(self, isbn: str) -> str:
-        if isbn not in self.books:
-            return "Error: Book not found!"
-            
-        if not self.books[isbn].available:
-            return "Error: Book already borrowed!"
-            
-        self.books[isbn].available = False
-        self._save_books()
-        return f"Borrowed: {self.books[isbn].title}"
+    async def add_book_by_isbn_async(self, isbn: str) -> str:
+        try:
+            if not isbn:
+                return "Error: ISBN is required!"
 
-    def return_book(self, isbn: str) -> str:
-        if isbn not in self.books:
-            return "Error: Book not found!"
-            
-        if self.books[isbn].available:
-            return "Error: Book wasn't borrowed!"
-            
-        self.books[isbn].available = True
-        self._save_books()
-        return f"Returned: {self.books[isbn].title}"
+            book_data = await self.async_client.fetch_book(isbn)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._add_fetched_book, isbn, book_data)
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            return f"API Error: {str(e)}"
+
+    def _add_fetched_book(self, isbn: str, book_data: Optional[Dict]) -> str:
+        if not book_data:
+            return "Error: Book not found via API!"
+
+        return self.add_book(
+            title=book_data.get('title', 'Unknown Title'),
+            authors=book_data.get('authors', ['Unknown Author']),
+            isbn=isbn
+        )
+
+    def borrow_book(self, isbn: str, borrower: Optional[str] = None,
+                    due_at: Optional[float] = None) -> str:
+        with self._isbn_lock(isbn):
+            book = self.books.get(isbn)
+            return self._borrow_error(book) or self._borrow(book, borrower, due_at)
+
+    def borrow_books(self, isbns: List[str], borrower: Optional[str] = None,
+                     due_at: Optional[float] = None) -> List[str]:
+        with self._isbn_lock_all(isbns):
+            books = {isbn: self.books.get(isbn) for isbn in set(isbns)}
+            taken: Dict[str, int] = {}
+            errors = []
+            for isbn in isbns:
+                errors.append(self._borrow_error(books[isbn], taken.get(isbn, 0)))
+                taken[isbn] = taken.get(isbn, 0) + 1
+            if any(errors):
+                return self._rejected(errors)
+            with self.batch():
+                return [self._borrow(books[isbn], borrower, due_at) for isbn in isbns]
+
+    def return_book(self, isbn: str, borrower: Optional[str] = None) -> str:
+        with self._isbn_lock(isbn):
+            book = self.books.get(isbn)
+            return self._return_error(book, borrower) or self._return(book, borrower)
+
+    def return_books(self, isbns: List[str], borrower: Optional[str] = None) -> List[str]:
+        with self._isbn_lock_all(isbns):
+            books = {isbn: self.books.get(isbn) for isbn in set(isbns)}
+            returned: Dict[str, int] = {}
+            errors = []
+            for isbn in isbns:
+                errors.append(self._return_error(books[isbn], borrower, returned.get(isbn, 0)))
+                returned[isbn] = returned.get(isbn, 0) + 1
+            if any(errors):
+                return self._rejected(errors)
+            with self.batch():
+                return [self._return(books[isbn], borrower) for isbn in isbns]
+
+    def set_copies(self, isbn: str, copies: int) -> str:
+        if copies < 1:
+            return "Error: A book needs at least one copy!"
+
+        with self._isbn_lock(isbn):
+            book = self.books.get(isbn)
+            if book is None:
+                return "Error: Book not found!"
+
+            borrowed = book.copies - book.available_copies
+            if copies < borrowed:
+                return f"Error: {borrowed} copies are borrowed, cannot reduce to {copies}!"
+
+            with self._lock:
+                if self._stats is not None:
+                    self._stats.set_copies(book, copies)
+                book.copies = copies
+            self._set_available_copies(book, copies - borrowed)
+            self._commit("copies", book)
+        return f"Copies updated: {book.title} ({copies})"
 
     def remove_book(self, isbn: str) -> str:
-        if isbn in self.books:
-            title = self.books[isbn].title
-            del self.books[isbn]
-            self._save_books()
-            return f"Removed: {title}"
-        return "Error: Book not found!"
+        with self._isbn_lock(isbn):
+            with self._lock:
+                book = self.books.pop(isbn, None)
+                if book is not None:
+                    self._index_remove(book)
+            if book is None:
+                return "Error: Book not found!"
+            self._commit("remove", book)
+        return f"Removed: {book.title}"
+
+    @contextmanager
+    def batch(self):
+        if getattr(self._local, 'pending', None) is not None:
+            yield
+            return
+        with self._cross_process_lock(), self._batch_exclusion():
+            self._local.pending = []
+            try:
+                yield
+            finally:
+                changes, self._local.pending = self._local.pending, None
+                if changes:
+                    with self._write_lock, self._lock:
+                        self.storage.write([(op, book.to_dict()) for op, book in changes], self.books)
+
+    def compact(self):
+        with self._cross_process_lock(), self._batch_exclusion(), self._write_lock, self._lock:
+            self.storage.compact(self.books)
+
+    def sync(self) -> int:
+        # Applies changes other processes made to shared storage and returns how many;
+        # a no-op otherwise
+        if not self._shared:
+            return 0
+        with self._lock:
+            changes = self.storage.changes()
+            if changes is None:
+                self._load_books()
+                return len(self.books)
+            for op, record in changes:
+                old = self.books.get(record['isbn'])
+                if old is not None:
+                    self._index_remove(old)
+                if op == "remove":
+                    self.books.pop(record['isbn'], None)
+                    continue
+                book = Book.from_dict(record)
+                self.books[book.isbn] = book
+                self._index_add(book)
+            if changes:
+                self.version += 1
+        return len(changes)
+
+    @property
+    def pending_writes(self) -> int:
+        return len(self._queue) + self._flushing
+
+    def flush(self):
+        with self._batch_exclusion(), self._write_lock:
+            with self._queue_cond:
+                changes, self._queue = self._queue, []
+                self._flushing = len(changes)
+            if not changes:
+                return
+            try:
+                with self._lock:
+                    self.storage.write([(op, book.to_dict()) for op, book in changes], self.books)
+            except Exception:
+                with self._queue_cond:
+                    self._queue[:0] = changes
+                raise
+            finally:
+                self._flushing = 0
+
+    def close(self):
+        if self._flusher is not None:
+            with self._queue_cond:
+                self._closed = True
+                self._queue_cond.notify()
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        self.storage.close()
+        self.client.close()
 
     def find_book(self, isbn: str) -> Optional[Book]:
+        if self._shared:
+            self.sync()
         return self.books.get(isbn)
 
+    def search(self, query: str, limit: int = 10, ranked: bool = False) -> List[Book]:
+        if self._shared:
+            self.sync()
+        with self._lock:
+            if self._index is None:
+                # On SQLite the tokens are indexed in the database, like list_page's orders
+                if isinstance(self.books, SqliteBooks):
+                    self._index = self.books.search_index()
+                else:
+                    self._index = SearchIndex(self.books.values())
+            if ranked:
+                isbns = self._index.ranked_search(query, limit)
+            else:
+                isbns = self._index.search(query, limit)
+            return [self.books[isbn] for isbn in isbns]
+
+    def page(self, skip: int = 0, limit: int = 10) -> List[Book]:
+        if self._shared:
+            self.sync()
+        with self._lock:
+            if isinstance(self.books, dict):
+                return list(islice(self.books.values(), skip, skip + limit))
+            return self.books.page(skip, limit)
+
+    def list_page(self, sort: str = "isbn", cursor: Optional[str] = None,
+                  skip: int = 0, limit: int = 10) -> Tuple[List[Book], Optional[str]]:
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort: {sort}")
+        if self._shared:
+            self.sync()
+        after = decode_cursor(sort, cursor) if cursor else None
+        with self._lock:
+            if isinstance(self.books, SqliteBooks):
+                # The database pages itself instead of every key being loaded into a SortedIndex
+                rows = self.books.sorted_page(sort, after, skip, limit + 1)
+                keys = [key for key, _ in rows]
+                books = [book for _, book in rows[:limit]]
+            else:
+                keys = self._order(sort).page(after, skip, limit)
+                books = [self.books[key[-1]] for key in keys[:limit]]
+        next_cursor = encode_cursor(sort, keys[limit - 1]) if len(keys) > limit else None
+        return books, next_cursor
+
+    def overdue_loans(self, now: Optional[float] = None, limit: int = 100) -> List[Loan]:
+        if self._shared:
+            self.sync()
+        with self._lock:
+            return self._loan_index().due_between(None, time.time() if now is None else now, limit)
+
+    def loans_due(self, within: float = DAY, now: Optional[float] = None, limit: int = 100) -> List[Loan]:
+        if self._shared:
+            self.sync()
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._loan_index().due_between(now, now + within, limit)
+
+    def stats(self, top_authors: int = 0) -> Dict:
+        if self._shared:
+            self.sync()
+        with self._lock:
+            if self._stats is None:
+                if isinstance(self.books, SqliteBooks):
+                    self._stats = self.books.catalog_stats()
+                else:
+                    self._stats = CatalogStats(self.books.values())
+            return self._stats.snapshot(top_authors)
+
     def list_books(self) -> List[str]:
-        if not self.books:
-            return ["No books in library"]
-        return [str(book) for book in self.books.values()]
+        if self._shared:
+            self.sync()
+        with self._lock:
+            if not self.books:
+                return ["No books in library"]
+            return [str(book) for book in self.books.values()]
 
     def _ensure_directory(self):
         dir_path = os.path.dirname(self.filename)
@@ -101,70 +419,225 @@ class Library:
             os.makedirs(dir_path, exist_ok=True)
 
     def _fetch_book_data(self, isbn: str) -> Optional[Dict]:
-        try:
-            response = httpx.get(
-                f"https://openlibrary.org/isbn/{isbn}.json",
-                timeout=10.0,
-                follow_redirects=True
-            )
-            response.raise_for_status()
-            data = response.json()
-
-            if 'authors' in data:
-                authors = []
-                for author in data['authors']:
-                    author_name = self._fetch_author_name(author['key'])
-                    authors.append(author_name if author_name else 'Unknown Author')
-                data['authors'] = authors
-
-            return data
-        except (httpx.RequestError, json.JSONDecodeError):
-            return None
+        return self.client.fetch_book(isbn)
 
     def _fetch_author_name(self, author_key: str) -> Optional[str]:
-        try:
-            response = httpx.get(
-                f"https://openlibrary.org{author_key}.json",
-                timeout=5.0
-            )
-            return response.json().get('name')
-        except (httpx.RequestError, json.JSONDecodeError):
-            return None
-    
+        return self.client.fetch_author_name(author_key)
+
+    def _order(self, sort: str) -> SortedIndex:
+        order = self._orders.get(sort)
+        if order is None:
+            order = self._orders[sort] = SortedIndex(SORT_KEYS[sort], self.books.values())
+        return order
+
+    def _loan_index(self) -> LoanIndex:
+        if self._loans is None:
+            self._loans = LoanIndex(self.books.values())
+        return self._loans
+
+    def _add_loan(self, book: Book, loan: Loan):
+        with self._lock:
+            book.loans = (book.loans or []) + [loan]
+            if self._loans is not None:
+                self._loans.add(loan)
+
+    def _remove_loan(self, book: Book, loan: Loan):
+        with self._lock:
+            book.loans = [other for other in book.loans if other is not loan] or None
+            if self._loans is not None:
+                self._loans.remove(loan)
+
+    def _index_add(self, book: Book):
+        if self._index is not None:
+            self._index.add(book)
+        if self._stats is not None:
+            self._stats.add(book)
+        for order in self._orders.values():
+            order.add(book)
+        if self._loans is not None:
+            for loan in book.loans or ():
+                self._loans.add(loan)
+
+    def _index_remove(self, book: Book):
+        if self._index is not None:
+            self._index.remove(book)
+        if self._stats is not None:
+            self._stats.remove(book)
+        for order in self._orders.values():
+            order.remove(book)
+        if self._loans is not None:
+            for loan in book.loans or ():
+                self._loans.remove(loan)
+
+    def _set_available_copies(self, book: Book, count: int):
+        with self._lock:
+            # The availability order only changes when the last copy goes or the first comes back
+            order = self._orders.get('availability') if book.available != (count > 0) else None
+            if order is not None:
+                order.remove(book)
+            if self._stats is not None:
+                self._stats.set_available_copies(book, count)
+            book.available_copies = count
+            if order is not None:
+                order.add(book)
+
+    def _isbn_lock(self, isbn: str) -> ContextManager:
+        if self._shared or self._batch_gate is not None:
+            return self._isbn_lock_all([isbn])
+        return self._isbn_locks[hash(isbn) % len(self._isbn_locks)]
+
+    @contextmanager
+    def _isbn_lock_all(self, isbns: List[str]):
+        # Stripes are taken in index order so two batches cannot deadlock
+        stripes = sorted({hash(isbn) % len(self._isbn_locks) for isbn in isbns})
+        with self._cross_process_lock(), self._batch_exclusion():
+            for i, stripe in enumerate(stripes):
+                try:
+                    self._isbn_locks[stripe].acquire()
+                except BaseException:
+                    for taken in stripes[:i]:
+                        self._isbn_locks[taken].release()
+                    raise
+            try:
+                yield
+            finally:
+                for stripe in reversed(stripes):
+                    self._isbn_locks[stripe].release()
+
+    @contextmanager
+    def _cross_process_lock(self):
+        # With shared storage every change holds the file lock, taken before any
+        # other lock, and starts from the latest state of the catalog
+        if not self._shared:
+            yield
+            return
+        with self.storage.lock:
+            self.sync()
+            yield
+
+    @staticmethod
+    def _add_error(title: str, authors: List[str], isbn: str, copies: int) -> Optional[str]:
+        if not all([title, isbn, authors]):
+            return "Error: Title, authors and ISBN are required!"
+        if copies < 1:
+            return "Error: A book needs at least one copy!"
+        return None
+
+    @staticmethod
+    def _borrow_error(book: Optional[Book], taken: int = 0) -> Optional[str]:
+        if book is None:
+            return "Error: Book not found!"
+        if book.available_copies - taken <= 0:
+            if book.copies > 1:
+                return f"Error: All {book.copies} copies already borrowed!"
+            return "Error: Book already borrowed!"
+        return None
+
+    @staticmethod
+    def _return_error(book: Optional[Book], borrower: Optional[str], returned: int = 0) -> Optional[str]:
+        if book is None:
+            return "Error: Book not found!"
+        if book.copies - book.available_copies - returned <= 0:
+            return "Error: Book wasn't borrowed!"
+        if borrower is not None and sum(loan.borrower == borrower for loan in book.loans or ()) - returned <= 0:
+            return f"Error: Book wasn't borrowed by {borrower}!"
+        return None
+
+    @staticmethod
+    def _rejected(errors: List[Optional[str]]) -> List[str]:
+        return [error or "Error: Not applied, another item in the batch failed!" for error in errors]
+
+    # The helpers below apply a validated change; callers hold the ISBN lock
+
+    @contextmanager
+    def _batch_exclusion(self):
+        # Taken before the ISBN stripes, so a batch holding it can still lock its own books
+        if self._batch_gate is None:
+            yield
+            return
+        with self._batch_gate:
+            yield
+
+    def _add(self, title: str, authors: List[str], isbn: str, copies: int) -> str:
+        book = Book(title, authors, isbn, copies)
+        with self._lock:
+            self.books[isbn] = book
+            self._index_add(book)
+        self._commit("add", book)
+        return f"Added: {title}"
+
+    def _borrow(self, book: Book, borrower: Optional[str], due_at: Optional[float]) -> str:
+        now = time.time()
+        loan = Loan(book.isbn, borrower, now, due_at if due_at is not None else now + self.loan_period)
+        self._set_available_copies(book, book.available_copies - 1)
+        self._add_loan(book, loan)
+        self._commit("borrow", book)
+        return f"Borrowed: {book.title}"
+
+    def _return(self, book: Book, borrower: Optional[str]) -> str:
+        loans = [loan for loan in book.loans or () if borrower is None or loan.borrower == borrower]
+        self._set_available_copies(book, book.available_copies + 1)
+        # Copies borrowed before loans were recorded have no loan to close
+        if loans:
+            self._remove_loan(book, loans[0])
+        self._commit("return", book)
+        return f"Returned: {book.title}"
+
+    def _commit(self, op: str, book: Book):
+        # Callers hold the ISBN lock; the record is taken under the write lock
+        # so the last record written for a book always carries its latest state
+        with self._lock:
+            self.version += 1
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            self.storage.stage([(op, book.to_dict())])
+            pending.append((op, book))
+            return
+        if self.durability == "batched":
+            self.storage.stage([(op, book.to_dict())])
+            with self._queue_cond:
+                self._queue.append((op, book))
+                if len(self._queue) >= self.flush_ops:
+                    self._queue_cond.notify()
+            return
+        with self._write_lock, self._lock:
+            self.storage.write([(op, book.to_dict())], self.books)
+
+    def _flush_loop(self):
+        while True:
+            with self._queue_cond:
+                if not self._closed and len(self._queue) < self.flush_ops:
+                    self._queue_cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Background flush failed")
+
     def _save_books(self):
-        try:
-            print(f"Saving: {self.filename}")
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                data = [book.to_dict() for book in self.books.values()]
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            print(f"{len(data)} books saved successfully")
-            print("File exists?:", os.path.exists(self.filename))
-            print("Absolute file path:", os.path.abspath(self.filename))
-        except Exception as e:
-            print(f"Save error: {str(e)}")
-            raise RuntimeError(f"Failed to save file: {self.filename}")
+        with self._cross_process_lock(), self._batch_exclusion(), self._write_lock, self._lock:
+            self.storage.save(self.books)
 
     def _load_books(self):
-        if os.path.exists(self.filename):
-            print(f"Loading: {self.filename}")
+        with self._lock:
+            self.version += 1
+            started = time.perf_counter()
             try:
-                with open(self.filename, 'r', encoding='utf-8') as f:
-                    books_data = json.load(f)
-                    self.books = {
-                        book['isbn']: Book(
-                            title=book['title'],
-                            authors=book['authors'],
-                            isbn=book['isbn']
-                        )
-                        for book in books_data
-                    }
-                    
-                    for isbn, book_data in zip(self.books.keys(), books_data):
-                        self.books[isbn].available = book_data.get('available', True)
-                print(f"{len(self.books)} books loaded")
-            except Exception as e:
-                print(f"Loading error: {str(e)}")
+                self._index = None
+                self._orders = {}
+                self._loans = None
+                self.books = self.storage.load_books(Book.from_dict)
+                if isinstance(self.books, dict):
+                    self._stats = CatalogStats(self.books.values())
+                else:
+                    self._stats = None
+            except Exception:
+                logger.exception("Failed to load %s", self.filename)
                 self.books = {}
-        else:
-            print("File not found, creating new library")
-            self.books = {}
\ No newline at end of file
+                self._stats = None
+            kind = getattr(self.storage, 'kind', type(self.storage).__name__)
+            LOAD_SECONDS.observe(time.perf_counter() - started, storage=kind)
+            count = len(self.books)
+            BOOKS_LOADED.inc(count, storage=kind)
+            logger.info("%d books loaded from %s", count, self.filename)
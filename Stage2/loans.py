@@ -0,0 +1,60 @@
+import uuid
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DAY = 24 * 3600
+
+class Loan:
+    __slots__ = ('id', 'isbn', 'borrower', 'borrowed_at', 'due_at')
+
+    def __init__(self, isbn: str, borrower: Optional[str], borrowed_at: float, due_at: float,
+                 id: Optional[str] = None):
+        self.id = id or uuid.uuid4().hex
+        self.isbn = isbn
+        self.borrower = borrower
+        self.borrowed_at = borrowed_at
+        self.due_at = due_at
+
+    def key(self) -> Tuple[float, str]:
+        return (self.due_at, self.id)
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'borrower': self.borrower,
+            'borrowed_at': self.borrowed_at,
+            'due_at': self.due_at
+        }
+
+    @classmethod
+    def from_dict(cls, isbn: str, data: Dict) -> 'Loan':
+        return cls(isbn, data.get('borrower'), data['borrowed_at'], data['due_at'], data['id'])
+
+class LoanIndex:
+    # Active loans ordered by due date, so due/overdue queries cost a bisect plus the results
+    def __init__(self, books: Iterable = ()):
+        self.loans: Dict[str, Loan] = {}
+        for book in books:
+            for loan in book.loans or ():
+                self.loans[loan.id] = loan
+        self.keys: List[Tuple[float, str]] = sorted(loan.key() for loan in self.loans.values())
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, loan: Loan) -> None:
+        self.loans[loan.id] = loan
+        insort(self.keys, loan.key())
+
+    def remove(self, loan: Loan) -> None:
+        if self.loans.pop(loan.id, None) is None:
+            return
+        key = loan.key()
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+
+    def due_between(self, start: Optional[float], end: float, limit: int) -> List[Loan]:
+        i = bisect_left(self.keys, (start,)) if start is not None else 0
+        j = min(bisect_left(self.keys, (end,)), i + limit)
+        return [self.loans[loan_id] for _, loan_id in self.keys[i:j]]
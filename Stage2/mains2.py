@@ -6,6 +6,7 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 
 from librarys2 import Library
+from openlibrary import OpenLibraryClient
 
 def display_menu():
     print("\n==== LIBRARY MANAGEMENT SYSTEM ====")
@@ -37,7 +38,8 @@ def clear_screen():
 
 def main():
     json_file = os.path.join(os.path.dirname(__file__), "library_data.json")
-    lib = Library(json_file)
+    cache_dir = os.path.join(os.path.dirname(__file__), ".openlibrary_cache")
+    lib = Library(json_file, client=OpenLibraryClient(cache_dir=cache_dir))
     
     while True:
         clear_screen()
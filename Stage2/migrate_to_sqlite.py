@@ -0,0 +1,45 @@
+import argparse
+import os
+import sys
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from storage import JournalStorage, SqliteStorage
+
+def chunks(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+def migrate(json_file: str, db_file: str, batch_size: int = 1000) -> int:
+    # Streams the JSON snapshot and then a pending .journal next to it, so only
+    # one chunk of records is in memory at a time
+    source = JournalStorage(json_file)
+    storage = SqliteStorage(db_file)
+    try:
+        for chunk in chunks(source.load_snapshot(), batch_size):
+            storage.upsert_many(chunk)
+        for chunk in chunks(source.journal_entries(), batch_size):
+            storage.apply(chunk)
+        return storage.query_one("SELECT COUNT(*) FROM books")[0]
+    finally:
+        storage.close()
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Copy a library_data.json catalog into a SQLite database")
+    parser.add_argument("json_file")
+    parser.add_argument("db_file")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    count = migrate(args.json_file, args.db_file, args.batch_size)
+    print(f"{count} books migrated to {args.db_file}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,567 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from lru import LRUCache
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+OPEN_LIBRARY_URL = "https://openlibrary.org"
+
+REQUEST_SECONDS = metrics.histogram("library_openlibrary_request_seconds", "Open Library HTTP request latency")
+CACHE_HITS = metrics.counter("library_openlibrary_cache_hits_total", "Open Library lookups served from the disk cache")
+LOCAL_HITS = metrics.counter("library_openlibrary_local_hits_total", "ISBN lookups served from the local dump store")
+COALESCED = metrics.counter("library_openlibrary_coalesced_total", "Lookups that joined an identical one already in flight")
+REJECTED = metrics.counter("library_openlibrary_rejected_total", "Open Library calls refused instead of queueing")
+NEGATIVE_HITS = metrics.counter("library_openlibrary_negative_hits_total", "Lookups answered from the not-found cache")
+STALE_HITS = metrics.counter("library_openlibrary_stale_hits_total", "Expired cache entries served while the circuit is open")
+CIRCUIT_TRANSITIONS = metrics.counter("library_openlibrary_circuit_transitions_total", "Circuit breaker state changes")
+
+class UpstreamBusy(Exception):
+    # Raised instead of waiting on Open Library; status is what an HTTP caller should answer with
+    def __init__(self, message: str, status: int = 503, retry_after: float = 1.0):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        return max(1.0, float(response.headers.get("Retry-After", "1")))
+    except ValueError:
+        return 1.0
+
+def _observe_request(resource: str, started: float, response: Optional[httpx.Response]) -> None:
+    status = str(response.status_code) if response is not None else "error"
+    REQUEST_SECONDS.observe(time.perf_counter() - started, resource=resource, status=status)
+
+def _local_book(metadata: Optional['MetadataStore'], isbn: str) -> Optional[Dict]:
+    if metadata is None:
+        return None
+    data = metadata.get(isbn)
+    if data is not None:
+        LOCAL_HITS.inc()
+    return data
+
+class CircuitBreaker:
+    # Closed: calls go through. After failure_threshold failures in a row it opens and calls
+    # fail fast; after reset_timeout seconds one probe goes through (half open), and its
+    # outcome closes the circuit again or reopens it
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, healthy: Optional[bool]) -> None:
+        # None: the call ended without saying anything about upstream, e.g. it never went out
+        with self._lock:
+            self._probing = False
+            if healthy is None:
+                return
+            if healthy:
+                self.failures = 0
+                if self.state != self.CLOSED:
+                    self._set_state(self.CLOSED)
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(1.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            snapshot = {'state': self.state, 'consecutive_failures': self.failures}
+            if self.state == self.OPEN:
+                snapshot['retry_in'] = round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 1)
+            return snapshot
+
+    def _set_state(self, state: str) -> None:
+        if state == self.OPEN:
+            logger.warning("Open Library circuit opened after %d failures", self.failures)
+        elif state == self.CLOSED:
+            logger.info("Open Library circuit closed")
+        self.state = state
+        CIRCUIT_TRANSITIONS.inc(state=state)
+
+class NegativeCache:
+    # Keys Open Library answered 404 for, remembered for ttl seconds
+    def __init__(self, ttl: float = 3600, maxsize: int = 10_000):
+        self.ttl = ttl
+        self._expiry = LRUCache(maxsize)
+
+    def add(self, key: str) -> None:
+        self._expiry.set(key, time.monotonic() + self.ttl)
+
+    def __contains__(self, key: str) -> bool:
+        expiry = self._expiry.get(key)
+        return expiry is not None and expiry > time.monotonic()
+
+def _cached(cache: Optional['DiskCache'], missing: NegativeCache, cache_key: str, url: str) -> Optional[Dict]:
+    resource = cache_key.split(":", 1)[0]
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            CACHE_HITS.inc(resource=resource)
+            return cached
+    if cache_key in missing:
+        NEGATIVE_HITS.inc(resource=resource)
+        # The same error a live 404 raises
+        httpx.Response(404, request=httpx.Request("GET", url)).raise_for_status()
+    return None
+
+def _circuit_open(cache: Optional['DiskCache'], breaker: CircuitBreaker, cache_key: str) -> Dict:
+    stale = cache.get(cache_key, stale=True) if cache is not None else None
+    if stale is not None:
+        STALE_HITS.inc(resource=cache_key.split(":", 1)[0])
+        return stale
+    REJECTED.inc(reason="circuit_open")
+    raise UpstreamBusy("Open Library is unavailable", 503, breaker.retry_after())
+
+def _response_json(response: httpx.Response, cache: Optional['DiskCache'], missing: NegativeCache,
+                   cache_key: str) -> Dict:
+    if response.status_code == 429:
+        REJECTED.inc(reason="upstream_rate_limit")
+        raise UpstreamBusy("Open Library rate limit reached", 429, _retry_after(response))
+    if response.status_code == 404:
+        missing.add(cache_key)
+    response.raise_for_status()
+    data = response.json()
+    if cache is not None:
+        cache.set(cache_key, data)
+    return data
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution, its result and its exception
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, key: str, function: Callable, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            COALESCED.inc(resource=key.split(":", 1)[0])
+            return future.result()
+        try:
+            result = function(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, function: Callable, *args):
+        task = self._calls.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            COALESCED.inc(resource=key.split(":", 1)[0])
+        else:
+            # A task of its own, so a cancelled caller does not cancel the others
+            task = self._calls[key] = asyncio.ensure_future(function(*args))
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Marks the exception retrieved when every caller has gone away
+            task.exception()
+
+class Admission:
+    # At most `limit` upstream calls at once and `max_pending` more waiting up to `timeout`
+    # seconds; anything beyond that fails fast rather than tying up a worker
+    def __init__(self, limit: int, max_pending: int, timeout: float):
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(limit)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._pending >= self.max_pending:
+                    REJECTED.inc(reason="queue_full")
+                    raise UpstreamBusy("Too many Open Library requests queued")
+                self._pending += 1
+            try:
+                acquired = self._slots.acquire(timeout=self.timeout)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+            if not acquired:
+                REJECTED.inc(reason="queue_timeout")
+                raise UpstreamBusy("Timed out waiting for an Open Library slot")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+class AsyncAdmission:
+    def __init__(self, limit: int, max_pending: int, timeout: float):
+        self.limit = limit
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pending = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop = None
+
+    @asynccontextmanager
+    async def slot(self):
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._loop is not loop:
+            self._slots = asyncio.Semaphore(self.limit)
+            self._loop = loop
+        slots = self._slots
+        if slots.locked():
+            if self._pending >= self.max_pending:
+                REJECTED.inc(reason="queue_full")
+                raise UpstreamBusy("Too many Open Library requests queued")
+            self._pending += 1
+            try:
+                await asyncio.wait_for(slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                REJECTED.inc(reason="queue_timeout")
+                raise UpstreamBusy("Timed out waiting for an Open Library slot")
+            finally:
+                self._pending -= 1
+        else:
+            await slots.acquire()
+        try:
+            yield
+        finally:
+            slots.release()
+
+class DiskCache:
+    def __init__(self, directory: str, ttl: float = 7 * 24 * 3600):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, key: str, stale: bool = False) -> Optional[Dict]:
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not stale and time.time() - entry['stored_at'] > self.ttl:
+            return None
+        return entry['value']
+
+    def set(self, key: str, value: Dict) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'stored_at': time.time(), 'value': value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+def normalize_isbn(isbn: str) -> str:
+    return isbn.replace("-", "").replace(" ", "").upper()
+
+class MetadataStore:
+    # ISBN -> edition metadata imported from the Open Library dumps (see openlibrary_dump.py).
+    # Editions keep their author keys and names are joined on lookup, so the editions and
+    # authors dumps can be imported in either order.
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS editions (isbn TEXT PRIMARY KEY, data TEXT NOT NULL) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS authors (key TEXT PRIMARY KEY, name TEXT NOT NULL) WITHOUT ROWID",
+    )
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        with self.conn:
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+
+    def get(self, isbn: str) -> Optional[Dict]:
+        with self._lock:
+            row = self.conn.execute("SELECT data FROM editions WHERE isbn = ?", (normalize_isbn(isbn),)).fetchone()
+            if row is None:
+                return None
+            data = json.loads(row[0])
+            keys = data.pop('author_keys', None)
+            if keys:
+                names = dict(self.conn.execute(
+                    f"SELECT key, name FROM authors WHERE key IN ({', '.join('?' * len(keys))})", keys))
+        if keys:
+            data['authors'] = [names.get(key, 'Unknown Author') for key in keys]
+        return data
+
+    def add_editions(self, rows: List[Tuple[str, str]]) -> None:
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO editions (isbn, data) VALUES (?, ?)", rows)
+
+    def add_authors(self, rows: List[Tuple[str, str]]) -> None:
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO authors (key, name) VALUES (?, ?)", rows)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    for table in ("editions", "authors")}
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+class OpenLibraryClient:
+    def __init__(self, base_url: str = OPEN_LIBRARY_URL, cache_dir: Optional[str] = None,
+                 ttl: float = 7 * 24 * 3600, max_connections: int = 20, max_workers: int = 8,
+                 timeout: float = 10.0, author_timeout: float = 5.0,
+                 transport: Optional[httpx.BaseTransport] = None,
+                 metadata: Optional[MetadataStore] = None,
+                 max_pending: int = 100, queue_timeout: float = 5.0,
+                 negative_ttl: float = 3600, breaker: Optional[CircuitBreaker] = None):
+        self.base_url = base_url
+        self.cache = DiskCache(cache_dir, ttl) if cache_dir else None
+        self.missing = NegativeCache(negative_ttl)
+        self.breaker = breaker or CircuitBreaker()
+        self.metadata = metadata
+        self.max_connections = max_connections
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.author_timeout = author_timeout
+        self.transport = transport
+        # Connections are the concurrency limit; callers beyond it queue, up to max_pending
+        self.admission = Admission(max_connections, max_pending, queue_timeout)
+        self._flights = SingleFlight()
+        self._client: Optional[httpx.Client] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(
+                        base_url=self.base_url,
+                        timeout=self.timeout,
+                        follow_redirects=True,
+                        limits=httpx.Limits(max_connections=self.max_connections,
+                                            max_keepalive_connections=self.max_connections),
+                        transport=self.transport
+                    )
+        return self._client
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix="openlibrary")
+        return self._executor
+
+    def fetch_book(self, isbn: str) -> Optional[Dict]:
+        local = _local_book(self.metadata, isbn)
+        if local is not None:
+            return local
+        return self._flights.do(f"isbn:{isbn}", self._fetch_book, isbn)
+
+    def _fetch_book(self, isbn: str) -> Optional[Dict]:
+        try:
+            data = self._get_json(f"isbn:{isbn}", f"/isbn/{isbn}.json", self.timeout)
+        except (httpx.RequestError, json.JSONDecodeError) as e:
+            logger.warning("Open Library lookup for %s failed: %s", isbn, e)
+            return None
+
+        if 'authors' in data:
+            names = self.fetch_author_names([author['key'] for author in data['authors']])
+            data['authors'] = [name if name else 'Unknown Author' for name in names]
+        return data
+
+    def fetch_author_names(self, author_keys: List[str]) -> List[Optional[str]]:
+        if len(author_keys) <= 1:
+            return [self.fetch_author_name(key) for key in author_keys]
+        return list(self.executor.map(self.fetch_author_name, author_keys))
+
+    def fetch_author_name(self, author_key: str) -> Optional[str]:
+        return self._flights.do(f"author:{author_key}", self._fetch_author_name, author_key)
+
+    def _fetch_author_name(self, author_key: str) -> Optional[str]:
+        try:
+            data = self._get_json(f"author:{author_key}", f"{author_key}.json", self.author_timeout)
+            return data.get('name')
+        except (httpx.HTTPError, json.JSONDecodeError):
+            return None
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _get_json(self, cache_key: str, path: str, timeout: float) -> Dict:
+        cached = _cached(self.cache, self.missing, cache_key, self.base_url + path)
+        if cached is not None:
+            return cached
+        if not self.breaker.allow():
+            return _circuit_open(self.cache, self.breaker, cache_key)
+        healthy = None
+        try:
+            with self.admission.slot():
+                started, response = time.perf_counter(), None
+                try:
+                    response = self.client.get(path, timeout=timeout)
+                finally:
+                    _observe_request(cache_key.split(":", 1)[0], started, response)
+            healthy = response.status_code < 500
+        except httpx.RequestError:
+            healthy = False
+            raise
+        finally:
+            self.breaker.record(healthy)
+        return _response_json(response, self.cache, self.missing, cache_key)
+
+class AsyncOpenLibraryClient:
+    def __init__(self, base_url: str = OPEN_LIBRARY_URL, cache_dir: Optional[str] = None,
+                 ttl: float = 7 * 24 * 3600, max_connections: int = 20,
+                 timeout: float = 10.0, author_timeout: float = 5.0,
+                 transport: Optional[httpx.AsyncBaseTransport] = None,
+                 metadata: Optional[MetadataStore] = None,
+                 max_pending: int = 100, queue_timeout: float = 5.0,
+                 negative_ttl: float = 3600, breaker: Optional[CircuitBreaker] = None):
+        self.base_url = base_url
+        self.cache = DiskCache(cache_dir, ttl) if cache_dir else None
+        self.missing = NegativeCache(negative_ttl)
+        self.breaker = breaker or CircuitBreaker()
+        self.metadata = metadata
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.author_timeout = author_timeout
+        self.transport = transport
+        self.admission = AsyncAdmission(max_connections, max_pending, queue_timeout)
+        self._flights = AsyncSingleFlight()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Pooled connections belong to the event loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                transport=self.transport
+            )
+            self._loop = loop
+        return self._client
+
+    async def fetch_book(self, isbn: str) -> Optional[Dict]:
+        if self.metadata is not None:
+            # A SQLite query, so it runs in a thread rather than on the event loop
+            local = await asyncio.to_thread(_local_book, self.metadata, isbn)
+            if local is not None:
+                return local
+        return await self._flights.do(f"isbn:{isbn}", self._fetch_book, isbn)
+
+    async def _fetch_book(self, isbn: str) -> Optional[Dict]:
+        try:
+            data = await self._get_json(f"isbn:{isbn}", f"/isbn/{isbn}.json", self.timeout)
+        except (httpx.RequestError, json.JSONDecodeError) as e:
+            logger.warning("Open Library lookup for %s failed: %s", isbn, e)
+            return None
+
+        if 'authors' in data:
+            names = await asyncio.gather(*(self.fetch_author_name(author['key']) for author in data['authors']))
+            data['authors'] = [name if name else 'Unknown Author' for name in names]
+        return data
+
+    async def fetch_author_name(self, author_key: str) -> Optional[str]:
+        return await self._flights.do(f"author:{author_key}", self._fetch_author_name, author_key)
+
+    async def _fetch_author_name(self, author_key: str) -> Optional[str]:
+        try:
+            data = await self._get_json(f"author:{author_key}", f"{author_key}.json", self.author_timeout)
+            return data.get('name')
+        except (httpx.HTTPError, json.JSONDecodeError):
+            return None
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _get_json(self, cache_key: str, path: str, timeout: float) -> Dict:
+        cached = await self._off_loop(_cached, self.cache, self.missing, cache_key, self.base_url + path)
+        if cached is not None:
+            return cached
+        if not self.breaker.allow():
+            return await self._off_loop(_circuit_open, self.cache, self.breaker, cache_key)
+        healthy = None
+        try:
+            async with self.admission.slot():
+                started, response = time.perf_counter(), None
+                try:
+                    response = await self.client.get(path, timeout=timeout)
+                finally:
+                    _observe_request(cache_key.split(":", 1)[0], started, response)
+            healthy = response.status_code < 500
+        except httpx.RequestError:
+            healthy = False
+            raise
+        finally:
+            self.breaker.record(healthy)
+        return await self._off_loop(_response_json, response, self.cache, self.missing, cache_key)
+
+    async def _off_loop(self, function: Callable, *args):
+        # The disk cache reads and replaces files, which must not stall the event loop
+        if self.cache is None:
+            return function(*args)
+        return await asyncio.to_thread(function, *args)
@@ -0,0 +1,99 @@
+import argparse
+import gzip
+import json
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from openlibrary import MetadataStore, normalize_isbn
+
+# Dump lines are tab separated: type, key, revision, last_modified, JSON record
+# https://openlibrary.org/developers/dumps
+
+def parse_line(line: str) -> Optional[Tuple[str, str, Dict]]:
+    parts = line.rstrip("\n").split("\t", 4)
+    if len(parts) != 5:
+        return None
+    try:
+        record = json.loads(parts[4])
+    except ValueError:
+        return None
+    return parts[0], parts[1], record
+
+def edition_isbns(record: Dict) -> List[str]:
+    isbns = [normalize_isbn(isbn) for isbn in record.get('isbn_13', []) + record.get('isbn_10', [])]
+    return list(dict.fromkeys(isbn for isbn in isbns if isbn))
+
+def edition_metadata(key: str, record: Dict) -> Dict:
+    # The shape fetch_book returns, with author keys still to be joined to names
+    data = {'key': key, 'title': record.get('title', 'Unknown Title')}
+    for field in ('subtitle', 'publishers', 'publish_date', 'number_of_pages'):
+        if field in record:
+            data[field] = record[field]
+    keys = [author['key'] for author in record.get('authors', []) if isinstance(author, dict) and 'key' in author]
+    if keys:
+        data['author_keys'] = keys
+    return data
+
+def import_dump(path: str, store: MetadataStore, batch_size: int = 10_000) -> Dict[str, int]:
+    # Streams an editions, authors or combined dump (gzipped or plain); other record
+    # types such as works and redirects are passed over
+    counts = {'editions': 0, 'isbns': 0, 'authors': 0, 'skipped': 0}
+    editions: List[Tuple[str, str]] = []
+    authors: List[Tuple[str, str]] = []
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            entry = parse_line(line)
+            if entry is None:
+                counts['skipped'] += 1
+                continue
+            kind, key, record = entry
+            if kind == "/type/edition":
+                isbns = edition_isbns(record)
+                if not isbns:
+                    continue
+                data = json.dumps(edition_metadata(key, record), ensure_ascii=False, separators=(',', ':'))
+                editions.extend((isbn, data) for isbn in isbns)
+                counts['editions'] += 1
+                counts['isbns'] += len(isbns)
+                if len(editions) >= batch_size:
+                    store.add_editions(editions)
+                    editions = []
+            elif kind == "/type/author" and record.get('name'):
+                authors.append((key, record['name']))
+                counts['authors'] += 1
+                if len(authors) >= batch_size:
+                    store.add_authors(authors)
+                    authors = []
+    if editions:
+        store.add_editions(editions)
+    if authors:
+        store.add_authors(authors)
+    return counts
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build a local ISBN metadata store from Open Library dumps")
+    parser.add_argument("db_file")
+    parser.add_argument("dumps", nargs="+", help="ol_dump_editions/ol_dump_authors files, .txt or .txt.gz")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    store = MetadataStore(args.db_file)
+    # The store can be rebuilt from the dumps, so a crash mid-import only costs a rerun
+    store.conn.execute("PRAGMA synchronous=OFF")
+    try:
+        for path in args.dumps:
+            counts = import_dump(path, store, args.batch_size)
+            print(f"{path}: {counts['editions']} editions ({counts['isbns']} ISBNs), "
+                  f"{counts['authors']} authors, {counts['skipped']} malformed lines skipped")
+        totals = store.counts()
+    finally:
+        store.close()
+    print(f"{args.db_file}: {totals['editions']} ISBNs, {totals['authors']} authors")
+
+if __name__ == "__main__":
+    main()
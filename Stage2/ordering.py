@@ -0,0 +1,95 @@
+import base64
+import json
+from bisect import bisect_left, bisect_right, insort
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from search import normalize
+
+SORT_KEYS: Dict[str, Callable] = {
+    'isbn': lambda book: (book.isbn,),
+    'title': lambda book: (normalize(book.title), book.isbn),
+    'author': lambda book: (normalize(book.authors[0]) if book.authors else "", book.isbn),
+    'availability': lambda book: (0 if book.available else 1, normalize(book.title), book.isbn),
+}
+
+class SortedIndex:
+    # Keys are kept in sorted blocks of up to 2 * BLOCK keys, with `maxes` holding each
+    # block's last key. An insert or delete shifts one block rather than the whole
+    # list, so bulk imports into a sorted catalog stay linear
+    BLOCK = 512
+
+    def __init__(self, key: Callable, books: Iterable = ()):
+        self.key = key
+        keys = sorted(key(book) for book in books)
+        self.blocks: List[List[Tuple]] = [keys[i:i + self.BLOCK] for i in range(0, len(keys), self.BLOCK)]
+        self.maxes: List[Tuple] = [block[-1] for block in self.blocks]
+
+    def add(self, book) -> None:
+        key = self.key(book)
+        if not self.blocks:
+            self.blocks.append([key])
+            self.maxes.append(key)
+            return
+        i = min(bisect_left(self.maxes, key), len(self.maxes) - 1)
+        block = self.blocks[i]
+        insort(block, key)
+        self.maxes[i] = block[-1]
+        if len(block) > 2 * self.BLOCK:
+            self.blocks[i:i + 1] = [block[:self.BLOCK], block[self.BLOCK:]]
+            self.maxes[i:i + 1] = [block[self.BLOCK - 1], block[-1]]
+
+    def remove(self, book) -> None:
+        key = self.key(book)
+        i = bisect_left(self.maxes, key)
+        if i == len(self.maxes):
+            return
+        block = self.blocks[i]
+        j = bisect_left(block, key)
+        if block[j] != key:
+            return
+        del block[j]
+        if not block:
+            del self.blocks[i], self.maxes[i]
+        elif j == len(block):
+            self.maxes[i] = block[-1]
+
+    def page(self, after: Optional[Tuple] = None, skip: int = 0, limit: int = 10) -> List[Tuple]:
+        # Up to limit + 1 keys, so the caller can tell whether another page follows
+        i = bisect_right(self.maxes, after) if after is not None else 0
+        j = bisect_right(self.blocks[i], after) if after is not None and i < len(self.blocks) else 0
+        j += skip
+        while i < len(self.blocks) and j >= len(self.blocks[i]):
+            j -= len(self.blocks[i])
+            i += 1
+        keys: List[Tuple] = []
+        while i < len(self.blocks) and len(keys) <= limit:
+            keys.extend(self.blocks[i][j:j + limit + 1 - len(keys)])
+            i, j = i + 1, 0
+        return keys
+
+def encode_cursor(sort: str, key: Tuple) -> str:
+    raw = json.dumps([sort, list(key)], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip("=")
+
+# Types of the key fields a cursor carries for each sort
+KEY_TYPES: Dict[str, Tuple[type, ...]] = {
+    'isbn': (str,),
+    'title': (str, str),
+    'author': (str, str),
+    'availability': (int, str, str),
+}
+
+def decode_cursor(sort: str, cursor: str) -> Tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError(f"Cursor was issued for sort '{cursor_sort}'")
+    types = KEY_TYPES[sort]
+    # type() rather than isinstance(), so true/false are not taken for integers
+    if not isinstance(key, list) or len(key) != len(types) or any(
+            type(value) is not expected for value, expected in zip(key, types)):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
@@ -0,0 +1,217 @@
+import heapq
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+TOKEN_RE = re.compile(r"\w+")
+
+def normalize(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(normalize(text))
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"^{token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a: str, b: str, limit: int) -> Optional[int]:
+    # Optimal string alignment distance (a swap of neighbours counts once),
+    # giving up as soon as it must exceed limit
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return None
+        previous2, previous = previous, current
+    return previous[-1] if previous[-1] <= limit else None
+
+def one_edit_apart(a: str, b: str) -> bool:
+    # Fast path of edit_distance(a, b, 1) == 1 using slice comparisons
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) - len(a) > 1 or a == b:
+        return False
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    return a[i + 1:] == b[i + 1:] or (a[i + 1:i + 2] == b[i:i + 1] and a[i:i + 1] == b[i + 1:i + 2]
+                                      and a[i + 2:] == b[i + 2:])
+
+def max_typos(term: str) -> int:
+    if len(term) < 3:
+        return 0
+    return 1 if len(term) <= 5 else 2
+
+def book_tokens(book) -> Set[str]:
+    return text_tokens(book.title, book.authors)
+
+def text_tokens(title: str, authors: Iterable[str]) -> Set[str]:
+    tokens = set(tokenize(title))
+    for author in authors:
+        tokens.update(tokenize(author))
+    return tokens
+
+class SearchIndex:
+    EXACT = 3.0
+    PREFIX = 2.0
+    FUZZY = 1.0
+
+    def __init__(self, books: Iterable = (), fuzzy_expansions: int = 50):
+        self.postings: Dict[str, Set[str]] = {}
+        self.tokens: List[str] = []
+        # Trigram -> tokens, built on the first ranked search
+        self.grams: Optional[Dict[str, Set[str]]] = None
+        self.fuzzy_expansions = fuzzy_expansions
+        for book in books:
+            self.add(book)
+
+    def add(self, book) -> None:
+        for token in book_tokens(book):
+            isbns = self.postings.get(token)
+            if isbns is None:
+                isbns = self.postings[token] = set()
+                insort(self.tokens, token)
+                if self.grams is not None:
+                    self._add_grams(token)
+            isbns.add(book.isbn)
+
+    def remove(self, book) -> None:
+        for token in book_tokens(book):
+            isbns = self.postings.get(token)
+            if isbns is None:
+                continue
+            isbns.discard(book.isbn)
+            if not isbns:
+                del self.postings[token]
+                self._forget(token)
+
+    def prefix_matches(self, prefix: str, exclude: Optional[str] = None) -> Set[str]:
+        return set().union(*(self.postings[token] for token in self._prefix_tokens(prefix) if token != exclude))
+
+    def search(self, query: str, limit: int = 10) -> List[str]:
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        candidates = sorted((self.prefix_matches(term) for term in terms), key=len)
+        matches = candidates[0].intersection(*candidates[1:])
+        return heapq.nsmallest(limit, matches)
+
+    def ranked_search(self, query: str, limit: int = 10) -> List[str]:
+        # Each term scores a book by its best token: exact > prefix > fuzzy.
+        # Books matching more terms rank first, then by total score, then ISBN.
+        terms = [self.term_tiers(term) for term in set(tokenize(query))]
+        if not terms:
+            return []
+        unions = [set().union(*(isbns for _, isbns in tiers)) for tiers in terms]
+        candidates = set.intersection(*sorted(unions, key=len))
+        if len(candidates) < limit and len(unions) > 1:
+            # Too few books match every term: widen to those matching the most terms
+            matched = Counter()
+            for isbns in unions:
+                matched.update(isbns)
+            by_count: Dict[int, List[str]] = {}
+            for isbn, count in matched.items():
+                by_count.setdefault(count, []).append(isbn)
+            candidates = set()
+            for count in sorted(by_count, reverse=True):
+                candidates.update(by_count[count])
+                if len(candidates) >= limit:
+                    break
+
+        def rank(isbn: str) -> Tuple[int, float, str]:
+            matched, score = 0, 0.0
+            for tiers in terms:
+                for weight, isbns in tiers:
+                    if isbn in isbns:
+                        matched += 1
+                        score += weight
+                        break
+            return (-matched, -score, isbn)
+        return heapq.nsmallest(limit, candidates, key=rank)
+
+    def term_tiers(self, term: str) -> List[Tuple[float, Set[str]]]:
+        # (weight, books) from best to worst; a book's first tier is its score for the term
+        tiers: List[Tuple[float, Set[str]]] = []
+        if term in self.postings:
+            tiers.append((self.EXACT, self.postings[term]))
+        prefixed = self.prefix_matches(term, exclude=term)
+        if prefixed:
+            tiers.append((self.PREFIX, prefixed))
+        if tiers and tiers[0][0] == self.EXACT:
+            # A known word is taken as spelled; looking for its neighbours
+            # would only add lower ranked books at the cost of a trigram scan
+            return tiers
+        by_distance: Dict[int, List[Set[str]]] = {}
+        for distance, token in self.fuzzy_matches(term):
+            by_distance.setdefault(distance, []).append(self.postings[token])
+        for distance in sorted(by_distance):
+            tiers.append((self.FUZZY - distance / (len(term) + 1), set().union(*by_distance[distance])))
+        return tiers
+
+    def _prefix_tokens(self, prefix: str) -> Iterable[str]:
+        i = bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            yield self.tokens[i]
+            i += 1
+
+    def fuzzy_matches(self, term: str) -> List[Tuple[int, str]]:
+        limit = max_typos(term)
+        if not limit:
+            return []
+        if self.grams is None:
+            self.grams = {}
+            for token in self.tokens:
+                self._add_grams(token)
+        grams = trigrams(term)
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self.grams.get(gram, ()))
+        # An edit touches at most four trigrams (a swap of neighbours), so a token
+        # within `allowed` edits shares the rest. Wider searches only run when
+        # closer ones find nothing.
+        for allowed in range(1, limit + 1):
+            needed = max(1, len(grams) - 4 * allowed)
+            found = []
+            for token, count in shared.items():
+                if count < needed or abs(len(token) - len(term)) > allowed or token.startswith(term):
+                    continue
+                if allowed == 1:
+                    if one_edit_apart(term, token):
+                        found.append((1, token))
+                    continue
+                distance = edit_distance(term, token, allowed)
+                if distance:
+                    found.append((distance, token))
+            if found:
+                return heapq.nsmallest(self.fuzzy_expansions, found)
+        return []
+
+    def _forget(self, token: str) -> None:
+        del self.tokens[bisect_left(self.tokens, token)]
+        if self.grams is not None:
+            for gram in trigrams(token):
+                tokens = self.grams[gram]
+                tokens.discard(token)
+                if not tokens:
+                    del self.grams[gram]
+
+    def _add_grams(self, token: str) -> None:
+        for gram in trigrams(token):
+            tokens = self.grams.get(gram)
+            if tokens is None:
+                tokens = self.grams[gram] = set()
+            tokens.add(token)
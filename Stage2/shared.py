@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import threading
+from collections.abc import MutableMapping
+from typing import Callable, IO, List, Optional
+
+from storage import Change, JsonStorage, JournalStorage
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class FileLock:
+    # Exclusive between processes (flock), reentrant between the threads of one process
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file: Optional[IO[bytes]] = None
+        self._pid: Optional[int] = None
+
+    def acquire(self) -> None:
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                if self._pid != os.getpid():
+                    # A forked worker must not share the parent's open file, or flock would not exclude them
+                    self._file = open(self.filename, 'ab')
+                    self._pid = os.getpid()
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._lock.release()
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._pid = None
+
+class SharedStorage(JournalStorage):
+    # Journal storage for several processes serving one catalog (e.g. uvicorn workers).
+    # Writers hold an exclusive file lock and catch up on the journal before validating
+    # a change; readers apply records appended since their last offset. Compaction swaps
+    # in a new journal file that starts with the next generation number, so others can
+    # still drain the old one through their reader and then carry on with the new one.
+    kind = "shared"
+    shared = True
+
+    def __init__(self, filename: str, compact_every: int = 1000):
+        if fcntl is None:
+            raise RuntimeError("Shared storage needs fcntl file locking (Linux/macOS)")
+        super().__init__(filename, compact_every)
+        self.lock = FileLock(filename + ".lock")
+        self._reader: Optional[IO[bytes]] = None
+        self._inode = 0
+        self._offset = 0
+        self.generation = 0
+
+    def load_books(self, factory: Callable) -> MutableMapping:
+        # No lock, so a reader can reload too. Compaction replaces the snapshot before the
+        # journal, and replaying a journal over a snapshot that already holds it changes
+        # nothing; only a journal replaced while the snapshot was read needs another try.
+        while True:
+            self._open_reader()
+            books = JsonStorage.load_books(self, factory)
+            if os.stat(self.journal_filename).st_ino == self._inode:
+                break
+        self.pending = 0
+        for op, record in self._read_tail():
+            if op == 'remove':
+                books.pop(record['isbn'], None)
+            else:
+                books[record['isbn']] = factory(record)
+        return books
+
+    def changes(self) -> Optional[List[Change]]:
+        # Records other processes appended since the last call, one stat when there are
+        # none, or None when this process fell too far behind and has to load_books again
+        try:
+            stat = os.stat(self.journal_filename)
+        except FileNotFoundError:
+            return []
+        if stat.st_ino == self._inode and stat.st_size == self._offset:
+            return []
+        changes = self._read_tail()
+        if stat.st_ino != self._inode:
+            generation = self.generation
+            self._close_journal()
+            self._open_reader()
+            if self.generation != generation + 1:
+                # Compacted more than once: records of the journals in between are only in the snapshot
+                return None
+            # Compacted once: the old journal is drained, so the new snapshot holds
+            # exactly our state and only the new journal is left to follow
+            self.pending = 0
+            changes += self._read_tail()
+        return changes
+
+    def compact(self, books) -> None:
+        with self.lock:
+            self.save(books)
+            self._close_journal()
+            # A new file rather than truncating in place, see changes()
+            tmp_filename = self.journal_filename + ".tmp"
+            with open(tmp_filename, 'wb') as f:
+                f.write(json.dumps({'op': 'generation', 'generation': self.generation + 1}).encode('utf-8') + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filename, self.journal_filename)
+            self._open_reader()
+            self.pending = 0
+
+    def close(self) -> None:
+        super().close()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        self.lock.close()
+
+    def _append(self, changes: List[Change]) -> int:
+        with self.lock:
+            if self._read_tail() or os.stat(self.journal_filename).st_ino != self._inode:
+                raise RuntimeError("Shared journal has changes this process has not applied")
+            if os.fstat(self._reader.fileno()).st_size > self._offset:
+                logger.warning("Dropping a partial record left in %s by a crashed writer", self.journal_filename)
+                os.truncate(self.journal_filename, self._offset)
+            written = super()._append(changes)
+            self._offset += written
+        return written
+
+    def _open_reader(self) -> None:
+        if self._reader is not None:
+            self._reader.close()
+        self._reader = open(self.journal_filename, 'a+b')
+        self._inode = os.fstat(self._reader.fileno()).st_ino
+        self._offset = 0
+        self.generation = 0
+        # Journals written before the first compaction have no header
+        head = os.pread(self._reader.fileno(), 256, 0)
+        end = head.find(b"\n") + 1
+        if end:
+            entry = json.loads(head[:end])
+            if entry['op'] == 'generation':
+                self.generation = entry['generation']
+                self._offset = end
+
+    def _read_tail(self) -> List[Change]:
+        # pread leaves the shared file position alone, which matters after a fork
+        size = os.fstat(self._reader.fileno()).st_size
+        data = os.pread(self._reader.fileno(), size - self._offset, self._offset) if size > self._offset else b""
+        # Only complete records; a writer may be in the middle of an append
+        end = data.rfind(b"\n") + 1
+        changes = []
+        for line in data[:end].splitlines():
+            entry = json.loads(line)
+            changes.append((entry['op'], entry['book']))
+        self._offset += end
+        self.pending += len(changes)
+        return changes
@@ -0,0 +1,279 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import weakref
+from collections.abc import MutableMapping
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from storage import BYTES_WRITTEN, RECORDS_WRITTEN, SAVE_SECONDS, Change, JournalStorage
+
+logger = logging.getLogger(__name__)
+
+# File layout: header, then `count` fixed-size records sorted by ISBN, then a
+# string table. Records point into the string table with (offset, length) pairs.
+MAGIC = b"LIBSNAP1"
+HEADER = struct.Struct("<8sIQ")
+RECORD = struct.Struct("<IIIIIIIIB3x")
+AUTHOR_SEPARATOR = "\x1f"
+CORE_FIELDS = ('title', 'authors', 'isbn', 'available')
+
+def write_snapshot(filename: str, records: Iterable[Dict]) -> int:
+    records = sorted(records, key=lambda record: record['isbn'])
+    strings_start = HEADER.size + RECORD.size * len(records)
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(records), strings_start))
+        table = []
+        offset = 0
+        f.seek(strings_start)
+        for record in records:
+            extra = {k: v for k, v in record.items() if k not in CORE_FIELDS}
+            fields = []
+            for value in (record['isbn'], record['title'], AUTHOR_SEPARATOR.join(record['authors']),
+                          json.dumps(extra, ensure_ascii=False) if extra else ""):
+                data = value.encode('utf-8')
+                f.write(data)
+                fields += [offset, len(data)]
+                offset += len(data)
+            table.append(RECORD.pack(*fields, int(record.get('available', True))))
+        f.seek(HEADER.size)
+        f.write(b"".join(table))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+    return len(records)
+
+class SnapshotReader:
+    def __init__(self, filename: str):
+        self.count = 0
+        self._file = None
+        self._mm = None
+        if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+            return
+        self._file = open(filename, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.strings_start = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a library snapshot: {filename}")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self.strings_start + offset
+        return self._mm[start:start + length].decode('utf-8')
+
+    def isbn_at(self, i: int) -> str:
+        fields = RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size)
+        return self._string(fields[0], fields[1])
+
+    def find(self, isbn: str) -> Optional[int]:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.isbn_at(mid) < isbn:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.isbn_at(lo) == isbn:
+            return lo
+        return None
+
+    def record(self, i: int) -> Dict:
+        fields = RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size)
+        authors = self._string(fields[4], fields[5])
+        record = {
+            'title': self._string(fields[2], fields[3]),
+            'authors': authors.split(AUTHOR_SEPARATOR) if authors else [],
+            'isbn': self._string(fields[0], fields[1]),
+            'available': bool(fields[8]),
+        }
+        if fields[7]:
+            record.update(json.loads(self._string(fields[6], fields[7])))
+        return record
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.count = 0
+
+class SnapshotBooks(MutableMapping):
+    # Books are decoded from the memory-mapped snapshot on access and kept weakly
+    # in `decoded`, so readers holding the same book share it without the process
+    # growing a copy of the catalog. A changed book is pinned in `overlay` until
+    # compaction writes it out and moves it back to `decoded`
+    def __init__(self, reader: SnapshotReader, factory: Callable):
+        self.reader = reader
+        self.factory = factory
+        self.overlay: Dict[str, object] = {}
+        self.decoded: MutableMapping = weakref.WeakValueDictionary()
+        self.added: Set[str] = set()
+        self.deleted: Set[str] = set()
+
+    def __getitem__(self, isbn: str):
+        book = self._live(isbn)
+        if book is not None:
+            return book
+        if isbn in self.deleted:
+            raise KeyError(isbn)
+        i = self.reader.find(isbn)
+        if i is None:
+            raise KeyError(isbn)
+        book = self.decoded[isbn] = self.factory(self.reader.record(i))
+        return book
+
+    def __contains__(self, isbn) -> bool:
+        if isbn in self.overlay:
+            return True
+        return isbn not in self.deleted and self.reader.find(isbn) is not None
+
+    def __setitem__(self, isbn: str, book) -> None:
+        if isbn not in self.overlay and self.reader.find(isbn) is None:
+            self.added.add(isbn)
+        self.deleted.discard(isbn)
+        self.overlay[isbn] = book
+
+    def __delitem__(self, isbn: str) -> None:
+        if isbn not in self:
+            raise KeyError(isbn)
+        self.overlay.pop(isbn, None)
+        self.decoded.pop(isbn, None)
+        if isbn in self.added:
+            self.added.discard(isbn)
+        else:
+            self.deleted.add(isbn)
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self.reader)):
+            isbn = self.reader.isbn_at(i)
+            if isbn not in self.deleted:
+                yield isbn
+        yield from list(self.added)
+
+    def __len__(self) -> int:
+        return len(self.reader) - len(self.deleted) + len(self.added)
+
+    def values(self):
+        # Walk the snapshot without caching every book in the overlay
+        for i in range(len(self.reader)):
+            isbn = self.reader.isbn_at(i)
+            if isbn in self.deleted:
+                continue
+            book = self._live(isbn)
+            yield book if book is not None else self.factory(self.reader.record(i))
+        for isbn in list(self.added):
+            yield self.overlay[isbn]
+
+    def page(self, skip: int, limit: int) -> List:
+        return list(islice(self.values(), skip, skip + limit))
+
+    def retire(self, reader: SnapshotReader) -> None:
+        # Called once everything in the overlay has been written to the new snapshot
+        self.reader = reader
+        self.decoded.update(self.overlay)
+        self.overlay.clear()
+        self.added.clear()
+        self.deleted.clear()
+
+    def pin(self, isbn: str) -> None:
+        # Called as a change is recorded, while the caller still holds the book
+        book = self.decoded.get(isbn)
+        if book is not None and isbn not in self.overlay:
+            self.overlay[isbn] = book
+
+    def _live(self, isbn: str):
+        book = self.overlay.get(isbn)
+        if book is None:
+            book = self.decoded.get(isbn)
+        return book
+
+class SnapshotStorage(JournalStorage):
+    kind = "snapshot"
+
+    def __init__(self, filename: str, compact_every: int = 1000):
+        super().__init__(filename, compact_every)
+        self.reader: Optional[SnapshotReader] = None
+        self.books: Optional[SnapshotBooks] = None
+
+    def load_snapshot(self) -> Iterator[Dict]:
+        reader = SnapshotReader(self.filename)
+        try:
+            for i in range(len(reader)):
+                yield reader.record(i)
+        finally:
+            reader.close()
+
+    def load_books(self, factory: Callable) -> MutableMapping:
+        if self.reader is not None:
+            self.reader.close()
+        logger.debug("Mapping %s", self.filename)
+        self.reader = SnapshotReader(self.filename)
+        self.books = SnapshotBooks(self.reader, factory)
+        return self.replay_journal(self.books, factory)
+
+    def stage(self, changes: List[Change]) -> None:
+        self._pin(changes)
+
+    def write(self, changes: List[Change], books) -> None:
+        self._pin(changes)
+        super().write(changes, books)
+
+    def save(self, books) -> None:
+        try:
+            with SAVE_SECONDS.time(storage=self.kind):
+                records = [book.to_dict() for book in books.values()]
+                if self.reader is not None:
+                    # The old mapping has to go before the file can be replaced on Windows
+                    self.reader.close()
+                count = write_snapshot(self.filename, records)
+        except Exception:
+            logger.exception("Failed to save %s", self.filename)
+            if self.books is not None:
+                self.reader = self.books.reader = SnapshotReader(self.filename)
+            raise RuntimeError(f"Failed to save file: {self.filename}")
+        BYTES_WRITTEN.inc(os.path.getsize(self.filename), storage=self.kind)
+        RECORDS_WRITTEN.inc(count, storage=self.kind)
+        logger.debug("Saved %d books to %s", count, self.filename)
+        if self.books is not None:
+            self._remap()
+
+    def close(self) -> None:
+        super().close()
+        if self.reader is not None:
+            self.reader.close()
+
+    def _pin(self, changes: List[Change]) -> None:
+        # A book changed in place is newer than the snapshot until the next compaction
+        if self.books is not None:
+            for op, record in changes:
+                if op != "remove":
+                    self.books.pin(record['isbn'])
+
+    def _remap(self) -> None:
+        self.reader = SnapshotReader(self.filename)
+        self.books.retire(self.reader)
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build a binary snapshot from a library_data.json catalog")
+    parser.add_argument("json_file")
+    parser.add_argument("snapshot_file")
+    args = parser.parse_args(argv)
+
+    count = write_snapshot(args.snapshot_file, JournalStorage(args.json_file).load())
+    print(f"{count} books written to {args.snapshot_file}")
+
+if __name__ == "__main__":
+    main()
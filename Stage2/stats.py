@@ -0,0 +1,59 @@
+import heapq
+from collections import Counter
+from typing import Dict, Iterable
+
+class CatalogStats:
+    def __init__(self, books: Iterable = ()):
+        self.total = 0
+        self.available = 0
+        self.copies = 0
+        self.available_copies = 0
+        self.by_author: Counter = Counter()
+        for book in books:
+            self.add(book)
+
+    @property
+    def borrowed(self) -> int:
+        return self.total - self.available
+
+    def add(self, book) -> None:
+        self.total += 1
+        self.available += book.available
+        self.copies += book.copies
+        self.available_copies += book.available_copies
+        for author in set(book.authors):
+            self.by_author[author] += 1
+
+    def remove(self, book) -> None:
+        self.total -= 1
+        self.available -= book.available
+        self.copies -= book.copies
+        self.available_copies -= book.available_copies
+        for author in set(book.authors):
+            self.by_author[author] -= 1
+            if not self.by_author[author]:
+                del self.by_author[author]
+
+    def set_available_copies(self, book, count: int) -> None:
+        if book.available != (count > 0):
+            self.available += 1 if count > 0 else -1
+        self.available_copies += count - book.available_copies
+
+    def set_copies(self, book, copies: int) -> None:
+        self.copies += copies - book.copies
+
+    def snapshot(self, top_authors: int = 0) -> Dict:
+        stats = {
+            'total_books': self.total,
+            'available_books': self.available,
+            'borrowed_books': self.borrowed,
+            'by_status': {'available': self.available, 'borrowed': self.borrowed},
+            'total_copies': self.copies,
+            'available_copies': self.available_copies,
+            'borrowed_copies': self.copies - self.available_copies,
+            'distinct_authors': len(self.by_author),
+        }
+        if top_authors:
+            top = heapq.nlargest(top_authors, self.by_author.items(), key=lambda item: (item[1], item[0]))
+            stats['top_authors'] = [{'author': author, 'books': count} for author, count in top]
+        return stats
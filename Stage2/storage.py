@@ -0,0 +1,503 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import MutableMapping
+from typing import Callable, Dict, IO, Iterator, List, Optional, Set, Tuple
+
+from metrics import metrics
+from search import SearchIndex, book_tokens, text_tokens, tokenize
+from stats import CatalogStats
+
+logger = logging.getLogger(__name__)
+
+Change = Tuple[str, Dict]
+
+SAVE_SECONDS = metrics.histogram("library_storage_save_seconds", "Time spent rewriting the whole catalog")
+WRITE_SECONDS = metrics.histogram("library_storage_write_seconds", "Time spent persisting a group of changes")
+BYTES_WRITTEN = metrics.counter("library_storage_bytes_written_total", "Bytes written to catalog files")
+RECORDS_WRITTEN = metrics.counter("library_storage_records_written_total", "Book records written to storage")
+
+def iter_json_array(f: IO[str], chunk_size: int = 1 << 16) -> Iterator[Dict]:
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    started = False
+    while True:
+        while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ',')):
+            pos += 1
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield record
+                pos = end
+                continue
+        elif eof:
+            raise ValueError("Unexpected end of JSON array")
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+
+def write_json_array(f: IO[str], records: Iterator[Dict]) -> int:
+    # Same layout as json.dump(records, f, indent=2), one record at a time
+    count = 0
+    for record in records:
+        f.write(",\n  " if count else "[\n  ")
+        f.write(json.dumps(record, indent=2, ensure_ascii=False).replace("\n", "\n  "))
+        count += 1
+    f.write("\n]" if count else "[]")
+    return count
+
+class JsonStorage:
+    kind = "json"
+    # Whether several processes may share the files; see shared.py
+    shared = False
+
+    def __init__(self, filename: str):
+        self.filename = filename
+
+    def load(self) -> Iterator[Dict]:
+        return self.load_snapshot()
+
+    def load_snapshot(self) -> Iterator[Dict]:
+        if not os.path.exists(self.filename):
+            logger.info("%s not found, creating new library", self.filename)
+            return
+        logger.debug("Loading %s", self.filename)
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            yield from iter_json_array(f)
+
+    def load_books(self, factory: Callable) -> MutableMapping:
+        return {record['isbn']: factory(record) for record in self.load_snapshot()}
+
+    def save(self, books: Dict) -> None:
+        try:
+            with SAVE_SECONDS.time(storage=self.kind):
+                tmp_filename = self.filename + ".tmp"
+                with open(tmp_filename, 'w', encoding='utf-8') as f:
+                    count = write_json_array(f, (book.to_dict() for book in books.values()))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    size = os.fstat(f.fileno()).st_size
+                os.replace(tmp_filename, self.filename)
+        except Exception:
+            logger.exception("Failed to save %s", self.filename)
+            raise RuntimeError(f"Failed to save file: {self.filename}")
+        BYTES_WRITTEN.inc(size, storage=self.kind)
+        RECORDS_WRITTEN.inc(count, storage=self.kind)
+        logger.debug("Saved %d books to %s", count, self.filename)
+
+    def stage(self, changes: List[Change]) -> None:
+        pass
+
+    def write(self, changes: List[Change], books: Dict) -> None:
+        self.save(books)
+
+    def compact(self, books: Dict) -> None:
+        self.save(books)
+
+    def close(self) -> None:
+        pass
+
+class JournalStorage(JsonStorage):
+    kind = "journal"
+
+    def __init__(self, filename: str, compact_every: int = 1000):
+        super().__init__(filename)
+        self.journal_filename = filename + ".journal"
+        self.compact_every = compact_every
+        self.pending = 0
+        self._journal = None
+
+    def load(self) -> Iterator[Dict]:
+        return iter(self.load_books(lambda record: record).values())
+
+    def load_books(self, factory: Callable) -> MutableMapping:
+        return self.replay_journal(super().load_books(factory), factory)
+
+    def replay_journal(self, books: MutableMapping, factory: Callable) -> MutableMapping:
+        self.pending = 0
+        for op, record in self.journal_entries():
+            if op == 'remove':
+                books.pop(record['isbn'], None)
+            else:
+                books[record['isbn']] = factory(record)
+            self.pending += 1
+        return books
+
+    def journal_entries(self) -> Iterator[Change]:
+        if not os.path.exists(self.journal_filename):
+            return
+        with open(self.journal_filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    # A crash can leave the last record half written; the next
+                    # append cuts it off
+                    return
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    return
+                if 'book' not in entry:
+                    # Bookkeeping such as the generation header of a shared journal
+                    continue
+                yield entry['op'], entry['book']
+
+    def write(self, changes: List[Change], books: Dict) -> None:
+        self._append(changes)
+        if self.pending >= self.compact_every:
+            self.compact(books)
+
+    def compact(self, books: Dict) -> None:
+        self.save(books)
+        self._close_journal()
+        open(self.journal_filename, 'w', encoding='utf-8').close()
+        self.pending = 0
+
+    def close(self) -> None:
+        self._close_journal()
+
+    def _append(self, changes: List[Change]) -> int:
+        with WRITE_SECONDS.time(storage=self.kind):
+            if self._journal is None:
+                self._truncate_partial_tail()
+                self._journal = open(self.journal_filename, 'ab')
+            data = "".join(
+                json.dumps({'op': op, 'book': record}, ensure_ascii=False, separators=(',', ':')) + "\n"
+                for op, record in changes
+            ).encode('utf-8')
+            self._journal.write(data)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        BYTES_WRITTEN.inc(len(data), storage=self.kind)
+        RECORDS_WRITTEN.inc(len(changes), storage=self.kind)
+        self.pending += len(changes)
+        return len(data)
+
+    def _truncate_partial_tail(self, chunk_size: int = 1 << 16) -> None:
+        # Records appended after a torn one would be glued onto it and lost on replay
+        if not os.path.exists(self.journal_filename):
+            return
+        with open(self.journal_filename, 'r+b') as f:
+            size = end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - chunk_size)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                logger.warning("Dropping a partial record at the end of %s", self.journal_filename)
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _close_journal(self) -> None:
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+# Upper bound for a prefix range over TEXT: BINARY collation compares UTF-8 bytes,
+# which sort like code points
+PREFIX_END = "\U0010ffff"
+
+class SqlitePostings:
+    # token -> ISBNs, read from the book_tokens table on demand
+    def __init__(self, storage: 'SqliteStorage'):
+        self.storage = storage
+
+    def __getitem__(self, token: str) -> Set[str]:
+        return {row[0] for row in self.storage.query_all("SELECT isbn FROM book_tokens WHERE token = ?", (token,))}
+
+    def __contains__(self, token: str) -> bool:
+        return self.storage.query_one("SELECT 1 FROM book_tokens WHERE token = ? LIMIT 1", (token,)) is not None
+
+    def get(self, token: str, default=None):
+        return self[token] if token in self else default
+
+class SqliteSearchIndex(SearchIndex):
+    # SearchIndex over the book_tokens table SqliteStorage keeps: only the vocabulary
+    # (for prefix walks and typo matching) is held in memory. A token can outlive its
+    # last book there until remove() is called; its postings are then just empty
+    def __init__(self, storage: 'SqliteStorage', fuzzy_expansions: int = 50):
+        super().__init__((), fuzzy_expansions)
+        self.storage = storage
+        self.postings = SqlitePostings(storage)
+        self.tokens = [row[0] for row in storage.query_all("SELECT DISTINCT token FROM book_tokens ORDER BY token")]
+
+    def add(self, book) -> None:
+        for token in book_tokens(book):
+            i = bisect_left(self.tokens, token)
+            if i == len(self.tokens) or self.tokens[i] != token:
+                self.tokens.insert(i, token)
+                if self.grams is not None:
+                    self._add_grams(token)
+
+    def remove(self, book) -> None:
+        for token in book_tokens(book):
+            i = bisect_left(self.tokens, token)
+            if i < len(self.tokens) and self.tokens[i] == token and token not in self.postings:
+                self._forget(token)
+
+    def prefix_matches(self, prefix: str, exclude: Optional[str] = None) -> Set[str]:
+        rows = self.storage.query_all(
+            "SELECT DISTINCT isbn FROM book_tokens WHERE token >= ? AND token < ? AND token != ?",
+            (prefix, prefix + PREFIX_END, "" if exclude is None else exclude))
+        return {row[0] for row in rows}
+
+    def search(self, query: str, limit: int = 10) -> List[str]:
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        matches = " INTERSECT ".join(["SELECT isbn FROM book_tokens WHERE token >= ? AND token < ?"] * len(terms))
+        params = [bound for term in terms for bound in (term, term + PREFIX_END)]
+        return [row[0] for row in self.storage.query_all(f"{matches} ORDER BY isbn LIMIT ?", (*params, limit))]
+
+class SqliteBooks(MutableMapping):
+    def __init__(self, storage: 'SqliteStorage', factory: Callable):
+        self.storage = storage
+        self.factory = factory
+
+    def __getitem__(self, isbn: str):
+        row = self.storage.query_one("SELECT data FROM books WHERE isbn = ?", (isbn,))
+        if row is None:
+            raise KeyError(isbn)
+        return self.factory(json.loads(row[0]))
+
+    def __contains__(self, isbn) -> bool:
+        return self.storage.query_one("SELECT 1 FROM books WHERE isbn = ?", (isbn,)) is not None
+
+    def __setitem__(self, isbn: str, book) -> None:
+        self.storage.upsert(book.to_dict())
+
+    def __delitem__(self, isbn: str) -> None:
+        if not self.storage.delete(isbn):
+            raise KeyError(isbn)
+
+    def __iter__(self) -> Iterator[str]:
+        for row in self.storage.query_all("SELECT isbn FROM books ORDER BY rowid"):
+            yield row[0]
+
+    def __len__(self) -> int:
+        return self.storage.query_one("SELECT COUNT(*) FROM books")[0]
+
+    def values(self):
+        return [self.factory(json.loads(row[0]))
+                for row in self.storage.query_all("SELECT data FROM books ORDER BY rowid")]
+
+    def page(self, skip: int, limit: int) -> List:
+        rows = self.storage.query_all(
+            "SELECT data FROM books ORDER BY rowid LIMIT ? OFFSET ?", (limit, skip))
+        return [self.factory(json.loads(row[0])) for row in rows]
+
+    def search_index(self) -> SqliteSearchIndex:
+        return SqliteSearchIndex(self.storage)
+
+    def catalog_stats(self) -> CatalogStats:
+        # Counted by the database rather than by decoding every book; Library keeps
+        # the result up to date as it changes books, as with an in-memory catalog
+        stats = CatalogStats()
+        copies = "COALESCE(json_extract(data, '$.copies'), 1)"
+        stats.total, stats.available, stats.copies, stats.available_copies = self.storage.query_one(
+            f"SELECT COUNT(*), COALESCE(SUM(available), 0), COALESCE(SUM({copies}), 0), "
+            f"COALESCE(SUM(COALESCE(json_extract(data, '$.available_copies'), available * {copies})), 0) FROM books")
+        stats.by_author = Counter(dict(self.storage.query_all(
+            "SELECT author.value, COUNT(DISTINCT books.isbn) FROM books, json_each(books.data, '$.authors') AS author "
+            "GROUP BY author.value")))
+        return stats
+
+    # Keyset paging for Library.list_page on the title/author indexes. Keys are the
+    # column values under SQLite's NOCASE collation rather than ordering.SORT_KEYS;
+    # cursors only ever come back to the backend that issued them. The leading range
+    # term on each condition is what lets SQLite seek the index instead of scanning it
+    ORDERS = {
+        'isbn': ("isbn", "isbn > ?1"),
+        'title': ("title COLLATE NOCASE, isbn",
+                  "title COLLATE NOCASE >= ?1 AND (title COLLATE NOCASE, isbn) > (?1, ?2)"),
+        'author': ("author COLLATE NOCASE, isbn",
+                   "author COLLATE NOCASE >= ?1 AND (author COLLATE NOCASE, isbn) > (?1, ?2)"),
+        'availability': ("available DESC, title COLLATE NOCASE, isbn",
+                         "available <= 1 - ?1 AND (1 - available, title COLLATE NOCASE, isbn) > (?1, ?2, ?3)"),
+    }
+
+    def sorted_page(self, sort: str, after: Optional[Tuple], skip: int, limit: int) -> List[Tuple[Tuple, object]]:
+        order, condition = self.ORDERS[sort]
+        where = f"WHERE {condition} " if after is not None else ""
+        rows = self.storage.query_all(
+            f"SELECT isbn, title, author, available, data FROM books {where}ORDER BY {order} LIMIT ? OFFSET ?",
+            (*(after or ()), limit, skip))
+        return [(self._sort_key(sort, row), self.factory(json.loads(row[4]))) for row in rows]
+
+    @staticmethod
+    def _sort_key(sort: str, row: Tuple) -> Tuple:
+        isbn, title, author, available = row[:4]
+        if sort == 'isbn':
+            return (isbn,)
+        if sort == 'availability':
+            return (1 - available, title, isbn)
+        return (title if sort == 'title' else author, isbn)
+
+class SqliteStorage:
+    kind = "sqlite"
+    shared = False
+    # Changes reach the database before write() commits them; see Library.batch
+    transactional = True
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS books (
+            isbn TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            available INTEGER NOT NULL,
+            data TEXT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_books_title ON books (title COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_books_author ON books (author COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_books_available ON books (available DESC, title COLLATE NOCASE)",
+        # Search tokens of each book's title and authors, for SqliteSearchIndex
+        """CREATE TABLE IF NOT EXISTS book_tokens (
+            token TEXT NOT NULL,
+            isbn TEXT NOT NULL,
+            PRIMARY KEY (token, isbn)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_book_tokens_isbn ON book_tokens (isbn)",
+    )
+    UPSERT = """INSERT INTO books (isbn, title, author, available, data) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (isbn) DO UPDATE SET
+            title = excluded.title, author = excluded.author,
+            available = excluded.available, data = excluded.data"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            tokenized = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'book_tokens'").fetchone()
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+            if tokenized is None:
+                # Databases from before book_tokens are tokenized once, a batch at a time
+                rows = self.conn.execute("SELECT data FROM books")
+                while True:
+                    records = [json.loads(row[0]) for row in rows.fetchmany(1000)]
+                    if not records:
+                        break
+                    self.conn.executemany("INSERT INTO book_tokens (token, isbn) VALUES (?, ?)",
+                                          [token for record in records for token in self._tokens(record)])
+
+    def query_one(self, sql: str, params: Tuple = ()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchone()
+
+    def query_all(self, sql: str, params: Tuple = ()) -> List:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def upsert(self, record: Dict) -> None:
+        with self._lock:
+            self._upsert(record)
+
+    def upsert_many(self, records: List[Dict]) -> None:
+        with self._lock, self.conn:
+            for record in records:
+                self._upsert(record)
+
+    def apply(self, changes: List[Change]) -> None:
+        # Journal-style changes, in order and in one transaction
+        with self._lock, self.conn:
+            for op, record in changes:
+                if op == 'remove':
+                    self._delete(record['isbn'])
+                else:
+                    self._upsert(record)
+
+    def delete(self, isbn: str) -> bool:
+        with self._lock:
+            return self._delete(isbn)
+
+    def load(self) -> Iterator[Dict]:
+        return (json.loads(row[0]) for row in self.query_all("SELECT data FROM books ORDER BY rowid"))
+
+    def load_books(self, factory: Callable) -> MutableMapping:
+        return SqliteBooks(self, factory)
+
+    def stage(self, changes: List[Change]) -> None:
+        # The database is the catalog, so state changes are applied right away
+        # and only the commit waits for write()
+        with self._lock:
+            for op, record in changes:
+                # Adds and removes already went through SqliteBooks; the other
+                # changes keep title and authors, so book_tokens is left as is
+                if op not in ("add", "remove"):
+                    self.conn.execute(self.UPSERT, self._row(record))
+
+    def write(self, changes: List[Change], books) -> None:
+        with WRITE_SECONDS.time(storage=self.kind), self._lock:
+            self.stage(changes)
+            self.conn.commit()
+        RECORDS_WRITTEN.inc(len(changes), storage=self.kind)
+
+    def save(self, books) -> None:
+        with self._lock:
+            self.conn.commit()
+
+    def compact(self, books) -> None:
+        with self._lock:
+            self.conn.commit()
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def _upsert(self, record: Dict) -> None:
+        self.conn.execute(self.UPSERT, self._row(record))
+        self.conn.execute("DELETE FROM book_tokens WHERE isbn = ?", (record['isbn'],))
+        self.conn.executemany("INSERT INTO book_tokens (token, isbn) VALUES (?, ?)", self._tokens(record))
+
+    def _delete(self, isbn: str) -> bool:
+        self.conn.execute("DELETE FROM book_tokens WHERE isbn = ?", (isbn,))
+        return self.conn.execute("DELETE FROM books WHERE isbn = ?", (isbn,)).rowcount > 0
+
+    @staticmethod
+    def _tokens(record: Dict) -> List[Tuple[str, str]]:
+        return [(token, record['isbn']) for token in text_tokens(record['title'], record['authors'])]
+
+    @staticmethod
+    def _row(record: Dict) -> Tuple:
+        return (record['isbn'], record['title'], ", ".join(record['authors']),
+                int(record.get('available', True)), json.dumps(record, ensure_ascii=False))
+
+def make_storage(kind: str, filename: str, compact_every: int = 1000):
+    if kind == "json":
+        return JsonStorage(filename)
+    if kind == "journal":
+        return JournalStorage(filename, compact_every)
+    if kind == "sqlite":
+        return SqliteStorage(filename)
+    if kind == "snapshot":
+        from snapshot import SnapshotStorage
+        return SnapshotStorage(filename, compact_every)
+    if kind == "shared":
+        from shared import SharedStorage
+        return SharedStorage(filename, compact_every)
+    raise ValueError(f"Unknown storage: {kind}")
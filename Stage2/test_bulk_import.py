@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+import time
+
+import httpx
+import pytest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from librarys2 import Library
+from openlibrary import OpenLibraryClient
+from bulk_import import BulkImporter, RateLimiter, load_report, read_isbns
+
+KNOWN = {f"978000000000{i}": f"Donated Book {i}" for i in range(6)}
+
+def make_library(tmp_path, requests_seen=None):
+    def handler(request):
+        if requests_seen is not None:
+            requests_seen.append(request.url.path)
+        isbn = request.url.path.split("/")[-1].replace(".json", "")
+        if isbn in KNOWN:
+            return httpx.Response(200, json={"title": KNOWN[isbn]})
+        if isbn == "flaky":
+            raise httpx.ConnectError("connection reset", request=request)
+        return httpx.Response(404, json={"error": "notfound"})
+    client = OpenLibraryClient(transport=httpx.MockTransport(handler))
+    return Library(filename=str(tmp_path / "lib.json"), client=client)
+
+@pytest.fixture
+def isbn_file(tmp_path):
+    path = tmp_path / "isbns.txt"
+    path.write_text("\n".join(list(KNOWN) + ["# comment", "", "0000000000", "flaky", "978-0000000000"]))
+    return str(path)
+
+def test_read_isbns_normalizes_and_skips_comments(isbn_file):
+    isbns = list(read_isbns(isbn_file))
+    assert isbns[-1] == "9780000000000"
+    assert "# comment" not in isbns
+    assert "" not in isbns
+
+def test_bulk_import_report_and_summary(tmp_path, isbn_file):
+    lib = make_library(tmp_path)
+    report = str(tmp_path / "report.jsonl")
+    summary = BulkImporter(lib, concurrency=4, rate=0, batch_size=3, report_path=report).run(read_isbns(isbn_file))
+
+    assert summary == {'added': 6, 'exists': 0, 'not_found': 1, 'error': 1, 'skipped': 1}
+    assert set(KNOWN) <= set(lib.books)
+    with open(report, encoding="utf-8") as f:
+        statuses = {entry["isbn"]: entry["status"] for entry in map(json.loads, f)}
+    assert statuses["0000000000"] == "not_found"
+    assert statuses["flaky"] == "error"
+
+    reloaded = Library(filename=str(tmp_path / "lib.json"))
+    assert len(reloaded.books) == 6
+
+def test_bulk_import_saves_in_batches(tmp_path, isbn_file):
+    lib = make_library(tmp_path)
+    writes = []
+    original_write = lib.storage.write
+    lib.storage.write = lambda changes, books: (writes.append(len(changes)), original_write(changes, books))
+
+    BulkImporter(lib, concurrency=4, rate=0, batch_size=4).run(read_isbns(isbn_file))
+    assert sum(writes) == 6
+    assert len(writes) <= 3
+
+def test_bulk_import_resumes_from_report(tmp_path, isbn_file):
+    report = str(tmp_path / "report.jsonl")
+    BulkImporter(make_library(tmp_path), rate=0, report_path=report).run(read_isbns(isbn_file))
+    assert load_report(report) == set(KNOWN) | {"0000000000"}
+
+    requests_seen = []
+    lib = make_library(tmp_path, requests_seen)
+    summary = BulkImporter(lib, rate=0, report_path=report).run(read_isbns(isbn_file))
+    assert requests_seen == ["/isbn/flaky.json"]
+    assert summary["skipped"] == 8
+
+def test_rate_limiter_spaces_calls():
+    limiter = RateLimiter(rate=20)
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.wait()
+    assert time.monotonic() - started >= 0.19
@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+
+import httpx
+import pytest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from jobs import DONE, FAILED, QUEUED, RUNNING, JobRunner, JobStore
+from librarys2 import Library
+from openlibrary import CircuitBreaker, OpenLibraryClient
+
+def handler(request):
+    path = request.url.path
+    if path == "/isbn/111.json":
+        return httpx.Response(200, json={"title": "Dune", "authors": [{"key": "/authors/OL1A"}]})
+    if path == "/authors/OL1A.json":
+        return httpx.Response(200, json={"name": "Frank Herbert"})
+    if path == "/isbn/500.json":
+        return httpx.Response(503)
+    return httpx.Response(404)
+
+@pytest.fixture
+def lib(tmp_path):
+    client = OpenLibraryClient(transport=httpx.MockTransport(handler), breaker=CircuitBreaker(failure_threshold=100))
+    lib = Library(filename=str(tmp_path / "library.json"), client=client)
+    yield lib
+    lib.close()
+
+@pytest.fixture
+def store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    yield store
+    store.close()
+
+def test_queue_survives_restart(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"), lease=0)
+    job = store.submit("111")
+    assert store.submit("111")["id"] == job["id"]
+    assert store.claim()["attempts"] == 1
+    store.close()
+
+    # The process died mid-job: once the lease is over the job is claimed again
+    store = JobStore(str(tmp_path / "jobs.db"))
+    assert store.get(job["id"])["status"] == RUNNING
+    claimed = store.claim()
+    assert (claimed["id"], claimed["attempts"]) == (job["id"], 2)
+    assert store.claim() is None
+    store.finish(job["id"], DONE, "Added: Dune")
+    assert store.submit("111")["id"] != job["id"]
+    assert store.counts() == {QUEUED: 1, RUNNING: 0, DONE: 1, FAILED: 0}
+    store.close()
+
+def test_runner_adds_books_and_reports_failures(lib, store):
+    runner = JobRunner(lib, store, max_attempts=2)
+    added, missing, flaky = (store.submit(isbn)["id"] for isbn in ("111", "404", "500"))
+    while runner.run_once():
+        pass
+
+    assert store.get(added)["status"] == DONE
+    assert store.get(added)["result"] == "Added: Dune"
+    assert lib.find_book("111").authors == ["Frank Herbert"]
+    assert (store.get(missing)["status"], store.get(missing)["result"]) == (FAILED, "Error: Book not found via API!")
+    # Upstream errors are retried later rather than failing the job
+    assert store.get(flaky)["status"] == QUEUED
+    assert store.get(flaky)["attempts"] == 1
+
+    store.retry(flaky, 0, "")
+    runner.run_once()
+    assert store.get(flaky)["status"] == FAILED
+    assert store.get(flaky)["attempts"] == 2
+
+def test_reclaimed_job_for_added_book_is_done(lib, store):
+    job = store.submit("111")["id"]
+    store.claim()
+    lib.add_book("Dune", ["Frank Herbert"], "111")
+    store.retry(job, 0, "")
+    JobRunner(lib, store).run_once()
+    assert (store.get(job)["status"], store.get(job)["result"]) == (DONE, "Already in library: Dune")
+
+def test_worker_threads_pick_up_jobs(lib, store):
+    runner = JobRunner(lib, store, workers=2, poll_interval=0.05)
+    runner.start()
+    try:
+        job = runner.submit("111")["id"]
+        deadline = time.monotonic() + 5
+        while store.get(job)["status"] != DONE and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        runner.stop()
+    assert store.get(job)["status"] == DONE
+    assert lib.find_book("111").title == "Dune"
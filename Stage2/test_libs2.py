@@ -1,8 +1,12 @@
+import asyncio
+import base64
 import pytest
 import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 import os
 import httpx
-from unittest.mock import patch, MagicMock
 import sys
 from typing import List
 
@@ -10,6 +14,9 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 
 from librarys2 import Library, Book
+from ordering import SortedIndex
+from search import edit_distance
+from openlibrary import AsyncOpenLibraryClient, OpenLibraryClient
 
 @pytest.fixture
 def temp_library(tmp_path):
@@ -26,17 +33,12 @@ def sample_book():
         "isbn": "1234567890"
     }
 
-def create_mock_request():
-    mock_request = MagicMock(spec=httpx.Request)
-    mock_request.method = "GET"
-    mock_request.url = "https://example.com"
-    return mock_request
-
-def create_mock_response(status_code=200):
-    mock_response = MagicMock(spec=httpx.Response)
-    mock_response.status_code = status_code
-    mock_response.request = create_mock_request()
-    return mock_response
+def library_with_routes(tmp_path, routes):
+    def handler(request):
+        status_code, payload = routes.get(request.url.path, (404, {"error": "notfound"}))
+        return httpx.Response(status_code, json=payload)
+    client = OpenLibraryClient(transport=httpx.MockTransport(handler))
+    return Library(filename=str(tmp_path / "lib.json"), client=client)
 
 def test_book_initialization(sample_book):
     book = Book(**sample_book)
@@ -133,64 +135,65 @@ def test_list_books(temp_library, sample_book):
     assert len(books_list) == 1
     assert sample_book["title"] in books_list[0]
 
-@patch('librarys2.httpx.get')
-def test_add_book_by_isbn_success(mock_get, temp_library):
-    
-    mock_book_response = create_mock_response()
-    mock_book_response.json.return_value = {
-        "title": "API Book",
-        "authors": [{"key": "/authors/OL1A"}],
-        "publishers": ["Test Publisher"]
-    }
-    
-    mock_author_response = create_mock_response()
-    mock_author_response.json.return_value = {"name": "API Author"}
-    
-    mock_get.side_effect = [mock_book_response, mock_author_response]
-    
-    result = temp_library.add_book_by_isbn("9876543210")
+def test_add_book_by_isbn_success(tmp_path):
+    lib = library_with_routes(tmp_path, {
+        "/isbn/9876543210.json": (200, {
+            "title": "API Book",
+            "authors": [{"key": "/authors/OL1A"}],
+            "publishers": ["Test Publisher"]
+        }),
+        "/authors/OL1A.json": (200, {"name": "API Author"}),
+    })
+
+    result = lib.add_book_by_isbn("9876543210")
     assert "Added" in result
     assert "API Book" in result
-    assert len(temp_library.books) == 1
-    assert "9876543210" in temp_library.books
-    assert temp_library.books["9876543210"].authors == ["API Author"]
-
-@patch('librarys2.httpx.get')
-def test_add_book_by_isbn_missing_authors(mock_get, temp_library):
-    mock_response = create_mock_response()
-    mock_response.json.return_value = {
-        "title": "No Author Book",
-        "publishers": ["Test Publisher"]
-    }
-    mock_get.return_value = mock_response
-    
-    result = temp_library.add_book_by_isbn("9876543210")
+    assert len(lib.books) == 1
+    assert "9876543210" in lib.books
+    assert lib.books["9876543210"].authors == ["API Author"]
+
+def test_add_book_by_isbn_missing_authors(tmp_path):
+    lib = library_with_routes(tmp_path, {
+        "/isbn/9876543210.json": (200, {
+            "title": "No Author Book",
+            "publishers": ["Test Publisher"]
+        }),
+    })
+
+    result = lib.add_book_by_isbn("9876543210")
     assert "Added" in result
-    assert temp_library.books["9876543210"].authors == ["Unknown Author"]
+    assert lib.books["9876543210"].authors == ["Unknown Author"]
 
-@patch('librarys2.httpx.get')
-def test_add_book_by_isbn_api_failure(mock_get, temp_library):
-    mock_get.side_effect = httpx.RequestError("API Error", request=create_mock_request())
-    
-    result = temp_library.add_book_by_isbn("9876543210")
+def test_add_book_by_isbn_api_failure(tmp_path):
+    def handler(request):
+        raise httpx.ConnectError("API Error", request=request)
+    lib = Library(filename=str(tmp_path / "lib.json"),
+                  client=OpenLibraryClient(transport=httpx.MockTransport(handler)))
+
+    result = lib.add_book_by_isbn("9876543210")
     assert "Error" in result
     assert "API" in result or "not found" in result
-    assert len(temp_library.books) == 0
+    assert len(lib.books) == 0
 
-@patch('librarys2.httpx.get')
-def test_add_book_by_isbn_http_error(mock_get, temp_library):
-    mock_response = create_mock_response(404)
-    mock_response.raise_for_status.side_effect = httpx.HTTPStatusError(
-        "404 Not Found", 
-        request=create_mock_request(),
-        response=mock_response
-    )
-    mock_get.return_value = mock_response
-    
-    result = temp_library.add_book_by_isbn("9876543210")
+def test_add_book_by_isbn_http_error(tmp_path):
+    lib = library_with_routes(tmp_path, {})
+
+    result = lib.add_book_by_isbn("9876543210")
     assert "Error" in result
     assert "404" in result
-    assert len(temp_library.books) == 0
+    assert len(lib.books) == 0
+
+def test_add_book_by_isbn_resolves_authors_concurrently(tmp_path):
+    lib = library_with_routes(tmp_path, {
+        "/isbn/42.json": (200, {
+            "title": "Anthology",
+            "authors": [{"key": f"/authors/OL{i}A"} for i in range(4)]
+        }),
+        **{f"/authors/OL{i}A.json": (200, {"name": f"Author {i}"}) for i in range(3)},
+    })
+
+    assert "Added" in lib.add_book_by_isbn("42")
+    assert lib.books["42"].authors == ["Author 0", "Author 1", "Author 2", "Unknown Author"]
 
 def test_add_book_by_isbn_empty_input(temp_library):
     result = temp_library.add_book_by_isbn("")
@@ -211,4 +214,469 @@ def test_library_persistence(tmp_path, sample_book):
     lib2 = Library(filename=str(lib_file))
     assert len(lib2.books) == 1
     assert sample_book["isbn"] in lib2.books
-    assert lib2.books[sample_book["isbn"]].title == sample_book["title"]
\ No newline at end of file
+    assert lib2.books[sample_book["isbn"]].title == sample_book["title"]
+
+def test_journal_mutations_do_not_rewrite_snapshot(tmp_path, sample_book):
+    lib_file = tmp_path / "journal_test.json"
+    lib = Library(filename=str(lib_file), storage="journal")
+    lib.add_book(**sample_book)
+    lib.borrow_book(sample_book["isbn"])
+
+    assert not os.path.exists(lib_file)
+    with open(str(lib_file) + ".journal", encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert [entry["op"] for entry in entries] == ["add", "borrow"]
+    lib.close()
+
+def test_journal_replay_on_load(tmp_path, sample_book):
+    lib_file = tmp_path / "journal_test.json"
+    lib = Library(filename=str(lib_file), storage="journal")
+    lib.add_book(**sample_book)
+    lib.add_book("Other Book", ["Someone"], "111")
+    lib.borrow_book(sample_book["isbn"])
+    lib.remove_book("111")
+    lib.close()
+
+    lib2 = Library(filename=str(lib_file), storage="journal")
+    assert list(lib2.books) == [sample_book["isbn"]]
+    assert not lib2.books[sample_book["isbn"]].available
+    lib2.close()
+
+@pytest.mark.parametrize("storage", ["journal", "snapshot"])
+def test_journal_ignores_truncated_tail(tmp_path, sample_book, storage):
+    lib_file = tmp_path / "journal_test.json"
+    lib = Library(filename=str(lib_file), storage=storage)
+    lib.add_book(**sample_book)
+    lib.close()
+    with open(str(lib_file) + ".journal", "a", encoding="utf-8") as f:
+        f.write('{"op":"remove","book":{"isbn"')
+
+    lib2 = Library(filename=str(lib_file), storage=storage)
+    assert sample_book["isbn"] in lib2.books
+    # Writes after the torn record must not be glued onto it
+    lib2.add_book("Other Book", ["Someone"], "111")
+    lib2.borrow_book(sample_book["isbn"])
+    lib2.close()
+
+    lib3 = Library(filename=str(lib_file), storage=storage)
+    assert sorted(lib3.books) == sorted([sample_book["isbn"], "111"])
+    assert not lib3.books[sample_book["isbn"]].available
+    lib3.close()
+
+def test_journal_compaction(tmp_path, sample_book):
+    lib_file = tmp_path / "journal_test.json"
+    lib = Library(filename=str(lib_file), storage="journal", compact_every=3)
+    lib.add_book(**sample_book)
+    lib.borrow_book(sample_book["isbn"])
+    lib.return_book(sample_book["isbn"])
+
+    with open(lib_file, encoding="utf-8") as f:
+        assert len(json.load(f)) == 1
+    assert os.path.getsize(str(lib_file) + ".journal") == 0
+
+    lib.borrow_book(sample_book["isbn"])
+    lib.close()
+    lib2 = Library(filename=str(lib_file), storage="journal")
+    assert not lib2.books[sample_book["isbn"]].available
+    lib2.close()
+
+def test_search_prefix_and_accent_folding(temp_library):
+    temp_library.add_book("Yüzüklerin Efendisi", ["J.R.R. Tolkien"], "9789753425426")
+    temp_library.add_book("Suç ve Ceza", ["Fyodor Dostoyevski"], "9750719387")
+
+    assert [b.isbn for b in temp_library.search("tolk")] == ["9789753425426"]
+    assert [b.isbn for b in temp_library.search("yuzuk")] == ["9789753425426"]
+    assert [b.isbn for b in temp_library.search("SUC ceza")] == ["9750719387"]
+    assert temp_library.search("tolkien ceza") == []
+
+def test_search_index_follows_mutations(temp_library, sample_book):
+    assert temp_library.search("test") == []
+    temp_library.add_book(**sample_book)
+    assert len(temp_library.search("test")) == 1
+    temp_library.remove_book(sample_book["isbn"])
+    assert temp_library.search("test") == []
+    assert temp_library.search("author") == []
+
+def test_search_limit(temp_library):
+    for i in range(5):
+        temp_library.add_book(f"Series Volume {i}", ["Writer"], f"isbn-{i}")
+    results = temp_library.search("series", limit=3)
+    assert [b.isbn for b in results] == ["isbn-0", "isbn-1", "isbn-2"]
+
+def test_ranked_search_tolerates_typos(temp_library):
+    temp_library.add_book("The Hobbit", ["J.R.R. Tolkien"], "1")
+    temp_library.add_book("Tolkien: A Biography", ["Humphrey Carpenter"], "2")
+    temp_library.add_book("Tolkiens and Hobbits", ["Someone Else"], "3")
+    temp_library.add_book("Dune", ["Frank Herbert"], "4")
+
+    assert temp_library.search("tolkein") == []
+    # The closest spelling wins; two-typo neighbours are only tried when no one-typo word exists
+    assert [b.isbn for b in temp_library.search("tolkein", ranked=True)] == ["1", "2"]
+    assert [b.isbn for b in temp_library.search("tolkeins", ranked=True)] == ["3"]
+    # Exact beats prefix, and matching every term beats matching one
+    assert [b.isbn for b in temp_library.search("tolkien", ranked=True)] == ["1", "2", "3"]
+    assert [b.isbn for b in temp_library.search("hobit tolkien", ranked=True)] == ["1", "2", "3"]
+    assert [b.isbn for b in temp_library.search("frank herbet", ranked=True, limit=1)] == ["4"]
+
+    temp_library.remove_book("1")
+    temp_library.add_book("Tolkein Misspelled", ["Typo"], "5")
+    # A word present in the catalog is taken as spelled
+    assert [b.isbn for b in temp_library.search("tolkein", ranked=True)] == ["5"]
+    assert [b.isbn for b in temp_library.search("tolkeim", ranked=True)] == ["5"]
+
+def test_edit_distance_counts_swaps_once():
+    assert edit_distance("tolkein", "tolkien", 2) == 1
+    assert edit_distance("hobit", "hobbit", 1) == 1
+    assert edit_distance("dune", "dawn", 1) is None
+    assert edit_distance("ab", "abcd", 1) is None
+
+def test_batch_persists_once(temp_library, sample_book):
+    writes = []
+    original_write = temp_library.storage.write
+    temp_library.storage.write = lambda changes, books: (writes.append([op for op, _ in changes]), original_write(changes, books))
+
+    with temp_library.batch():
+        temp_library.add_book(**sample_book)
+        temp_library.borrow_book(sample_book["isbn"])
+        assert writes == []
+    assert writes == [["add", "borrow"]]
+
+def test_add_book_by_isbn_async(tmp_path):
+    async def handler(request):
+        await asyncio.sleep(0.2)
+        if request.url.path.startswith("/authors/"):
+            return httpx.Response(200, json={"name": "Async Author"})
+        isbn = request.url.path.split("/")[-1].replace(".json", "")
+        return httpx.Response(200, json={"title": f"Async {isbn}", "authors": [{"key": "/authors/OL1A"}]})
+    lib = Library(filename=str(tmp_path / "lib.json"),
+                  async_client=AsyncOpenLibraryClient(transport=httpx.MockTransport(handler)))
+
+    async def add_all():
+        return await asyncio.gather(*(lib.add_book_by_isbn_async(str(i)) for i in range(5)))
+
+    started = time.perf_counter()
+    results = asyncio.run(add_all())
+    assert time.perf_counter() - started < 0.8
+    assert all("Added" in result for result in results)
+    assert lib.books["3"].authors == ["Async Author"]
+
+def test_add_book_by_isbn_async_not_found(tmp_path):
+    lib = Library(filename=str(tmp_path / "lib.json"),
+                  async_client=AsyncOpenLibraryClient(
+                      transport=httpx.MockTransport(lambda request: httpx.Response(404, json={}))))
+    result = asyncio.run(lib.add_book_by_isbn_async("9876543210"))
+    assert "Error" in result
+    assert "404" in result
+
+def test_concurrent_borrow_return_invariants(tmp_path):
+    lib_file = str(tmp_path / "stress.json")
+    lib = Library(filename=lib_file, storage="journal", compact_every=200)
+    isbns = [f"isbn-{i}" for i in range(4)]
+    for isbn in isbns:
+        lib.add_book(f"Book {isbn}", ["Author"], isbn)
+
+    def worker(n):
+        outcomes = []
+        for i in range(250):
+            isbn = isbns[(n + i) % len(isbns)]
+            if i % 2 == 0:
+                outcomes.append((isbn, "borrow", lib.borrow_book(isbn).startswith("Borrowed")))
+            else:
+                outcomes.append((isbn, "return", lib.return_book(isbn).startswith("Returned")))
+        return outcomes
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outcomes = [o for result in executor.map(worker, range(8)) for o in result]
+
+    for isbn in isbns:
+        borrows = sum(1 for i, op, ok in outcomes if i == isbn and op == "borrow" and ok)
+        returns = sum(1 for i, op, ok in outcomes if i == isbn and op == "return" and ok)
+        assert borrows - returns in (0, 1)
+        assert lib.books[isbn].available == (borrows == returns)
+
+    lib.close()
+    reloaded = Library(filename=lib_file, storage="journal")
+    assert {isbn: book.available for isbn, book in reloaded.books.items()} == \
+        {isbn: book.available for isbn, book in lib.books.items()}
+    reloaded.close()
+
+def test_save_is_atomic(temp_library, sample_book, monkeypatch):
+    temp_library.add_book(**sample_book)
+    with open(temp_library.filename, encoding="utf-8") as f:
+        before = f.read()
+
+    def failing_write(f, records):
+        f.write("[\n  {")
+        raise OSError("disk full")
+    monkeypatch.setattr("storage.write_json_array", failing_write)
+    with pytest.raises(RuntimeError):
+        temp_library.borrow_book(sample_book["isbn"])
+
+    with open(temp_library.filename, encoding="utf-8") as f:
+        assert f.read() == before
+
+def test_batched_durability_groups_writes(tmp_path, sample_book):
+    lib = Library(filename=str(tmp_path / "batched.json"), storage="journal",
+                  durability="batched", flush_interval_ms=10000, flush_ops=1000)
+    writes = []
+    original_write = lib.storage.write
+    lib.storage.write = lambda changes, books: (writes.append(len(changes)), original_write(changes, books))
+
+    lib.add_book(**sample_book)
+    for _ in range(5):
+        lib.borrow_book(sample_book["isbn"])
+        lib.return_book(sample_book["isbn"])
+    assert writes == []
+    assert lib.pending_writes == 11
+
+    lib.flush()
+    assert writes == [11]
+    assert lib.pending_writes == 0
+    lib.close()
+
+def test_batched_flusher_runs_on_interval_and_op_count(tmp_path, sample_book):
+    lib_file = str(tmp_path / "batched.json")
+    lib = Library(filename=lib_file, durability="batched", flush_interval_ms=20, flush_ops=1000)
+    lib.add_book(**sample_book)
+    deadline = time.monotonic() + 2
+    while lib.pending_writes and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert Library(filename=lib_file).find_book(sample_book["isbn"]) is not None
+    lib.close()
+
+    lib = Library(filename=lib_file, durability="batched", flush_interval_ms=10000, flush_ops=3)
+    for i in range(3):
+        lib.add_book(f"Book {i}", ["Author"], f"isbn-{i}")
+    deadline = time.monotonic() + 2
+    while lib.pending_writes and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(Library(filename=lib_file).books) == 4
+    lib.close()
+
+def test_batched_close_flushes(tmp_path, sample_book):
+    lib_file = str(tmp_path / "batched.json")
+    lib = Library(filename=lib_file, durability="batched", flush_interval_ms=10000)
+    lib.add_book(**sample_book)
+    lib.borrow_book(sample_book["isbn"])
+    lib.close()
+    assert not Library(filename=lib_file).books[sample_book["isbn"]].available
+
+def test_unknown_durability(tmp_path):
+    with pytest.raises(ValueError):
+        Library(filename=str(tmp_path / "lib.json"), durability="sometimes")
+
+def test_list_page_cursor_walks_catalog(temp_library):
+    for i in [3, 1, 4, 0, 2]:
+        temp_library.add_book(f"Book {i}", ["Author"], f"isbn-{i}")
+
+    seen, cursor = [], None
+    while True:
+        books, cursor = temp_library.list_page(sort="isbn", cursor=cursor, limit=2)
+        seen.extend(book.isbn for book in books)
+        if cursor is None:
+            break
+    assert seen == [f"isbn-{i}" for i in range(5)]
+
+def test_list_page_sorts_and_tracks_mutations(temp_library):
+    temp_library.add_book("Çiçek", ["Zeynep"], "1")
+    temp_library.add_book("armut", ["Ali"], "2")
+    temp_library.add_book("Bahçe", ["Mehmet"], "3")
+
+    assert [b.isbn for b in temp_library.list_page(sort="title")[0]] == ["2", "3", "1"]
+    assert [b.isbn for b in temp_library.list_page(sort="author")[0]] == ["2", "3", "1"]
+    assert [b.isbn for b in temp_library.list_page(sort="availability")[0]] == ["2", "3", "1"]
+
+    temp_library.borrow_book("2")
+    temp_library.remove_book("3")
+    temp_library.add_book("Aaa", ["Yusuf"], "4")
+    assert [b.isbn for b in temp_library.list_page(sort="availability")[0]] == ["4", "1", "2"]
+    assert [b.isbn for b in temp_library.list_page(sort="title")[0]] == ["4", "2", "1"]
+
+def test_list_page_skip_and_bad_cursor(temp_library):
+    for i in range(5):
+        temp_library.add_book(f"Book {i}", ["Author"], f"isbn-{i}")
+    books, cursor = temp_library.list_page(skip=3, limit=1)
+    assert [b.isbn for b in books] == ["isbn-3"]
+    assert cursor is not None
+
+    with pytest.raises(ValueError):
+        temp_library.list_page(sort="title", cursor=cursor)
+    with pytest.raises(ValueError):
+        temp_library.list_page(cursor="not-a-cursor")
+    # Well-formed JSON with the wrong shape or types is as invalid as garbage
+    for sort, key in [("isbn", 5), ("isbn", [5]), ("isbn", [[1]]), ("isbn", ["isbn-1", "extra"]),
+                      ("availability", [True, "a", "b"])]:
+        cursor = base64.urlsafe_b64encode(json.dumps([sort, key]).encode()).decode()
+        with pytest.raises(ValueError):
+            temp_library.list_page(sort=sort, cursor=cursor)
+    with pytest.raises(ValueError):
+        temp_library.list_page(sort="price")
+
+def test_sorted_index_blocks_match_a_sorted_list(monkeypatch):
+    monkeypatch.setattr(SortedIndex, "BLOCK", 4)
+    rng = random.Random(3)
+    index = SortedIndex(lambda book: (book.isbn,), [Book("T", ["A"], str(rng.randrange(100))) for _ in range(30)])
+    expected = [key for block in index.blocks for key in block]
+    for _ in range(2000):
+        book = Book("T", ["A"], str(rng.randrange(100)))
+        if rng.random() < 0.55:
+            index.add(book)
+            expected = sorted(expected + [(book.isbn,)])
+        else:
+            index.remove(book)
+            if (book.isbn,) in expected:
+                expected.remove((book.isbn,))
+        assert [key for block in index.blocks for key in block] == expected
+        after = (str(rng.randrange(100)),)
+        start = len([key for key in expected if key <= after])
+        assert index.page(after, 2, 5) == expected[start + 2:start + 8]
+        assert index.page(None, 0, 3) == expected[:4]
+
+def test_stats_counters_follow_mutations(temp_library):
+    temp_library.add_book("Dune", ["Frank Herbert"], "1")
+    temp_library.add_book("Dune Messiah", ["Frank Herbert"], "2")
+    temp_library.add_book("Good Omens", ["Terry Pratchett", "Neil Gaiman"], "3")
+    temp_library.borrow_book("1")
+    temp_library.borrow_book("3")
+    temp_library.return_book("3")
+    temp_library.remove_book("2")
+
+    stats = temp_library.stats(top_authors=2)
+    assert stats["total_books"] == 2
+    assert stats["available_books"] == 1
+    assert stats["borrowed_books"] == 1
+    assert stats["by_status"] == {"available": 1, "borrowed": 1}
+    assert stats["distinct_authors"] == 3
+    assert stats["top_authors"][0]["books"] == 1
+    assert "top_authors" not in temp_library.stats()
+
+def test_stats_built_on_load(tmp_path, sample_book):
+    lib_file = str(tmp_path / "stats.json")
+    lib = Library(filename=lib_file)
+    lib.add_book(**sample_book)
+    lib.borrow_book(sample_book["isbn"])
+
+    stats = Library(filename=lib_file).stats()
+    assert (stats["total_books"], stats["borrowed_books"]) == (1, 1)
+
+def test_book_is_slotted_and_interns_authors():
+    first = Book("One", ["".join(["Shared", " Author"])], "1")
+    second = Book("Two", ["".join(["Shared", " Author"])], "2")
+    assert not hasattr(first, "__dict__")
+    assert first.authors[0] is second.authors[0]
+
+def test_multiple_copies_borrow_and_return(temp_library):
+    temp_library.add_book("Dune", ["Frank Herbert"], "1", copies=3)
+    assert "Error" in temp_library.add_book("Emma", ["Jane Austen"], "2", copies=0)
+
+    for _ in range(3):
+        assert "Borrowed" in temp_library.borrow_book("1")
+    assert "already borrowed" in temp_library.borrow_book("1")
+    book = temp_library.find_book("1")
+    assert (book.copies, book.available_copies, book.available) == (3, 0, False)
+
+    assert "Returned" in temp_library.return_book("1")
+    assert temp_library.find_book("1").available_copies == 1
+    assert [b.isbn for b in temp_library.list_page(sort="availability")[0]] == ["1"]
+
+    stats = temp_library.stats()
+    assert (stats["total_copies"], stats["available_copies"], stats["borrowed_copies"]) == (3, 1, 2)
+    assert stats["available_books"] == 1
+
+def test_set_copies_keeps_borrowed_copies(tmp_path):
+    lib_file = str(tmp_path / "copies.json")
+    lib = Library(filename=lib_file)
+    lib.add_book("Dune", ["Frank Herbert"], "1", copies=2)
+    lib.stats()
+    lib.borrow_book("1")
+    lib.borrow_book("1")
+
+    assert "Error" in lib.set_copies("1", 1)
+    assert "Copies updated" in lib.set_copies("1", 5)
+    assert lib.find_book("1").available_copies == 3
+    assert lib.stats()["total_copies"] == 5
+
+    reloaded = Library(filename=lib_file).find_book("1")
+    assert (reloaded.copies, reloaded.available_copies) == (5, 3)
+    assert Book("Emma", ["Jane Austen"], "2").to_dict() == \
+        {"title": "Emma", "authors": ["Jane Austen"], "isbn": "2", "available": True}
+
+def test_loans_record_borrower_and_due_date(temp_library):
+    temp_library.add_book("Dune", ["Frank Herbert"], "1", copies=2)
+    temp_library.add_book("Emma", ["Jane Austen"], "2")
+    temp_library.borrow_book("1", borrower="alice", due_at=100)
+    temp_library.borrow_book("1", borrower="bob", due_at=300)
+    temp_library.borrow_book("2", borrower="carol", due_at=200)
+
+    loans = temp_library.find_book("1").loans
+    assert [(loan.borrower, loan.due_at) for loan in loans] == [("alice", 100), ("bob", 300)]
+    assert [loan.borrower for loan in temp_library.overdue_loans(now=250)] == ["alice", "carol"]
+    assert [loan.borrower for loan in temp_library.overdue_loans(now=250, limit=1)] == ["alice"]
+    assert [loan.borrower for loan in temp_library.loans_due(within=100, now=150)] == ["carol"]
+
+    assert "Error" in temp_library.return_book("1", borrower="carol")
+    assert "Returned" in temp_library.return_book("1", borrower="bob")
+    temp_library.remove_book("2")
+    assert [loan.borrower for loan in temp_library.overdue_loans(now=1000)] == ["alice"]
+
+def test_loans_survive_reload(tmp_path):
+    lib_file = str(tmp_path / "loans.json")
+    lib = Library(filename=lib_file, storage="journal", loan_days=7)
+    lib.add_book("Dune", ["Frank Herbert"], "1")
+    lib.borrow_book("1", borrower="alice")
+    loan = lib.find_book("1").loans[0]
+    assert loan.due_at - loan.borrowed_at == 7 * 24 * 3600
+    lib.close()
+
+    reloaded = Library(filename=lib_file, storage="journal")
+    assert [l.id for l in reloaded.overdue_loans(now=loan.due_at + 1)] == [loan.id]
+    assert reloaded.overdue_loans(now=loan.due_at - 1) == []
+    reloaded.return_book("1")
+    assert reloaded.find_book("1").loans is None
+    assert reloaded.overdue_loans(now=loan.due_at + 1) == []
+
+def test_batch_operations_are_all_or_nothing(temp_library, monkeypatch):
+    writes = []
+    original_write = temp_library.storage.write
+    monkeypatch.setattr(temp_library.storage, "write",
+                        lambda changes, books: (writes.append(len(changes)), original_write(changes, books)))
+
+    results = temp_library.add_books([
+        {"title": "Dune", "authors": ["Frank Herbert"], "isbn": "1", "copies": 2},
+        {"title": "Emma", "authors": ["Jane Austen"], "isbn": "2"},
+    ])
+    assert results == ["Added: Dune", "Added: Emma"]
+    assert writes == [2]
+
+    rejected = temp_library.add_books([
+        {"title": "Persuasion", "authors": ["Jane Austen"], "isbn": "3"},
+        {"title": "Emma", "authors": ["Jane Austen"], "isbn": "2"},
+    ])
+    assert "Not applied" in rejected[0] and "already exists" in rejected[1]
+    assert temp_library.find_book("3") is None
+
+    rejected = temp_library.borrow_books(["1", "2", "2"], borrower="kiosk")
+    assert "already borrowed" in rejected[2]
+    assert temp_library.find_book("1").available_copies == 2
+
+    assert temp_library.borrow_books(["1", "1", "2"], borrower="kiosk") == \
+        ["Borrowed: Dune", "Borrowed: Dune", "Borrowed: Emma"]
+    assert writes == [2, 3]
+    assert "wasn't borrowed by" in temp_library.return_books(["1", "2"], borrower="someone")[0]
+    assert temp_library.return_books(["1", "2"], borrower="kiosk") == ["Returned: Dune", "Returned: Emma"]
+    assert temp_library.find_book("1").available_copies == 1
+    assert writes == [2, 3, 2]
+
+def test_version_changes_with_every_mutation(temp_library, sample_book):
+    versions = [temp_library.version]
+    temp_library.add_book(**sample_book)
+    versions.append(temp_library.version)
+    temp_library.borrow_book(sample_book["isbn"])
+    versions.append(temp_library.version)
+    assert "Error" in temp_library.borrow_book(sample_book["isbn"])
+    versions.append(temp_library.version)
+    temp_library.borrow_books([sample_book["isbn"]])
+    versions.append(temp_library.version)
+    temp_library.remove_book(sample_book["isbn"])
+    versions.append(temp_library.version)
+    assert versions[0] < versions[1] < versions[2] == versions[3] == versions[4] < versions[5]
@@ -0,0 +1,292 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from openlibrary import (CACHE_HITS, COALESCED, NEGATIVE_HITS, REJECTED, REQUEST_SECONDS, STALE_HITS,
+                         AsyncOpenLibraryClient, CircuitBreaker, DiskCache, OpenLibraryClient, UpstreamBusy)
+
+ROUTES = {
+    "/isbn/111.json": {"title": "First Edition", "authors": [{"key": "/authors/OL1A"}, {"key": "/authors/OL2A"}]},
+    "/isbn/222.json": {"title": "Second Edition", "authors": [{"key": "/authors/OL1A"}]},
+    "/authors/OL1A.json": {"name": "Shared Author"},
+    "/authors/OL2A.json": {"name": "Co Author"},
+}
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        if self.path.startswith("/authors/"):
+            time.sleep(self.server.author_delay)
+        payload = ROUTES.get(self.path)
+        body = json.dumps(payload if payload else {"error": "notfound"}).encode("utf-8")
+        self.send_response(200 if payload else 404)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.hits = []
+    server.author_delay = 0
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def make_client(server, **kwargs):
+    return OpenLibraryClient(base_url=f"http://127.0.0.1:{server.server_port}", **kwargs)
+
+def test_fetch_book_resolves_authors(stub_server):
+    client = make_client(stub_server)
+    data = client.fetch_book("111")
+    assert data["title"] == "First Edition"
+    assert data["authors"] == ["Shared Author", "Co Author"]
+    client.close()
+
+def test_fetch_book_not_found_raises(stub_server):
+    client = make_client(stub_server)
+    with pytest.raises(Exception) as exc_info:
+        client.fetch_book("999")
+    assert "404" in str(exc_info.value)
+    client.close()
+
+def test_authors_are_fetched_concurrently(stub_server):
+    stub_server.author_delay = 0.3
+    client = make_client(stub_server)
+    started = time.perf_counter()
+    client.fetch_book("111")
+    assert time.perf_counter() - started < 0.55
+    client.close()
+
+def test_disk_cache_shares_authors_between_editions(stub_server, tmp_path):
+    client = make_client(stub_server, cache_dir=str(tmp_path / "cache"))
+    client.fetch_book("111")
+    client.fetch_book("222")
+    assert stub_server.hits.count("/authors/OL1A.json") == 1
+    client.close()
+
+    # A new client, as after a restart, is answered from the same cache directory
+    fresh = make_client(stub_server, cache_dir=str(tmp_path / "cache"))
+    assert fresh.fetch_book("111")["authors"] == ["Shared Author", "Co Author"]
+    assert stub_server.hits.count("/isbn/111.json") == 1
+    fresh.close()
+
+def test_request_latency_metrics(stub_server, tmp_path):
+    before = REQUEST_SECONDS.count(resource="isbn", status="200"), CACHE_HITS.value(resource="author")
+    client = make_client(stub_server, cache_dir=str(tmp_path / "cache"))
+    client.fetch_book("111")
+    client.fetch_book("222")
+    with pytest.raises(Exception):
+        client.fetch_book("999")
+    client.close()
+
+    assert REQUEST_SECONDS.count(resource="isbn", status="200") - before[0] == 2
+    assert REQUEST_SECONDS.count(resource="isbn", status="404") >= 1
+    assert CACHE_HITS.value(resource="author") - before[1] == 1
+
+def test_disk_cache_ttl(tmp_path):
+    cache = DiskCache(str(tmp_path), ttl=60)
+    cache.set("isbn:1", {"title": "Cached"})
+    assert cache.get("isbn:1") == {"title": "Cached"}
+    assert cache.get("isbn:2") is None
+
+    cache.ttl = -1
+    assert cache.get("isbn:1") is None
+
+def counting_handler(hits, delay=0.0):
+    def handler(request):
+        hits.append(request.url.path)
+        time.sleep(delay)
+        if request.url.path.startswith("/authors/"):
+            return httpx.Response(200, json={"name": "Stub Author"})
+        return httpx.Response(200, json={"title": "Bestseller", "authors": [{"key": "/authors/OL1A"}]})
+    return handler
+
+def test_concurrent_lookups_share_one_fetch():
+    hits = []
+    coalesced = COALESCED.value(resource="isbn")
+    client = OpenLibraryClient(transport=httpx.MockTransport(counting_handler(hits, delay=0.2)))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(client.fetch_book, ["111"] * 8))
+    assert all(result["authors"] == ["Stub Author"] for result in results)
+    assert hits == ["/isbn/111.json", "/authors/OL1A.json"]
+    assert COALESCED.value(resource="isbn") - coalesced == 7
+    client.close()
+
+def test_concurrent_async_lookups_share_one_fetch():
+    hits = []
+
+    async def handler(request):
+        await asyncio.sleep(0.05)
+        return counting_handler(hits)(request)
+
+    async def run():
+        client = AsyncOpenLibraryClient(transport=httpx.MockTransport(handler))
+        results = await asyncio.gather(*(client.fetch_book("111") for _ in range(10)))
+        await client.aclose()
+        return results
+
+    results = asyncio.run(run())
+    assert all(result["title"] == "Bestseller" for result in results)
+    assert hits == ["/isbn/111.json", "/authors/OL1A.json"]
+
+def test_async_disk_cache_runs_off_the_loop(tmp_path, monkeypatch):
+    hits, threads = [], []
+
+    def recording(method):
+        def wrapper(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return method(*args, **kwargs)
+        return wrapper
+    monkeypatch.setattr(DiskCache, "get", recording(DiskCache.get))
+    monkeypatch.setattr(DiskCache, "set", recording(DiskCache.set))
+
+    async def fetch():
+        client = AsyncOpenLibraryClient(transport=httpx.MockTransport(counting_handler(hits)),
+                                        cache_dir=str(tmp_path))
+        result = await client.fetch_book("111")
+        await client.aclose()
+        return result, threading.get_ident()
+
+    (first, loop_thread), (second, _) = asyncio.run(fetch()), asyncio.run(fetch())
+    assert first == second
+    assert hits == ["/isbn/111.json", "/authors/OL1A.json"]
+    assert threads and loop_thread not in threads
+
+def test_full_queue_fails_fast():
+    release = threading.Event()
+
+    def handler(request):
+        release.wait(5)
+        return httpx.Response(200, json={"title": "Slow"})
+
+    rejected = REJECTED.value(reason="queue_full")
+    client = OpenLibraryClient(transport=httpx.MockTransport(handler), max_connections=1,
+                               max_pending=1, queue_timeout=5)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        running = executor.submit(client.fetch_book, "1")
+        time.sleep(0.1)
+        queued = executor.submit(client.fetch_book, "2")
+        time.sleep(0.1)
+        started = time.perf_counter()
+        with pytest.raises(UpstreamBusy) as exc_info:
+            client.fetch_book("3")
+        assert time.perf_counter() - started < 0.1
+        assert exc_info.value.status == 503
+        release.set()
+        assert running.result()["title"] == queued.result()["title"] == "Slow"
+    assert REJECTED.value(reason="queue_full") - rejected == 1
+    client.close()
+
+def test_queue_wait_is_bounded():
+    async def handler(request):
+        await asyncio.sleep(0.5)
+        return httpx.Response(200, json={"title": "Slow"})
+
+    async def run():
+        client = AsyncOpenLibraryClient(transport=httpx.MockTransport(handler), max_connections=1,
+                                        queue_timeout=0.1)
+        results = await asyncio.gather(client.fetch_book("1"), client.fetch_book("2"), return_exceptions=True)
+        await client.aclose()
+        return results
+
+    first, second = asyncio.run(run())
+    assert first["title"] == "Slow"
+    assert isinstance(second, UpstreamBusy) and second.status == 503
+
+def test_upstream_rate_limit_is_reported():
+    client = OpenLibraryClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(429, headers={"Retry-After": "7"})))
+    with pytest.raises(UpstreamBusy) as exc_info:
+        client.fetch_book("111")
+    assert (exc_info.value.status, exc_info.value.retry_after) == (429, 7)
+    client.close()
+
+def test_not_found_is_cached():
+    hits = []
+
+    def handler(request):
+        hits.append(request.url.path)
+        return httpx.Response(404)
+
+    negative_hits = NEGATIVE_HITS.value(resource="isbn")
+    client = OpenLibraryClient(transport=httpx.MockTransport(handler), negative_ttl=60)
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError) as exc_info:
+            client.fetch_book("000")
+        assert exc_info.value.response.status_code == 404
+    assert hits == ["/isbn/000.json"]
+    assert NEGATIVE_HITS.value(resource="isbn") - negative_hits == 2
+
+    client.missing.ttl = -1
+    client.missing.add("isbn:000")
+    with pytest.raises(httpx.HTTPStatusError):
+        client.fetch_book("000")
+    assert len(hits) == 2
+    client.close()
+
+def test_circuit_opens_and_recovers(tmp_path):
+    hits, healthy = [], threading.Event()
+
+    def handler(request):
+        hits.append(request.url.path)
+        if not healthy.is_set():
+            return httpx.Response(503)
+        return httpx.Response(200, json={"title": "Back", "authors": []})
+
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.2)
+    client = OpenLibraryClient(transport=httpx.MockTransport(handler), breaker=breaker)
+    for isbn in ("1", "2", "3"):
+        with pytest.raises(httpx.HTTPStatusError):
+            client.fetch_book(isbn)
+    assert breaker.snapshot()["state"] == "open"
+
+    # Open: no upstream call until the reset timeout
+    with pytest.raises(UpstreamBusy) as exc_info:
+        client.fetch_book("4")
+    assert exc_info.value.status == 503 and exc_info.value.retry_after >= 1
+    assert len(hits) == 3
+
+    # Half open: a failed probe reopens the circuit, a good one closes it
+    time.sleep(0.25)
+    with pytest.raises(httpx.HTTPStatusError):
+        client.fetch_book("5")
+    assert breaker.snapshot()["state"] == "open"
+    time.sleep(0.25)
+    healthy.set()
+    assert client.fetch_book("6")["title"] == "Back"
+    assert breaker.snapshot() == {"state": "closed", "consecutive_failures": 0}
+    client.close()
+
+def test_open_circuit_serves_stale_cache(tmp_path):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    client = OpenLibraryClient(cache_dir=str(tmp_path), ttl=60, breaker=breaker,
+                               transport=httpx.MockTransport(lambda request: httpx.Response(500)))
+    client.cache.set("isbn:111", {"title": "Stale", "authors": []})
+    client.cache.ttl = -1
+    with pytest.raises(httpx.HTTPStatusError):
+        client.fetch_book("111")
+
+    stale_hits = STALE_HITS.value(resource="isbn")
+    assert client.fetch_book("111")["title"] == "Stale"
+    assert STALE_HITS.value(resource="isbn") - stale_hits == 1
+    with pytest.raises(UpstreamBusy):
+        client.fetch_book("222")
+    client.close()
@@ -0,0 +1,88 @@
+import asyncio
+import gzip
+import json
+import os
+import sys
+
+import httpx
+import pytest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from librarys2 import Library
+from openlibrary import LOCAL_HITS, AsyncOpenLibraryClient, MetadataStore, OpenLibraryClient
+from openlibrary_dump import import_dump, main as import_main
+
+def dump_line(kind, key, record):
+    return f"{kind}\t{key}\t3\t2024-01-01T00:00:00\t{json.dumps(record)}\n"
+
+EDITIONS = [
+    dump_line("/type/edition", "/books/OL1M", {
+        "title": "Dune", "isbn_10": ["0441013597"], "isbn_13": ["978-0-441-01359-3"],
+        "authors": [{"key": "/authors/OL1A"}], "publishers": ["Ace"], "covers": [1],
+    }),
+    dump_line("/type/edition", "/books/OL2M", {
+        "title": "Good Omens", "isbn_13": ["9780060853976"],
+        "authors": [{"key": "/authors/OL2A"}, {"key": "/authors/OL9A"}],
+    }),
+    dump_line("/type/edition", "/books/OL3M", {"title": "No ISBN"}),
+    dump_line("/type/work", "/works/OL1W", {"title": "Dune"}),
+    "not a dump line\n",
+]
+AUTHORS = [
+    dump_line("/type/author", "/authors/OL1A", {"name": "Frank Herbert"}),
+    dump_line("/type/author", "/authors/OL2A", {"name": "Terry Pratchett"}),
+]
+
+def write_dump(path, lines):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.writelines(lines)
+    return str(path)
+
+@pytest.fixture
+def store(tmp_path):
+    store = MetadataStore(str(tmp_path / "openlibrary.db"))
+    # Editions before authors: names are joined on lookup, not at import
+    assert import_dump(write_dump(tmp_path / "editions.txt.gz", EDITIONS), store) == {
+        'editions': 2, 'isbns': 3, 'authors': 0, 'skipped': 1}
+    assert import_dump(write_dump(tmp_path / "authors.txt.gz", AUTHORS), store)['authors'] == 2
+    yield store
+    store.close()
+
+def offline(request):
+    raise AssertionError(f"Unexpected request to {request.url}")
+
+def test_store_joins_authors_and_normalizes_isbns(store):
+    assert store.get("9780441013593") == {
+        'key': '/books/OL1M', 'title': 'Dune', 'publishers': ['Ace'], 'authors': ['Frank Herbert']}
+    assert store.get("0-441-01359-7")['title'] == "Dune"
+    assert store.get("9780060853976")['authors'] == ["Terry Pratchett", "Unknown Author"]
+    assert store.get("000") is None
+    assert store.counts() == {'editions': 3, 'authors': 2}
+
+def test_clients_use_store_before_network(store):
+    hits = LOCAL_HITS.value()
+    client = OpenLibraryClient(transport=httpx.MockTransport(offline), metadata=store)
+    assert client.fetch_book("0441013597")['authors'] == ["Frank Herbert"]
+    async_client = AsyncOpenLibraryClient(transport=httpx.MockTransport(offline), metadata=store)
+    assert asyncio.run(async_client.fetch_book("9780060853976"))['title'] == "Good Omens"
+    assert LOCAL_HITS.value() - hits == 2
+    client.close()
+
+def test_library_adds_books_without_network(store, tmp_path):
+    client = OpenLibraryClient(transport=httpx.MockTransport(offline), metadata=store)
+    lib = Library(filename=str(tmp_path / "library.json"), client=client)
+    assert lib.add_book_by_isbn("9780441013593") == "Added: Dune"
+    assert lib.find_book("9780441013593").authors == ["Frank Herbert"]
+    lib.close()
+
+def test_main_imports_plain_and_gzipped_dumps(tmp_path, capsys):
+    authors = tmp_path / "authors.txt"
+    authors.write_text("".join(AUTHORS), encoding="utf-8")
+    db_file = str(tmp_path / "cli.db")
+    import_main([db_file, write_dump(tmp_path / "editions.txt.gz", EDITIONS), str(authors)])
+    assert capsys.readouterr().out.splitlines()[-1] == f"{db_file}: 3 ISBNs, 2 authors"
+    store = MetadataStore(db_file)
+    assert store.get("9780441013593")['authors'] == ["Frank Herbert"]
+    store.close()
@@ -0,0 +1,132 @@
+import json
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+pytest.importorskip("fcntl")
+
+from librarys2 import Library
+
+RECORDS = [
+    {"title": "Dune", "authors": ["Frank Herbert"], "isbn": "111", "available": True},
+    {"title": "Good Omens", "authors": ["Terry Pratchett", "Neil Gaiman"], "isbn": "222", "available": True},
+]
+
+@pytest.fixture
+def catalog(tmp_path):
+    path = str(tmp_path / "library.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(RECORDS, f)
+    return path
+
+def test_changes_are_visible_to_other_instances(catalog):
+    a = Library(filename=catalog, storage="shared")
+    b = Library(filename=catalog, storage="shared")
+    version = b.version
+
+    assert a.borrow_book("111", borrower="ann") == "Borrowed: Dune"
+    assert not b.find_book("111").available
+    assert b.version > version
+    # b validates against the latest state, not the one it loaded
+    assert b.borrow_book("111") == "Error: Book already borrowed!"
+    assert b.add_book("Hyperion", ["Dan Simmons"], "333") == "Added: Hyperion"
+    assert [book.isbn for book in a.search("hyperion")] == ["333"]
+    assert a.stats()["borrowed_books"] == 1
+    assert a.remove_book("222") == "Removed: Good Omens"
+    assert b.find_book("222") is None
+    assert b.overdue_loans(now=a.find_book("111").loans[0].due_at + 1)[0].borrower == "ann"
+    a.close()
+    b.close()
+
+def test_compaction_by_one_instance_is_followed_by_others(catalog):
+    a = Library(filename=catalog, storage="shared", compact_every=3)
+    b = Library(filename=catalog, storage="shared", compact_every=3)
+    a.borrow_book("111")
+    a.borrow_book("222")
+    b.return_book("111")
+    # b's write compacted the journal into the catalog file and started a new one
+    assert b.storage.generation == 1
+    with open(catalog + ".journal", encoding="utf-8") as f:
+        assert f.read() == '{"op": "generation", "generation": 1}\n'
+    assert a.find_book("111").available
+    a.add_book("Hyperion", ["Dan Simmons"], "333")
+    assert b.find_book("333").title == "Hyperion"
+    assert not b.find_book("222").available
+    a.close()
+    b.close()
+
+    reloaded = Library(filename=catalog, storage="shared")
+    assert sorted(reloaded.books) == ["111", "222", "333"]
+    assert not reloaded.find_book("222").available
+    reloaded.close()
+
+def test_instance_idle_through_two_compactions_reloads(catalog):
+    a = Library(filename=catalog, storage="shared", compact_every=2)
+    b = Library(filename=catalog, storage="shared", compact_every=2)
+    a.borrow_book("111")
+    a.add_book("Hyperion", ["Dan Simmons"], "333")
+    a.borrow_book("222")
+    a.add_book("Ilium", ["Dan Simmons"], "444")
+    assert a.storage.generation == 2
+    # b only still has the first journal, the second one is gone
+    assert b.sync() == 4
+    assert b.storage.generation == 2
+    assert not b.find_book("222").available
+    assert b.borrow_book("222") == "Error: Book already borrowed!"
+    assert [book.isbn for book in b.search("simmons")] == ["333", "444"]
+    a.close()
+    b.close()
+
+def test_partial_record_from_crashed_writer_is_dropped(catalog):
+    lib = Library(filename=catalog, storage="shared")
+    lib.borrow_book("111")
+    with open(catalog + ".journal", "ab") as f:
+        f.write(b'{"op":"borrow","book":{"isb')
+    other = Library(filename=catalog, storage="shared")
+    assert other.sync() == 0
+    assert other.return_book("111") == "Returned: Dune"
+    lib.close()
+    other.close()
+
+    reloaded = Library(filename=catalog, storage="shared")
+    assert reloaded.find_book("111").available
+    reloaded.close()
+
+def test_batched_durability_is_rejected(catalog):
+    with pytest.raises(ValueError):
+        Library(filename=catalog, storage="shared", durability="batched")
+
+def stress_worker(args):
+    catalog, worker = args
+    lib = Library(filename=catalog, storage="shared", compact_every=7)
+    borrowed = 0
+    for i in range(40):
+        isbn = RECORDS[i % len(RECORDS)]["isbn"]
+        borrowed += lib.borrow_book(isbn, borrower=f"worker-{worker}").startswith("Borrowed")
+        if i % 4 == 0:
+            lib.add_book(f"Book {worker}-{i}", ["Stress Author"], f"{worker}-{i}")
+    lib.close()
+    return borrowed
+
+def test_processes_do_not_lose_updates(catalog):
+    with open(catalog, "w", encoding="utf-8") as f:
+        json.dump([dict(record, copies=5, available_copies=5) for record in RECORDS], f)
+
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        borrowed = pool.map(stress_worker, [(catalog, worker) for worker in range(4)])
+
+    # Ten copies in total: every one is lent exactly once, however the workers interleave
+    assert sum(borrowed) == 10
+    lib = Library(filename=catalog, storage="shared")
+    assert len(lib.books) == 2 + 4 * 10
+    for record in RECORDS:
+        book = lib.find_book(record["isbn"])
+        assert book.available_copies == 0
+        assert len(book.loans) == 5
+    assert lib.stats()["borrowed_copies"] == 10
+    lib.close()
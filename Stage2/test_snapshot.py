@@ -0,0 +1,123 @@
+import json
+import os
+import sys
+
+import pytest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from librarys2 import Library
+from snapshot import SnapshotReader, main as build_snapshot, write_snapshot
+
+RECORDS = [
+    {"title": "Yüzüklerin Efendisi", "authors": ["J.R.R. Tolkien"], "isbn": "9789753425426", "available": True},
+    {"title": "Dune", "authors": ["Frank Herbert"], "isbn": "111", "available": False},
+    {"title": "Good Omens", "authors": ["Terry Pratchett", "Neil Gaiman"], "isbn": "222", "available": True},
+]
+
+@pytest.fixture
+def snapshot_file(tmp_path):
+    path = str(tmp_path / "library.snap")
+    write_snapshot(path, RECORDS)
+    return path
+
+def test_reader_finds_records_by_isbn(snapshot_file):
+    reader = SnapshotReader(snapshot_file)
+    assert len(reader) == 3
+    assert [reader.isbn_at(i) for i in range(3)] == ["111", "222", "9789753425426"]
+    assert reader.record(reader.find("222")) == RECORDS[2]
+    assert reader.record(reader.find("9789753425426"))["title"] == "Yüzüklerin Efendisi"
+    assert reader.find("000") is None
+    assert reader.find("999") is None
+    reader.close()
+
+def test_library_reads_snapshot_lazily(snapshot_file):
+    lib = Library(filename=snapshot_file, storage="snapshot")
+    book = lib.find_book("111")
+    assert book.title == "Dune"
+    assert lib.find_book("111") is book
+    assert len(lib.books) == 3
+    assert [book.isbn for book in lib.search("omens")] == ["222"]
+    lib.return_book("111")
+    assert set(lib.storage.books.overlay) == {"111"}
+    lib.close()
+
+def test_reads_do_not_pin_books(tmp_path):
+    path = str(tmp_path / "library.snap")
+    write_snapshot(path, [{"title": f"Book {i}", "authors": ["Author"], "isbn": str(1000 + i), "available": True}
+                          for i in range(200)])
+    lib = Library(filename=path, storage="snapshot")
+    for i in range(200):
+        assert lib.find_book(str(1000 + i)).title == f"Book {i}"
+    assert len(lib.storage.books.overlay) == 0
+    lib.borrow_book("1000")
+    assert set(lib.storage.books.overlay) == {"1000"}
+    assert not lib.find_book("1000").available
+    lib.close()
+
+def test_snapshot_mutations_survive_restart(snapshot_file):
+    lib = Library(filename=snapshot_file, storage="snapshot")
+    lib.borrow_book("222")
+    lib.return_book("111")
+    lib.remove_book("9789753425426")
+    lib.add_book("Emma", ["Jane Austen"], "333")
+    lib.remove_book("111")
+    lib.add_book("Dune", ["Frank Herbert"], "111")
+    assert sorted(lib.books) == ["111", "222", "333"]
+    lib.close()
+
+    lib2 = Library(filename=snapshot_file, storage="snapshot")
+    assert sorted(lib2.books) == ["111", "222", "333"]
+    assert not lib2.find_book("222").available
+    assert lib2.find_book("111").available
+    assert lib2.find_book("9789753425426") is None
+    lib2.close()
+
+def test_snapshot_compaction_rewrites_file(snapshot_file):
+    lib = Library(filename=snapshot_file, storage="snapshot", compact_every=2)
+    lib.borrow_book("9789753425426")
+    lib.add_book("Emma", ["Jane Austen"], "333")
+
+    assert os.path.getsize(snapshot_file + ".journal") == 0
+    reader = SnapshotReader(snapshot_file)
+    assert len(reader) == 4
+    assert reader.record(reader.find("9789753425426"))["available"] is False
+    reader.close()
+    assert lib.find_book("333").title == "Emma"
+    lib.close()
+
+def test_compaction_keeps_books_in_use(snapshot_file):
+    lib = Library(filename=snapshot_file, storage="snapshot", compact_every=2)
+    compacted = []
+
+    def borrow_error(book, taken=0):
+        # Another thread's change compacts between this borrow's lookup and its update
+        if not compacted:
+            compacted.append(True)
+            lib.compact()
+        return Library._borrow_error(book, taken)
+
+    lib._borrow_error = borrow_error
+    assert lib.borrow_book("222") == "Borrowed: Good Omens"
+    assert compacted
+    assert not lib.find_book("222").available
+    assert lib.borrow_book("222") == "Error: Book already borrowed!"
+    lib.remove_book("222")
+    assert lib.find_book("222") is None
+    lib.close()
+
+    lib2 = Library(filename=snapshot_file, storage="snapshot")
+    assert lib2.find_book("222") is None
+    lib2.close()
+
+def test_build_snapshot_from_json(tmp_path):
+    json_file = tmp_path / "library_data.json"
+    json_file.write_text(json.dumps(RECORDS), encoding="utf-8")
+    snapshot_path = str(tmp_path / "library.snap")
+    build_snapshot([str(json_file), snapshot_path])
+
+    lib = Library(filename=snapshot_path, storage="snapshot")
+    assert {isbn: book.available for isbn, book in zip(lib.books, lib.books.values())} == \
+        {record["isbn"]: record["available"] for record in RECORDS}
+    lib.close()
@@ -0,0 +1,248 @@
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+import pytest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from librarys2 import Library
+from migrate_to_sqlite import migrate
+from metrics import Metrics
+from storage import BYTES_WRITTEN, RECORDS_WRITTEN, SqliteBooks, SqliteStorage, iter_json_array, write_json_array
+
+@pytest.fixture
+def sqlite_library(tmp_path):
+    lib = Library(filename=str(tmp_path / "library.db"), storage="sqlite")
+    yield lib
+    lib.close()
+
+def test_sqlite_crud(sqlite_library):
+    assert "Added" in sqlite_library.add_book("Dune", ["Frank Herbert"], "111")
+    assert "Error" in sqlite_library.add_book("Dune", ["Frank Herbert"], "111")
+    assert sqlite_library.find_book("111").title == "Dune"
+    assert sqlite_library.find_book("999") is None
+
+    assert "Borrowed" in sqlite_library.borrow_book("111")
+    assert "already borrowed" in sqlite_library.borrow_book("111")
+    assert not sqlite_library.find_book("111").available
+    assert "Returned" in sqlite_library.return_book("111")
+
+    assert "Removed" in sqlite_library.remove_book("111")
+    assert "Error" in sqlite_library.remove_book("111")
+    assert len(sqlite_library.books) == 0
+
+def test_sqlite_persistence(tmp_path):
+    db_file = str(tmp_path / "library.db")
+    lib = Library(filename=db_file, storage="sqlite")
+    lib.add_book("Dune", ["Frank Herbert"], "111")
+    lib.borrow_book("111")
+    lib.close()
+
+    lib2 = Library(filename=db_file, storage="sqlite")
+    assert list(lib2.books) == ["111"]
+    assert not lib2.books["111"].available
+    lib2.close()
+
+def test_sqlite_page_and_search(sqlite_library):
+    for i in range(25):
+        sqlite_library.add_book(f"Book {i}", ["Author"], f"isbn-{i:02d}")
+    page = sqlite_library.page(skip=10, limit=5)
+    assert [book.isbn for book in page] == [f"isbn-{i:02d}" for i in range(10, 15)]
+    assert len(sqlite_library.search("book", limit=50)) == 25
+
+def test_sqlite_list_page_uses_the_database(sqlite_library):
+    for isbn, title, author in [("3", "bahçe", "Mehmet"), ("1", "Armut", "Zeynep"), ("2", "armut", "Ali"),
+                                ("4", "Çiçek", "Yusuf"), ("5", "Dune", "Frank Herbert")]:
+        sqlite_library.add_book(title, [author], isbn)
+    sqlite_library.borrow_book("1")
+
+    def walk(sort):
+        seen, cursor = [], None
+        while True:
+            books, cursor = sqlite_library.list_page(sort=sort, cursor=cursor, limit=2)
+            seen.extend(book.isbn for book in books)
+            if cursor is None:
+                return seen
+
+    assert walk("isbn") == ["1", "2", "3", "4", "5"]
+    # NOCASE collation: case is ignored, accents are not folded
+    assert walk("title") == ["1", "2", "3", "5", "4"]
+    assert walk("author") == ["2", "5", "3", "4", "1"]
+    assert walk("availability") == ["2", "3", "5", "4", "1"]
+    assert [book.isbn for book in sqlite_library.list_page(sort="title", skip=1, limit=2)[0]] == ["2", "3"]
+    assert sqlite_library._orders == {}
+
+def test_sqlite_search_and_stats_use_the_database(tmp_path, monkeypatch):
+    db_file = str(tmp_path / "library.db")
+    sqlite_lib = Library(filename=db_file, storage="sqlite")
+    json_lib = Library(filename=str(tmp_path / "library.json"))
+    for lib in (sqlite_lib, json_lib):
+        lib.add_book("Yüzüklerin Efendisi", ["J.R.R. Tolkien"], "3")
+        lib.add_book("Dune Messiah", ["Frank Herbert"], "2")
+        lib.add_book("Dune", ["Frank Herbert"], "1", copies=3)
+        lib.add_book("Good Omens", ["Terry Pratchett", "Neil Gaiman"], "4")
+        lib.borrow_book("4")
+        lib.borrow_book("1")
+    monkeypatch.setattr(SqliteBooks, "values", lambda self: pytest.fail("decoded the whole table"))
+
+    def compare():
+        for query, ranked in [("dune", False), ("du her", False), ("yuzuk", False), ("xyz", False),
+                              ("herbet", True), ("frank mesiah", True), ("gaiman omens", True)]:
+            expected = [book.isbn for book in json_lib.search(query, ranked=ranked)]
+            assert [book.isbn for book in sqlite_lib.search(query, ranked=ranked)] == expected
+        assert sqlite_lib.stats(top_authors=3) == json_lib.stats(top_authors=3)
+
+    compare()
+    for lib in (sqlite_lib, json_lib):
+        lib.remove_book("2")
+        lib.add_book("Emma", ["Jane Austen"], "5")
+        lib.set_copies("1", 5)
+    compare()
+    assert [book.isbn for book in sqlite_lib.search("messiah")] == []
+    assert "messiah" not in sqlite_lib._index.tokens
+    json_lib.close()
+    sqlite_lib.close()
+
+    # Databases written before book_tokens existed are tokenized when opened
+    with sqlite3.connect(db_file) as conn:
+        conn.execute("DROP TABLE book_tokens")
+    sqlite_lib = Library(filename=db_file, storage="sqlite")
+    assert [book.isbn for book in sqlite_lib.search("dune")] == ["1"]
+    sqlite_lib.close()
+
+def test_sqlite_uses_wal_and_indexes(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "library.db"))
+    assert storage.query_one("PRAGMA journal_mode")[0] == "wal"
+    indexes = {row[1] for row in storage.query_all("PRAGMA index_list(books)")}
+    assert {"idx_books_title", "idx_books_author"} <= indexes
+    plan = storage.query_all("EXPLAIN QUERY PLAN SELECT data FROM books WHERE isbn = ?", ("1",))
+    assert "INDEX" in plan[0][3]
+    storage.close()
+
+def test_migrate_from_json(tmp_path):
+    json_file = tmp_path / "library_data.json"
+    json_file.write_text(json.dumps([
+        {"title": "Dune", "authors": ["Frank Herbert"], "isbn": "111", "available": False},
+        {"title": "Emma", "authors": ["Jane Austen"], "isbn": "222", "available": True},
+    ]), encoding="utf-8")
+    db_file = str(tmp_path / "library.db")
+
+    assert migrate(str(json_file), db_file, batch_size=1) == 2
+    lib = Library(filename=db_file, storage="sqlite")
+    assert list(lib.books) == ["111", "222"]
+    assert not lib.books["111"].available
+    lib.close()
+
+def test_migrate_applies_pending_journal(tmp_path):
+    json_file = str(tmp_path / "library_data.json")
+    lib = Library(filename=json_file, storage="journal")
+    for isbn in ("111", "222", "333"):
+        lib.add_book(f"Book {isbn}", ["Someone"], isbn)
+    lib.compact()
+    lib.borrow_book("111")
+    lib.remove_book("222")
+    lib.add_book("Emma", ["Jane Austen"], "444")
+    lib.close()
+    db_file = str(tmp_path / "library.db")
+
+    assert migrate(json_file, db_file, batch_size=2) == 3
+    lib = Library(filename=db_file, storage="sqlite")
+    assert sorted(lib.books) == ["111", "333", "444"]
+    assert not lib.books["111"].available
+    lib.close()
+
+def test_sqlite_batched_durability(tmp_path):
+    db_file = str(tmp_path / "library.db")
+    lib = Library(filename=db_file, storage="sqlite", durability="batched", flush_interval_ms=10000)
+    lib.add_book("Dune", ["Frank Herbert"], "111")
+    assert "Borrowed" in lib.borrow_book("111")
+    assert "already borrowed" in lib.borrow_book("111")
+    lib.close()
+
+    lib2 = Library(filename=db_file, storage="sqlite")
+    assert not lib2.books["111"].available
+    lib2.close()
+
+def test_sqlite_batch_is_not_committed_by_other_writers(tmp_path):
+    db_file = str(tmp_path / "library.db")
+    lib = Library(filename=db_file, storage="sqlite")
+    lib.add_book("Dune", ["Frank Herbert"], "111")
+    reader = sqlite3.connect(db_file)
+    other = threading.Thread(target=lib.borrow_book, args=("111",))
+    with lib.batch():
+        lib.add_book("Emma", ["Jane Austen"], "a")
+        other.start()
+        other.join(0.2)
+        # The concurrent borrow waits instead of committing half of the batch
+        assert other.is_alive()
+        lib.add_book("Ilium", ["Dan Simmons"], "b")
+        assert reader.execute("SELECT isbn FROM books ORDER BY isbn").fetchall() == [("111",)]
+    other.join()
+    assert reader.execute("SELECT isbn, available FROM books ORDER BY isbn").fetchall() == [
+        ("111", 0), ("a", 1), ("b", 1)]
+    reader.close()
+    lib.close()
+
+TRICKY_RECORDS = [
+    {"title": "Brackets ] and , commas [", "authors": ["A \"Quoted\" Name"], "isbn": "1", "available": True},
+    {"title": "Yüzüklerin Efendisi", "authors": ["J.R.R. Tolkien", "Çevirmen"], "isbn": "2", "available": False},
+]
+
+def test_write_json_array_matches_json_dump():
+    for records in ([], TRICKY_RECORDS):
+        out = io.StringIO()
+        assert write_json_array(out, iter(records)) == len(records)
+        assert out.getvalue() == json.dumps(records, indent=2, ensure_ascii=False)
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_iter_json_array_streams_records(chunk_size):
+    text = json.dumps(TRICKY_RECORDS, indent=2, ensure_ascii=False)
+    assert list(iter_json_array(io.StringIO(text), chunk_size)) == TRICKY_RECORDS
+    assert list(iter_json_array(io.StringIO(" [ ] "), chunk_size)) == []
+
+def test_iter_json_array_rejects_truncated_input():
+    text = json.dumps(TRICKY_RECORDS)
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(text[:-5]), 8))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"not": "a list"}')))
+
+def test_storage_metrics_count_bytes_and_records(tmp_path):
+    filename = str(tmp_path / "library.json")
+    lib = Library(filename=filename, storage="journal", compact_every=3)
+    json_bytes = BYTES_WRITTEN.value(storage="journal")
+    lib.add_book("Dune", ["Frank Herbert"], "111")
+    lib.borrow_book("111")
+    assert BYTES_WRITTEN.value(storage="journal") - json_bytes == os.path.getsize(filename + ".journal")
+
+    records = RECORDS_WRITTEN.value(storage="journal")
+    lib.return_book("111")
+    # The third change triggers compaction: one journal record plus one snapshot record
+    assert RECORDS_WRITTEN.value(storage="journal") - records == 2
+    lib.close()
+
+def test_metrics_render_prometheus_text():
+    registry = Metrics()
+    registry.counter("books_total", "Books").inc(2, shelf='a"b')
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    assert registry.render().splitlines() == [
+        "# HELP books_total Books",
+        "# TYPE books_total counter",
+        'books_total{shelf="a\\"b"} 2',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        "latency_seconds_sum 0.55",
+        "latency_seconds_count 2",
+    ]
+    with pytest.raises(ValueError):
+        registry.histogram("books_total", "Books")
@@ -1,98 +1,301 @@
+import asyncio
+import hashlib
 import sys
 import os
+import logging
+import json
+import math
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, status, Query
-from pydantic import BaseModel, ConfigDict
-from typing import List
+from fastapi import FastAPI, HTTPException, status, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+from typing import Callable, Dict, List, Optional, Tuple
 import httpx
 
 current_dir = Path(__file__).parent
 stage2_path = current_dir.parent / "Stage2"
 sys.path.insert(0, str(stage2_path))
 
+logger = logging.getLogger(__name__)
+
 try:
+    from jobs import JobRunner, JobStore
     from librarys2 import Library
-    print(f"Library module successfully imported: {stage2_path}/librarys2.py")
+    from lru import LRUCache
+    from metrics import metrics
+    from openlibrary import AsyncOpenLibraryClient, CircuitBreaker, MetadataStore, OpenLibraryClient, UpstreamBusy
+    logger.debug("Library module imported from %s", stage2_path)
 except ImportError as e:
-    print(f"Import error: {e}")
-    print(f"Python paths: {sys.path}")
+    logger.error("Import error: %s (Python paths: %s)", e, sys.path)
     raise
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    JOB_RUNNER.start()
+    yield
+    JOB_RUNNER.stop()
+    JOB_STORE.close()
+    lib.close()
+
 app = FastAPI(
     title="Library Management API",
     description="API for managing books with Open Library integration",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
-JSON_FILE = os.path.abspath(os.path.join(current_dir, "library_data.json"))
+DATA_DIR = os.environ.get("LIBRARY_DATA_DIR", str(current_dir))
+JSON_FILE = os.path.abspath(os.path.join(DATA_DIR, "library_data.json"))
 if not os.path.exists(JSON_FILE):
     with open(JSON_FILE, "w", encoding="utf-8") as f:
         f.write("[]")
-print(f"Library file path: {JSON_FILE}")
-lib = Library(JSON_FILE)
+logger.debug("Library file path: %s", JSON_FILE)
+STORAGE = os.environ.get("LIBRARY_STORAGE", "json")
+DURABILITY = os.environ.get("LIBRARY_DURABILITY", "per_op")
+FLUSH_INTERVAL_MS = int(os.environ.get("LIBRARY_FLUSH_INTERVAL_MS", "50"))
+FLUSH_OPS = int(os.environ.get("LIBRARY_FLUSH_OPS", "100"))
+DB_FILE = os.path.abspath(os.path.join(DATA_DIR, "library_data.db"))
+SNAPSHOT_FILE = os.path.abspath(os.path.join(DATA_DIR, "library_data.snap"))
+DATA_FILES = {"sqlite": DB_FILE, "snapshot": SNAPSHOT_FILE}
+CACHE_DIR = os.path.abspath(os.path.join(DATA_DIR, ".openlibrary_cache"))
+# Built from the Open Library dumps with Stage2/openlibrary_dump.py; consulted before the network
+METADATA_FILE = os.environ.get("LIBRARY_OPENLIBRARY_DB", os.path.join(DATA_DIR, "openlibrary.db"))
+METADATA = MetadataStore(METADATA_FILE) if os.path.exists(METADATA_FILE) else None
+# One breaker for both clients: they call the same upstream
+BREAKER = CircuitBreaker()
+lib = Library(
+    DATA_FILES.get(STORAGE, JSON_FILE),
+    storage=STORAGE,
+    client=OpenLibraryClient(cache_dir=CACHE_DIR, metadata=METADATA, breaker=BREAKER),
+    async_client=AsyncOpenLibraryClient(cache_dir=CACHE_DIR, metadata=METADATA, breaker=BREAKER),
+    durability=DURABILITY,
+    flush_interval_ms=FLUSH_INTERVAL_MS,
+    flush_ops=FLUSH_OPS
+)
+# Background ISBN lookups for POST /books/isbn?background=true; the queue is shared by all workers
+JOBS_FILE = os.path.abspath(os.path.join(DATA_DIR, "jobs.db"))
+JOB_STORE = JobStore(JOBS_FILE)
+JOB_RUNNER = JobRunner(lib, JOB_STORE, workers=int(os.environ.get("LIBRARY_JOB_WORKERS", "4")))
+
+RESPONSE_CACHE = LRUCache(int(os.environ.get("LIBRARY_RESPONSE_CACHE_SIZE", "1024")))
+# Versions restart at zero with the process, so ETags also carry a per-process tag
+ETAG_PREFIX = uuid.uuid4().hex[:8]
+CACHE_HITS = metrics.counter("library_api_cache_hits_total", "Read responses served from the response cache")
+CACHE_MISSES = metrics.counter("library_api_cache_misses_total", "Read responses rendered and cached")
+NOT_MODIFIED = metrics.counter("library_api_not_modified_total", "Conditional reads answered with 304")
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    return any(tag.strip() in ("*", etag, f"W/{etag}") for tag in if_none_match.split(","))
+
+def cached_response(request: Request, route: str,
+                    render: Callable[[], Tuple[bytes, Dict[str, str]]]) -> Response:
+    # The version is read before rendering: a change racing with render() can only
+    # make an entry newer than its key, never older. With shared storage, other
+    # workers' changes are applied first so they bump the version too.
+    lib.sync()
+    version = lib.version
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())), version)
+    # The version is catalog-wide, so the tag also names the route and its params
+    digest = hashlib.blake2b(repr(key[:2]).encode('utf-8'), digest_size=8).hexdigest()
+    etag = f'"{ETAG_PREFIX}-{version}-{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        NOT_MODIFIED.inc(route=route)
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    entry = RESPONSE_CACHE.get(key)
+    if entry is None:
+        CACHE_MISSES.inc(route=route)
+        entry = render()
+        RESPONSE_CACHE.set(key, entry)
+    else:
+        CACHE_HITS.inc(route=route)
+    body, extra_headers = entry
+    return Response(content=body, media_type="application/json", headers={**headers, **extra_headers})
 
 class BookModel(BaseModel):
     title: str
     authors: List[str]
     isbn: str
     available: bool
+    copies: int = 1
+    available_copies: int = 1
 
     model_config = ConfigDict(from_attributes=True)
 
 class ISBNModel(BaseModel):
     isbn: str
 
+BOOK = TypeAdapter(BookModel)
+BOOK_LIST = TypeAdapter(List[BookModel])
+
+def render_books(books) -> bytes:
+    return BOOK_LIST.dump_json(BOOK_LIST.validate_python(books, from_attributes=True))
+
 class BookCreateModel(BaseModel):
     title: str
     authors: List[str]
     isbn: str
+    copies: int = Field(1, ge=1)
+
+class CopiesModel(BaseModel):
+    copies: int = Field(..., ge=1)
 
 class BorrowReturnModel(BaseModel):
     isbn: str
 
+class BorrowerModel(BaseModel):
+    borrower: Optional[str] = None
+
+class LoanRequestModel(BorrowerModel):
+    days: Optional[float] = Field(None, gt=0, description="Loan period, defaults to the library's")
+
+class BatchAddModel(BaseModel):
+    books: List[BookCreateModel] = Field(..., min_length=1, max_length=100)
+
+class BatchLoanModel(LoanRequestModel):
+    isbns: List[str] = Field(..., min_length=1, max_length=100)
+
+class BatchItemModel(BaseModel):
+    isbn: str
+    ok: bool
+    message: str
+
+class BatchResultModel(BaseModel):
+    applied: bool
+    results: List[BatchItemModel]
+
+def batch_response(response: Response, isbns: List[str], results: List[str]) -> BatchResultModel:
+    # Batches are all or nothing, so one error means nothing was applied
+    applied = not any("Error" in result for result in results)
+    if not applied:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+    return BatchResultModel(
+        applied=applied,
+        results=[BatchItemModel(isbn=isbn, ok=applied, message=result) for isbn, result in zip(isbns, results)]
+    )
+
+class JobModel(BaseModel):
+    id: str
+    isbn: str
+    status: str
+    result: Optional[str] = None
+    attempts: int
+    created_at: datetime
+    updated_at: datetime
+
+class LoanModel(BaseModel):
+    id: str
+    isbn: str
+    borrower: Optional[str]
+    borrowed_at: datetime
+    due_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
 @app.post("/books/isbn", response_model=BookModel, status_code=status.HTTP_201_CREATED)
-def add_book_by_isbn(isbn_data: ISBNModel):
-    result = lib.add_book_by_isbn(isbn_data.isbn)
+async def add_book_by_isbn(
+    isbn_data: ISBNModel,
+    background: bool = Query(False, description="Queue the lookup and answer 202 with a job instead of waiting")
+):
+    if background:
+        # The job store waits on SQLite locks that job workers in every process take
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, submit_isbn_job, isbn_data.isbn)
+    try:
+        result = await lib.add_book_by_isbn_async(isbn_data.isbn)
+    except UpstreamBusy as e:
+        # 503 when our own queue to Open Library is full, 429 when Open Library rate limits us
+        raise HTTPException(e.status, detail=f"Error: {e}", headers={"Retry-After": str(math.ceil(e.retry_after))})
     if "Error" in result:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=result)
     return lib.books[isbn_data.isbn]
 
+def submit_isbn_job(isbn: str) -> JSONResponse:
+    if not isbn:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Error: ISBN is required!")
+    if lib.find_book(isbn) is not None:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Error: ISBN {isbn} already exists!")
+    job = JOB_RUNNER.submit(isbn)
+    return JSONResponse(JobModel(**job).model_dump(mode="json"), status_code=status.HTTP_202_ACCEPTED,
+                        headers={"Location": f"/jobs/{job['id']}"})
+
+@app.get("/jobs/{job_id}", response_model=JobModel)
+def get_job(job_id: str):
+    job = JOB_STORE.get(job_id)
+    if job is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Error: Job not found!")
+    return job
+
 @app.post("/books", response_model=BookModel, status_code=status.HTTP_201_CREATED)
 def add_book_manual(book: BookCreateModel):
-    result = lib.add_book(book.title, book.authors, book.isbn)
+    result = lib.add_book(book.title, book.authors, book.isbn, book.copies)
     if "Error" in result:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=result)
     return lib.books[book.isbn]
 
+@app.post("/books/batch", response_model=BatchResultModel)
+def add_books_batch(batch: BatchAddModel, response: Response):
+    books = [book.model_dump() for book in batch.books]
+    return batch_response(response, [book["isbn"] for book in books], lib.add_books(books))
+
+@app.post("/books/batch/borrow", response_model=BatchResultModel)
+def borrow_books_batch(batch: BatchLoanModel, response: Response):
+    due_at = time.time() + batch.days * 24 * 3600 if batch.days else None
+    return batch_response(response, batch.isbns, lib.borrow_books(batch.isbns, borrower=batch.borrower, due_at=due_at))
+
+@app.post("/books/batch/return", response_model=BatchResultModel)
+def return_books_batch(batch: BatchLoanModel, response: Response):
+    return batch_response(response, batch.isbns, lib.return_books(batch.isbns, borrower=batch.borrower))
+
 @app.get("/books", response_model=List[BookModel])
 def list_books(
+    request: Request,
     skip: int = Query(0, ge=0, description="Number of records to skip"),
-    limit: int = Query(10, ge=1, le=100, description="Number of records per page")
+    limit: int = Query(10, ge=1, le=100, description="Number of records per page"),
+    sort: str = Query("isbn", pattern="^(isbn|title|author|availability)$", description="Sort order"),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page")
 ):
-    books_list = list(lib.books.values())
-    return books_list[skip:skip + limit]
+    def render():
+        try:
+            books, next_cursor = lib.list_page(sort=sort, cursor=cursor, skip=skip, limit=limit)
+        except ValueError as e:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+        return render_books(books), {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return cached_response(request, "list_books", render)
 
 @app.get("/books/search", response_model=List[BookModel])
 def search_books(
+    request: Request,
     query: str = Query(..., min_length=2, description="Search term"),
-    limit: int = Query(10, ge=1, le=50, description="Maximum number of results")
+    limit: int = Query(10, ge=1, le=50, description="Maximum number of results"),
+    ranked: bool = Query(False, description="Rank by relevance and tolerate typos")
 ):
-    results = [
-        book for book in lib.books.values()
-        if query.lower() in book.title.lower() or 
-        any(query.lower() in author.lower() for author in book.authors)
-    ]
-    return results[:limit]
+    return cached_response(request, "search_books",
+                           lambda: (render_books(lib.search(query, limit, ranked=ranked)), {}))
 
 @app.get("/books/{isbn}", response_model=BookModel)
-def get_book(isbn: str):
-    book = lib.find_book(isbn)
-    if not book:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Book with ISBN: {isbn} not found"
-        )
-    return book
+async def get_book(request: Request, isbn: str):
+    def render():
+        book = lib.find_book(isbn)
+        if not book:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Book with ISBN: {isbn} not found"
+            )
+        return BOOK.dump_json(BOOK.validate_python(book, from_attributes=True)), {}
+    if lib.storage.shared:
+        # sync() waits for Library._lock, which a compacting writer holds for the whole rewrite
+        return await run_in_threadpool(cached_response, request, "get_book", render)
+    # Otherwise this is a dict lookup, cheaper than the hop to the threadpool
+    return cached_response(request, "get_book", render)
 
 @app.delete("/books/{isbn}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_book(isbn: str):
@@ -101,43 +304,77 @@ def delete_book(isbn: str):
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail=result)
 
 @app.put("/books/{isbn}/borrow", response_model=BookModel)
-def borrow_book(isbn: str):
-    result = lib.borrow_book(isbn)
+def borrow_book(isbn: str, loan: Optional[LoanRequestModel] = None):
+    loan = loan or LoanRequestModel()
+    due_at = time.time() + loan.days * 24 * 3600 if loan.days else None
+    result = lib.borrow_book(isbn, borrower=loan.borrower, due_at=due_at)
     if "Error" in result:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=result)
     return lib.books[isbn]
 
 @app.put("/books/{isbn}/return", response_model=BookModel)
-def return_book(isbn: str):
-    result = lib.return_book(isbn)
+def return_book(isbn: str, borrower: Optional[BorrowerModel] = None):
+    result = lib.return_book(isbn, borrower=borrower.borrower if borrower else None)
     if "Error" in result:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=result)
     return lib.books[isbn]
 
+@app.put("/books/{isbn}/copies", response_model=BookModel)
+def set_copies(isbn: str, copies: CopiesModel):
+    result = lib.set_copies(isbn, copies.copies)
+    if "not found" in result:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=result)
+    if "Error" in result:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=result)
+    return lib.books[isbn]
+
+@app.get("/loans/overdue", response_model=List[LoanModel])
+def overdue_loans(limit: int = Query(100, ge=1, le=1000, description="Maximum number of loans")):
+    return lib.overdue_loans(limit=limit)
+
+@app.get("/loans/due", response_model=List[LoanModel])
+def loans_due(
+    hours: float = Query(24, gt=0, le=24 * 365, description="Look-ahead window"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of loans")
+):
+    return lib.loans_due(within=hours * 3600, limit=limit)
+
 @app.get("/health")
 def health_check():
+    lib.sync()
     return {
         "status": "healthy",
         "total_books": len(lib.books),
         "data_file": JSON_FILE,
-        "file_exists": os.path.exists(JSON_FILE)
+        "file_exists": os.path.exists(JSON_FILE),
+        "storage": STORAGE,
+        "durability": lib.durability,
+        "pending_writes": lib.pending_writes,
+        "openlibrary": BREAKER.snapshot(),
+        "jobs": JOB_STORE.counts()
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/stats")
-def get_stats():
-    total_books = len(lib.books)
-    available_books = sum(1 for book in lib.books.values() if book.available)
-    borrowed_books = total_books - available_books
-    return {
-        "total_books": total_books,
-        "available_books": available_books,
-        "borrowed_books": borrowed_books
-    }
+def get_stats(
+    request: Request,
+    top_authors: int = Query(0, ge=0, le=100, description="Include the N authors with the most books")
+):
+    return cached_response(request, "stats", lambda: (json.dumps(lib.stats(top_authors)).encode("utf-8"), {}))
 
 if __name__ == "__main__":
     import uvicorn
-    print("Starting API... http://localhost:8000")
-    print(f"JSON file path: {JSON_FILE}")
-    print(f"Initial book count: {len(lib.books)}")
-    print(f"File exists?: {os.path.exists(JSON_FILE)}")
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
\ No newline at end of file
+    logging.basicConfig(level=os.environ.get("LIBRARY_LOG_LEVEL", "INFO"),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    workers = int(os.environ.get("LIBRARY_WORKERS", "1"))
+    if workers > 1 and not lib.storage.shared:
+        # Each worker would keep its own copy of the catalog and overwrite the others' changes
+        raise SystemExit("Error: LIBRARY_WORKERS > 1 needs LIBRARY_STORAGE=shared")
+    logger.info("Starting API on http://localhost:8000 with %d books from %s", len(lib.books), lib.filename)
+    if workers > 1:
+        uvicorn.run("api:app", app_dir=str(current_dir), host="0.0.0.0", port=8000, log_level="info", workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
\ No newline at end of file
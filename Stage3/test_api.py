@@ -1,6 +1,10 @@
+import base64
 import pytest
 from fastapi.testclient import TestClient
-from api import app, JSON_FILE
+from api import app, BREAKER, JOB_RUNNER, JSON_FILE, lib
+from openlibrary import AsyncOpenLibraryClient, OpenLibraryClient
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
 
@@ -67,4 +71,243 @@ def test_search_books():
     
     response = client.get("/books/search", params={"query": "test"})
     assert response.status_code == 200
-    assert len(response.json()) > 0
\ No newline at end of file
+    assert len(response.json()) > 0
+
+def test_ranked_search_books():
+    client.post("/books", json={"title": "Ranked Hobbit", "authors": ["J.R.R. Tolkien"], "isbn": "ranked-1"})
+    assert client.get("/books/search", params={"query": "tolkein"}).json() == []
+    response = client.get("/books/search", params={"query": "tolkein", "ranked": "true"})
+    assert [book["isbn"] for book in response.json()] == ["ranked-1"]
+    lib.remove_book("ranked-1")
+
+def test_add_book_by_isbn_async_lookup(monkeypatch):
+    def handler(request):
+        if request.url.path.startswith("/authors/"):
+            return httpx.Response(200, json={"name": "Stub Author"})
+        return httpx.Response(200, json={"title": "Stub Title", "authors": [{"key": "/authors/OL1A"}]})
+    monkeypatch.setattr(lib, "async_client", AsyncOpenLibraryClient(transport=httpx.MockTransport(handler)))
+
+    response = client.post("/books/isbn", json={"isbn": "5555555555"})
+    assert response.status_code == 201
+    assert response.json()["authors"] == ["Stub Author"]
+    lib.remove_book("5555555555")
+
+def test_add_book_by_isbn_upstream_rate_limited(monkeypatch):
+    handler = lambda request: httpx.Response(429, headers={"Retry-After": "7"})
+    monkeypatch.setattr(lib, "async_client", AsyncOpenLibraryClient(transport=httpx.MockTransport(handler)))
+
+    response = client.post("/books/isbn", json={"isbn": "6666666666"})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "7"
+    assert lib.find_book("6666666666") is None
+
+def test_add_book_by_isbn_circuit_open(monkeypatch):
+    hits = []
+
+    def handler(request):
+        hits.append(request.url.path)
+        return httpx.Response(502)
+
+    monkeypatch.setattr(BREAKER, "failure_threshold", 2)
+    monkeypatch.setattr(lib, "async_client", AsyncOpenLibraryClient(transport=httpx.MockTransport(handler),
+                                                                    breaker=BREAKER))
+    # Earlier tests may have left failures behind
+    BREAKER.record(True)
+    try:
+        for isbn in ("7777777771", "7777777772"):
+            assert client.post("/books/isbn", json={"isbn": isbn}).status_code == 400
+        response = client.post("/books/isbn", json={"isbn": "7777777773"})
+        assert response.status_code == 503
+        assert int(response.headers["retry-after"]) >= 1
+        assert len(hits) == 2
+        health = client.get("/health").json()["openlibrary"]
+        assert health["state"] == "open" and health["consecutive_failures"] == 2
+    finally:
+        BREAKER.record(True)
+    assert client.get("/health").json()["openlibrary"]["state"] == "closed"
+
+def test_add_book_by_isbn_in_background(monkeypatch):
+    def handler(request):
+        if request.url.path == "/isbn/8888888888.json":
+            return httpx.Response(200, json={"title": "Queued Book", "authors": [{"key": "/authors/OL8A"}]})
+        return httpx.Response(200, json={"name": "Queued Author"})
+
+    monkeypatch.setattr(lib, "client", OpenLibraryClient(transport=httpx.MockTransport(handler)))
+    response = client.post("/books/isbn?background=true", json={"isbn": "8888888888"})
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status"] == "queued"
+    assert response.headers["location"] == f"/jobs/{job['id']}"
+    # The same ISBN while the first lookup is pending joins it
+    assert client.post("/books/isbn?background=true", json={"isbn": "8888888888"}).json()["id"] == job["id"]
+    assert client.get("/health").json()["jobs"]["queued"] >= 1
+
+    while JOB_RUNNER.run_once():
+        pass
+    job = client.get(response.headers["location"]).json()
+    assert (job["status"], job["result"], job["attempts"]) == ("done", "Added: Queued Book", 1)
+    assert client.get("/books/8888888888").json()["title"] == "Queued Book"
+    assert client.post("/books/isbn?background=true", json={"isbn": "8888888888"}).status_code == 400
+    assert client.get("/jobs/unknown").status_code == 404
+
+def test_concurrent_borrow_return_requests():
+    isbns = [f"stress-{i}" for i in range(3)]
+    for isbn in isbns:
+        client.post("/books", json={"title": f"Stress {isbn}", "authors": ["Load"], "isbn": isbn})
+
+    def call(i):
+        isbn = isbns[i % len(isbns)]
+        action = "borrow" if (i // len(isbns)) % 2 == 0 else "return"
+        return isbn, action, client.put(f"/books/{isbn}/{action}").status_code
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(call, range(2000)))
+
+    assert {code for _, _, code in results} <= {200, 400}
+    lib.flush()
+    with open(JSON_FILE, encoding="utf-8") as f:
+        saved = {book["isbn"]: book["available"] for book in json.load(f)}
+    for isbn in isbns:
+        borrows = sum(1 for i, a, code in results if i == isbn and a == "borrow" and code == 200)
+        returns = sum(1 for i, a, code in results if i == isbn and a == "return" and code == 200)
+        assert borrows - returns in (0, 1)
+        assert lib.books[isbn].available == (borrows == returns)
+        assert saved[isbn] == lib.books[isbn].available
+        lib.remove_book(isbn)
+
+def test_list_books_cursor_pagination():
+    isbns = [f"page-{i}" for i in range(5)]
+    for isbn in isbns:
+        client.post("/books", json={"title": f"Title {isbn}", "authors": ["Pager"], "isbn": isbn})
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, "sort": "title"}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/books", params=params)
+        assert response.status_code == 200
+        seen.extend(book["isbn"] for book in response.json() if book["isbn"].startswith("page-"))
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == isbns
+
+    assert client.get("/books", params={"cursor": "garbage"}).status_code == 400
+    for key in (5, [[1]]):
+        cursor = base64.urlsafe_b64encode(json.dumps(["isbn", key]).encode()).decode()
+        assert client.get("/books", params={"cursor": cursor}).status_code == 400
+    assert client.get("/books", params={"sort": "price"}).status_code == 422
+    for isbn in isbns:
+        lib.remove_book(isbn)
+
+def test_stats():
+    client.post("/books", json=TEST_BOOK)
+    client.put(f"/books/{TEST_BOOK['isbn']}/borrow")
+
+    stats = client.get("/stats", params={"top_authors": 5}).json()
+    assert stats["borrowed_books"] >= 1
+    assert stats["total_books"] == stats["available_books"] + stats["borrowed_books"]
+    assert {"author": "Test Author", "books": 1} in stats["top_authors"]
+    client.put(f"/books/{TEST_BOOK['isbn']}/return")
+
+def test_metrics():
+    client.post("/books", json={**TEST_BOOK, "isbn": "metrics-1"})
+    client.delete("/books/metrics-1")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert "# TYPE library_storage_save_seconds histogram" in body
+    assert 'library_storage_save_seconds_bucket{storage="json",le="+Inf"}' in body
+    assert 'library_storage_bytes_written_total{storage="json"}' in body
+    assert 'library_load_seconds_count{storage="json"}' in body
+
+def test_book_copies():
+    isbn = "copies-1"
+    response = client.post("/books", json={**TEST_BOOK, "isbn": isbn, "copies": 2})
+    assert (response.json()["copies"], response.json()["available_copies"]) == (2, 2)
+
+    assert client.put(f"/books/{isbn}/borrow").json()["available_copies"] == 1
+    assert client.put(f"/books/{isbn}/borrow").json()["available"] is False
+    assert client.put(f"/books/{isbn}/borrow").status_code == 400
+
+    assert client.put(f"/books/{isbn}/copies", json={"copies": 1}).status_code == 400
+    assert client.put(f"/books/{isbn}/copies", json={"copies": 3}).json()["available_copies"] == 1
+    assert client.put("/books/missing/copies", json={"copies": 3}).status_code == 404
+    assert client.get("/stats").json()["borrowed_copies"] >= 2
+    lib.remove_book(isbn)
+
+def test_loans_endpoints():
+    isbn = "loans-1"
+    client.post("/books", json={**TEST_BOOK, "isbn": isbn, "copies": 3})
+    client.put(f"/books/{isbn}/borrow", json={"borrower": "alice", "days": 0.5})
+    client.put(f"/books/{isbn}/borrow", json={"borrower": "bob", "days": 7})
+    lib.borrow_book(isbn, borrower="carol", due_at=1)
+
+    overdue = client.get("/loans/overdue").json()
+    assert [loan["borrower"] for loan in overdue if loan["isbn"] == isbn] == ["carol"]
+    due = [loan for loan in client.get("/loans/due", params={"hours": 24}).json() if loan["isbn"] == isbn]
+    assert [loan["borrower"] for loan in due] == ["alice"]
+    assert due[0]["due_at"] > due[0]["borrowed_at"]
+
+    assert client.put(f"/books/{isbn}/return", json={"borrower": "dave"}).status_code == 400
+    assert client.put(f"/books/{isbn}/return", json={"borrower": "carol"}).status_code == 200
+    assert client.get("/loans/overdue").json() == [loan for loan in overdue if loan["isbn"] != isbn]
+    lib.remove_book(isbn)
+
+def test_batch_endpoints():
+    books = [{**TEST_BOOK, "isbn": f"batch-{i}"} for i in range(3)]
+    response = client.post("/books/batch", json={"books": books})
+    assert response.status_code == 200
+    assert response.json()["applied"] is True
+
+    isbns = [book["isbn"] for book in books]
+    response = client.post("/books/batch/borrow", json={"isbns": isbns + ["missing"], "borrower": "kiosk"})
+    assert response.status_code == 400
+    results = response.json()["results"]
+    assert [item["ok"] for item in results] == [False] * 4
+    assert "not found" in results[3]["message"]
+    assert all(lib.books[isbn].available for isbn in isbns)
+
+    response = client.post("/books/batch/borrow", json={"isbns": isbns, "borrower": "kiosk", "days": 7})
+    assert response.json()["applied"] is True
+    assert not any(lib.books[isbn].available for isbn in isbns)
+    response = client.post("/books/batch/return", json={"isbns": isbns, "borrower": "kiosk"})
+    assert [item["message"] for item in response.json()["results"]] == ["Returned: Test Book"] * 3
+    assert client.post("/books/batch/borrow", json={"isbns": []}).status_code == 422
+    for isbn in isbns:
+        lib.remove_book(isbn)
+
+def test_etag_and_response_cache():
+    from api import CACHE_HITS, RESPONSE_CACHE
+    isbn = "etag-1"
+    client.post("/books", json={**TEST_BOOK, "isbn": isbn})
+
+    first = client.get(f"/books/{isbn}")
+    etag = first.headers["ETag"]
+    hits = CACHE_HITS.value(route="get_book")
+    second = client.get(f"/books/{isbn}")
+    assert second.content == first.content
+    assert CACHE_HITS.value(route="get_book") == hits + 1
+
+    assert client.get(f"/books/{isbn}", headers={"If-None-Match": etag}).status_code == 304
+    # Another route or other params at the same version is a different representation
+    assert client.get("/stats", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/books/search?query=etag", headers={"If-None-Match": etag}).status_code == 200
+    listing = client.get("/books?limit=5")
+    assert client.get("/books?limit=5", headers={"If-None-Match": listing.headers["ETag"]}).status_code == 304
+    assert client.get("/books?limit=6", headers={"If-None-Match": listing.headers["ETag"]}).status_code == 200
+
+    version = lib.version
+    client.put(f"/books/{isbn}/borrow")
+    assert lib.version > version
+    changed = client.get(f"/books/{isbn}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()["available"] is False
+
+    assert client.get("/books/missing-etag").status_code == 404
+    assert len(RESPONSE_CACHE) > 0
+    lib.remove_book(isbn)
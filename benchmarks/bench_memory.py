@@ -0,0 +1,50 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Stage2"))
+
+from catalog import generate_records
+from librarys2 import Book
+
+class LegacyBook:
+    def __init__(self, title: str, authors: List[str], isbn: str):
+        self.title = title
+        self.authors = authors
+        self.isbn = isbn
+        self.available = True
+
+def measure(book_class, catalog: str) -> int:
+    # Parse inside the trace so the strings json.loads creates are counted,
+    # then drop the parsed records and keep only the Book objects
+    gc.collect()
+    tracemalloc.start()
+    books = {}
+    for record in json.loads(catalog):
+        book = book_class(record['title'], record['authors'], record['isbn'])
+        book.available = record['available']
+        books[record['isbn']] = book
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare catalog memory of the slotted Book against the old layout")
+    parser.add_argument("--books", type=int, default=200_000)
+    args = parser.parse_args(argv)
+
+    catalog = json.dumps(generate_records(args.books))
+    legacy = measure(LegacyBook, catalog)
+    current = measure(Book, catalog)
+    print(f"{'layout':<10} {'total MiB':>10} {'bytes/book':>11}")
+    for name, size in (("legacy", legacy), ("slotted", current)):
+        print(f"{name:<10} {size / 2**20:>10.1f} {size / args.books:>11.0f}")
+    print(f"saved: {(1 - current / legacy) * 100:.0f}%")
+
+if __name__ == "__main__":
+    main()
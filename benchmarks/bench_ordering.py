@@ -0,0 +1,70 @@
+import argparse
+import os
+import random
+import sys
+import time
+from bisect import bisect_left, bisect_right, insort
+from typing import Callable, Iterable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Stage2"))
+
+from catalog import generate_records
+from librarys2 import Book
+from ordering import SORT_KEYS, SortedIndex
+
+class LegacySortedIndex:
+    # The single sorted list SortedIndex used before it was split into blocks
+    def __init__(self, key: Callable, books: Iterable = ()):
+        self.key = key
+        self.keys: List[Tuple] = sorted(key(book) for book in books)
+
+    def add(self, book) -> None:
+        insort(self.keys, self.key(book))
+
+    def remove(self, book) -> None:
+        key = self.key(book)
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+
+    def page(self, after: Optional[Tuple] = None, skip: int = 0, limit: int = 10) -> List[Tuple]:
+        start = bisect_right(self.keys, after) if after is not None else 0
+        return self.keys[start + skip:start + skip + limit + 1]
+
+def run(index_class, books: List[Book], imported: List[Book]) -> Tuple[float, float, float]:
+    index = index_class(SORT_KEYS['title'], books)
+    started = time.perf_counter()
+    for book in imported:
+        index.add(book)
+    added = time.perf_counter() - started
+
+    rng = random.Random(1)
+    started = time.perf_counter()
+    for book in rng.sample(imported, min(len(imported), 10_000)):
+        index.remove(book)
+    removed = time.perf_counter() - started
+
+    keys = [index.key(book) for book in rng.sample(books, 1000)]
+    started = time.perf_counter()
+    for key in keys:
+        index.page(key, 0, 20)
+    paged = (time.perf_counter() - started) / len(keys) * 1000
+    return added, removed, paged
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import into a sorted listing: blocked SortedIndex vs one list")
+    parser.add_argument("--books", type=int, default=1_000_000, help="Books already in the catalog")
+    parser.add_argument("--imports", type=int, default=100_000, help="Books added afterwards, one at a time")
+    args = parser.parse_args(argv)
+
+    records = generate_records(args.books + args.imports)
+    books = [Book.from_dict(record) for record in records[:args.books]]
+    imported = [Book.from_dict(record) for record in records[args.books:]]
+    print(f"{'index':<8} {'adds/s':>10} {'removes/s':>10} {'page ms':>8}")
+    for name, index_class in (("legacy", LegacySortedIndex), ("blocked", SortedIndex)):
+        added, removed, paged = run(index_class, books, imported)
+        removes = min(len(imported), 10_000)
+        print(f"{name:<8} {len(imported) / added:>10.0f} {removes / removed:>10.0f} {paged:>8.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Stage2"))
+
+from catalog import generate_records
+from librarys2 import Book
+from search import SearchIndex
+
+def typo(rng: random.Random, text: str) -> str:
+    i = rng.randrange(len(text) - 1)
+    return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latency of prefix and ranked (typo-tolerant) search")
+    parser.add_argument("--books", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(7)
+    books = [Book.from_dict(record) for record in generate_records(args.books)]
+    started = time.perf_counter()
+    index = SearchIndex(books)
+    print(f"index build: {time.perf_counter() - started:.1f}s, {len(index.tokens)} tokens")
+
+    started = time.perf_counter()
+    index.fuzzy_matches("warmup")
+    print(f"trigram build: {time.perf_counter() - started:.1f}s")
+
+    titles = [rng.choice(books).title.lower() for _ in range(args.queries)]
+    queries = {
+        "prefix": [(title.split()[0][:4], False) for title in titles],
+        "ranked": [(title, True) for title in titles],
+        "ranked+typo": [(" ".join(typo(rng, w) if len(w) > 3 else w for w in title.split()), True)
+                        for title in titles],
+    }
+    print(f"{'mode':<12} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, cases in queries.items():
+        samples = []
+        for query, ranked in cases:
+            started = time.perf_counter()
+            if ranked:
+                index.ranked_search(query, 10)
+            else:
+                index.search(query, 10)
+            samples.append((time.perf_counter() - started) * 1000)
+        print(f"{mode:<12} {statistics.median(samples):>8.2f} {percentile(samples, 0.99):>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Stage2"))
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from catalog import generate_records, write_catalog
+from librarys2 import Book, Library
+from snapshot import write_snapshot
+
+def legacy_load(filename: str) -> dict:
+    # The loader Library used before streaming: whole list, then a second pass for availability
+    with open(filename, 'r', encoding='utf-8') as f:
+        books_data = json.load(f)
+        books = {
+            book['isbn']: Book(title=book['title'], authors=book['authors'], isbn=book['isbn'])
+            for book in books_data
+        }
+        for isbn, book_data in zip(books.keys(), books_data):
+            books[isbn].available = book_data.get('available', True)
+    return books
+
+def peak_rss_mib() -> float:
+    if resource is None:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and KiB elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+def run_variant(variant: str, filename: str) -> None:
+    baseline = peak_rss_mib()
+    started = time.perf_counter()
+    if variant == "legacy":
+        count = len(legacy_load(filename))
+    elif variant == "snapshot":
+        lib = Library(filename + ".snap", storage="snapshot")
+        count = len(lib.books)
+        lib.close()
+    else:
+        count = len(Library(filename).books)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({'variant': variant, 'books': count, 'seconds': elapsed,
+                      'peak_rss_mib': peak_rss_mib(), 'baseline_rss_mib': baseline}))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Startup time and peak RSS of loading the catalog")
+    parser.add_argument("--books", type=int, default=500_000)
+    parser.add_argument("--variant", choices=["generate", "legacy", "streaming", "snapshot"], help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.variant == "generate":
+        records = generate_records(args.books)
+        write_catalog(args.file, records)
+        write_snapshot(args.file + ".snap", records)
+        return
+    if args.variant:
+        run_variant(args.variant, args.file)
+        return
+
+    # Every step runs in its own process: Linux keeps ru_maxrss across fork/exec,
+    # so a parent that built the catalog would inflate the children's peaks
+    def child(variant: str, filename: str) -> str:
+        return subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--variant", variant,
+             "--file", filename, "--books", str(args.books)],
+            capture_output=True, text=True, check=True
+        ).stdout
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "library_data.json")
+        child("generate", filename)
+
+        print(f"{'variant':<10} {'seconds':>8} {'peak RSS MiB':>13}")
+        for variant in ("legacy", "streaming", "snapshot"):
+            result = json.loads(child(variant, filename).strip().splitlines()[-1])
+            print(f"{variant:<10} {result['seconds']:>8.2f} {result['peak_rss_mib']:>13.1f}")
+
+if __name__ == "__main__":
+    main()
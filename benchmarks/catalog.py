@@ -0,0 +1,38 @@
+import os
+import random
+import sys
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Stage2"))
+
+from storage import write_json_array
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "tol", "kien", "dor", "an", "sel", "vi", "ra", "thu", "en", "gar", "is", "bel"]
+FIRST_ISBN = 9780000000000
+
+def word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+def generate_records(count: int, seed: int = 42, vocabulary: int = 50_000,
+                     borrowed: float = 0.2) -> List[Dict]:
+    # Titles of one to five words from a fixed vocabulary, so search sees a
+    # realistic mix of shared and rare tokens; about 20 books per author
+    rng = random.Random(seed)
+    words = sorted({word(rng) for _ in range(vocabulary)})
+    authors = [f"{rng.choice(words).title()} {rng.choice(words).title()}" for _ in range(max(1, count // 20))]
+    return [
+        {
+            'title': " ".join(rng.choice(words) for _ in range(rng.randint(1, 5))).title(),
+            'authors': [rng.choice(authors)],
+            'isbn': str(FIRST_ISBN + i),
+            'available': rng.random() >= borrowed,
+        }
+        for i in range(count)
+    ]
+
+def isbn(i: int) -> str:
+    return str(FIRST_ISBN + i)
+
+def write_catalog(path: str, records: List[Dict]) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        write_json_array(f, iter(records))
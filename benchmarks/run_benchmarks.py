@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STAGE2 = os.path.join(HERE, "..", "Stage2")
+STAGE3 = os.path.join(HERE, "..", "Stage3")
+sys.path.insert(0, STAGE2)
+
+from bench_search import percentile, typo
+from bench_startup import peak_rss_mib
+from catalog import generate_records, isbn, write_catalog
+from librarys2 import Library
+
+DEFAULT_BASELINE = os.path.join(HERE, "baseline.json")
+STORAGE_FILES = {"json": "library_data.json", "journal": "library_data.json",
+                 "sqlite": "library_data.db", "snapshot": "library_data.snap"}
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    for suffix, factor in (("k", 1_000), ("m", 1_000_000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+def summarize(samples: List[float], elapsed: float) -> Dict:
+    return {
+        'ops': len(samples),
+        'ops_per_sec': len(samples) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(samples, 0.5) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+    }
+
+def measure(operation: Callable, arguments: Iterable[Tuple]) -> Dict:
+    samples = []
+    started = time.perf_counter()
+    for args in arguments:
+        op_started = time.perf_counter()
+        operation(*args)
+        samples.append(time.perf_counter() - op_started)
+    return summarize(samples, time.perf_counter() - started)
+
+def prepare_catalog(directory: str, size: int, storage: str) -> Tuple[str, List[Dict]]:
+    records = generate_records(size)
+    json_file = os.path.join(directory, "library_data.json")
+    write_catalog(json_file, records)
+    filename = os.path.join(directory, STORAGE_FILES[storage])
+    if storage == "sqlite":
+        from migrate_to_sqlite import migrate
+        migrate(json_file, filename)
+    elif storage == "snapshot":
+        from snapshot import write_snapshot
+        write_snapshot(filename, records)
+    return filename, records
+
+def run_library(size: int, ops: int, storage: str) -> Dict[str, Dict]:
+    rng = random.Random(1)
+    results: Dict[str, Dict] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        filename, records = prepare_catalog(tmp, size, storage)
+        repeats = 3 if size <= 100_000 else 1
+        libraries: List[Library] = []
+
+        def load():
+            if libraries:
+                libraries.pop().close()
+            libraries.append(Library(filename, storage=storage))
+        results['load'] = measure(load, [()] * repeats)
+        lib = libraries[0]
+
+        results['find'] = measure(lib.find_book, [(isbn(rng.randrange(size + size // 10)),) for _ in range(ops)])
+
+        results['search_index'] = measure(lib.search, [("warmup",)])
+        titles = [rng.choice(records)['title'].lower() for _ in range(ops)]
+        results['search_prefix'] = measure(lib.search, [(title.split()[0][:4],) for title in titles])
+        lib.search("warmup", ranked=True)
+        results['search_ranked'] = measure(lib.search, [
+            (" ".join(typo(rng, word) if len(word) > 3 else word for word in title.split()), 10, True)
+            for title in titles
+        ])
+
+        def borrow_or_return(key: str):
+            if "Error" in lib.borrow_book(key):
+                lib.return_book(key)
+        results['borrow_return'] = measure(borrow_or_return, [(isbn(rng.randrange(size)),) for _ in range(ops)])
+
+        results['add'] = measure(lib.add_book, [
+            (f"Benchmark Title {i}", ["Benchmark Author"], isbn(size + i)) for i in range(ops)
+        ])
+        results['save'] = measure(lib.compact, [()] * repeats)
+        lib.close()
+    results['memory'] = {'peak_rss_mib': peak_rss_mib()}
+    return results
+
+def open_library_stub(request):
+    import httpx
+    if request.url.path.startswith("/authors/"):
+        return httpx.Response(200, json={"name": "Stub Author"})
+    key = request.url.path.rsplit("/", 1)[-1].replace(".json", "")
+    return httpx.Response(200, json={"title": f"Stub Title {key}", "authors": [{"key": "/authors/OL1A"}]})
+
+def http_request(rng: random.Random, records: List[Dict], n: int) -> Tuple[str, str, str, Optional[Dict]]:
+    record = rng.choice(records)
+    roll = rng.random()
+    if roll < 0.5:
+        return "http_get_book", "GET", f"/books/{record['isbn']}", None
+    if roll < 0.6:
+        return "http_list", "GET", f"/books?limit=20&sort=title&skip={rng.randrange(100)}", None
+    if roll < 0.7:
+        return "http_search", "GET", f"/books/search?query={record['title'].split()[0][:4]}", None
+    if roll < 0.75:
+        return "http_search_ranked", "GET", f"/books/search?ranked=true&query={record['title'].lower()}", None
+    if roll < 0.95:
+        return "http_borrow", "PUT", f"/books/{record['isbn']}/borrow", None
+    return "http_add_isbn", "POST", "/books/isbn", {"isbn": f"stub-{n}"}
+
+async def drive(app, records: List[Dict], total: int, concurrency: int) -> Dict[str, Dict]:
+    import httpx
+    samples: Dict[str, List[float]] = {}
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker(seed: int):
+        nonlocal errors
+        rng = random.Random(seed)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            for n in counter:
+                kind, method, url, body = http_request(rng, records, n)
+                started = time.perf_counter()
+                response = await client.request(method, url, json=body)
+                if kind == "http_borrow" and response.status_code == 400:
+                    response = await client.put(url.replace("/borrow", "/return"))
+                samples.setdefault(kind, []).append(time.perf_counter() - started)
+                errors += response.status_code >= 500
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(seed) for seed in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    results = {kind: summarize(values, elapsed) for kind, values in samples.items()}
+    results['http_total'] = summarize([value for values in samples.values() for value in values], elapsed)
+    results['http_total']['errors'] = errors
+    return results
+
+def run_http(size: int, requests: int, concurrency: int, storage: str) -> Dict[str, Dict]:
+    with tempfile.TemporaryDirectory() as tmp:
+        _, records = prepare_catalog(tmp, size, storage)
+        os.environ["LIBRARY_DATA_DIR"] = tmp
+        os.environ["LIBRARY_STORAGE"] = storage
+        sys.path.insert(0, STAGE3)
+        import httpx
+        import api
+        from openlibrary import AsyncOpenLibraryClient
+        api.lib.async_client = AsyncOpenLibraryClient(transport=httpx.MockTransport(open_library_stub))
+        try:
+            results = asyncio.run(drive(api.app, records, requests, concurrency))
+        finally:
+            api.lib.close()
+    results['http_memory'] = {'peak_rss_mib': peak_rss_mib()}
+    return results
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    regressions = []
+    print(f"{'benchmark':<34} {'ops/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'RSS MiB':>8} {'baseline':>10} {'change':>8}")
+    for key, current in results.items():
+        base = baseline.get(key)
+        if 'peak_rss_mib' in current:
+            line = f"{key:<34} {'':>10} {'':>8} {'':>8} {current['peak_rss_mib']:>8.1f}"
+            if base:
+                change = current['peak_rss_mib'] / base['peak_rss_mib'] - 1
+                line += f" {base['peak_rss_mib']:>10.1f} {change:>+8.0%}"
+                if change > tolerance:
+                    regressions.append(f"{key}: peak RSS {change:+.0%}")
+            print(line)
+            continue
+        line = f"{key:<34} {current['ops_per_sec']:>10.1f} {current['p50_ms']:>8.3f} {current['p99_ms']:>8.3f} {'':>8}"
+        if base:
+            change = current['ops_per_sec'] / base['ops_per_sec'] - 1 if base['ops_per_sec'] else 0.0
+            line += f" {base['ops_per_sec']:>10.1f} {change:>+8.0%}"
+            if change < -tolerance:
+                regressions.append(f"{key}: throughput {change:+.0%}")
+            if base['p99_ms'] and current['p99_ms'] > base['p99_ms'] * (1 + tolerance) * 2:
+                # p99 is noisy on shared machines, so it only counts when it more than doubles
+                regressions.append(f"{key}: p99 {current['p99_ms']:.3f} ms vs {base['p99_ms']:.3f} ms")
+        print(line)
+    return regressions
+
+def config_mismatch(config: Dict, saved: Dict, skip_http: bool) -> List[str]:
+    # Storage and sizes are part of every result key, so runs that differ there
+    # just have nothing to compare; these settings change the numbers themselves
+    keys = ('ops',) if skip_http else ('ops', 'requests', 'concurrency')
+    return [f"{key} {saved.get(key)} != {config[key]}" for key in keys if saved.get(key) != config[key]]
+
+def run_worker(args) -> Dict[str, Dict]:
+    if args.worker == "library":
+        return run_library(args.size, args.ops, args.storage)
+    return run_http(args.size, args.requests, args.concurrency, args.storage)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Library and API benchmark suite with baseline comparison")
+    parser.add_argument("--sizes", default="1k,10k,100k", help="Catalog sizes, e.g. 1k,10k,100k,1m")
+    parser.add_argument("--ops", type=int, default=1000, help="Operations per micro-benchmark")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests in the HTTP scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent HTTP clients")
+    parser.add_argument("--storage", default="journal", choices=sorted(STORAGE_FILES))
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before flagging a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--output", help="Also write the results as JSON")
+    parser.add_argument("--worker", choices=["library", "http"], help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+
+    config = {'ops': args.ops, 'requests': args.requests, 'concurrency': args.concurrency,
+              'storage': args.storage, 'sizes': sorted(parse_size(size) for size in args.sizes.split(","))}
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        mismatched = config_mismatch(config, saved.get('config', {}), args.skip_http)
+        if mismatched:
+            raise SystemExit(f"Error: {args.baseline} was recorded with a different run config "
+                             f"({', '.join(mismatched)}); use the same options or --save-baseline")
+        baseline = saved['results']
+
+    # Each size and scenario runs in its own process so peak RSS and lazily
+    # built indexes do not leak between them
+    results: Dict[str, Dict] = {}
+    for size in (parse_size(size) for size in args.sizes.split(",")):
+        for worker in ("library",) if args.skip_http else ("library", "http"):
+            command = [sys.executable, os.path.abspath(__file__), "--worker", worker, "--size", str(size),
+                       "--ops", str(args.ops), "--requests", str(args.requests),
+                       "--concurrency", str(args.concurrency), "--storage", args.storage]
+            output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+            for name, result in json.loads(output.strip().splitlines()[-1]).items():
+                results[f"{args.storage}/{size}/{name}"] = result
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': config,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    if regressions:
+        print("\nRegressions against baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()